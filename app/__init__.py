@@ -1,11 +1,14 @@
 from flask import Flask, render_template
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
+from flask_migrate import Migrate
 from config import Config
+from app.db_routing import RoutingSession, configure_engines
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+migrate = Migrate()
 login_manager = LoginManager()
-login_manager.login_view = 'auth.login'
+login_manager.login_view = 'index'
 login_manager.login_message = 'Пожалуйста, войдите для доступа к этой странице.'
 login_manager.login_message_category = 'info'
 
@@ -19,20 +22,35 @@ def load_user(user_id):
 def create_app(config_class=None):
     app = Flask(__name__)
 
-    # Конфигурация
-    if config_class:
-        app.config.from_object(config_class)
-    else:
-        # Конфигурация по умолчанию
-        app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql://postgres:cat@db/nutrition_db'
-        app.config['SECRET_KEY'] = 'dev-secret-key-change-in-production'
-        app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-    # ... остальной код без изменений
-    # Инициализация расширений
+    # Конфигурация (по умолчанию - config.Config из переменных окружения)
+    app.config.from_object(config_class or Config)
+
+    # Инициализация расширений: профиль пула соединений и реплика для чтения
+    configure_engines(app)
     db.init_app(app)
+    migrate.init_app(app, db)
     login_manager.init_app(app)
 
+    from app.cache import solution_cache
+    solution_cache.configure(app.config.get('SOLUTION_CACHE_SIZE'),
+                             app.config.get('SOLUTION_CACHE_TTL'))
+
+    from app.catalog import nutrient_catalog
+    nutrient_catalog.configure(app.config.get('NUTRIENT_CATALOG_TTL'))
+
+    from app.recipe_index import recipe_index
+    recipe_index.configure(app.config.get('RECIPE_INDEX_TTL'))
+
+    from app.recipe_search import recipe_search
+    recipe_search.configure(app.config.get('RECIPE_SEARCH_TTL'))
+
+    from app.pagination import list_counts
+    list_counts.configure(app.config.get('LIST_COUNT_TTL'),
+                          app.config.get('LIST_EXACT_COUNT_LIMIT'))
+
+    from app.telemetry import solver_telemetry
+    solver_telemetry.configure(app.config.get('SOLVER_TELEMETRY_SIZE'))
+
     # Регистрация Blueprints
     from app.auth import bp as auth_bp
     app.register_blueprint(auth_bp, url_prefix='/auth')
@@ -48,8 +66,6 @@ def create_app(config_class=None):
     def index():
         return render_template('index.html')
 
-    # Создание таблиц при первом запуске
-    with app.app_context():
-        db.create_all()
-
+    # Схема базы - миграции (flask db upgrade), при запуске приложения
+    # таблицы не создаются и не заполняются
     return app
\ No newline at end of file
@@ -1,9 +1,17 @@
-from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for
+from flask import (Blueprint, Response, render_template, request, jsonify, flash, redirect, url_for,
+                   abort, current_app, stream_with_context)
 from flask_login import login_required, current_user
-from sqlalchemy import or_
+from sqlalchemy import or_, func
+from sqlalchemy.orm import joinedload
 from app import db
-from app.models import Ingredient, Recipe, User
+from app.models import Ingredient, Recipe, RecipeTotals, User, Nutrient
 from app.forms import IngredientForm, RecipeForm
+from app.cache import solution_cache
+from app.pagination import keyset_paginate, InvalidCursor
+from app.db_routing import replica_reads
+from app.telemetry import solver_telemetry
+from app.bulk import (BulkImportError, CONTENT_TYPES, export_ingredients, export_recipes, file_format,
+                      import_ingredients, import_recipes)
 
 bp = Blueprint('admin', __name__)
 
@@ -21,8 +29,8 @@ def admin_required(f):
 @bp.route('/ingredients')
 @login_required
 @admin_required
+@replica_reads
 def ingredients():
-    page = request.args.get('page', 1, type=int)
     per_page = 50
     
     query = Ingredient.query
@@ -44,22 +52,24 @@ def ingredients():
     sort_order = request.args.get('sort_order', 'asc')
     
     sort_mapping = {
+        'name': Ingredient.name,
         'calories': Ingredient.calories,
         'proteins': Ingredient.proteins,
         'fats': Ingredient.fats,
         'carbs': Ingredient.carbs,
         'created_at': Ingredient.created_at
     }
+    if sort_by not in sort_mapping:
+        sort_by = 'name'
     
-    if sort_by in sort_mapping:
-        if sort_order == 'desc':
-            query = query.order_by(sort_mapping[sort_by].desc())
-        else:
-            query = query.order_by(sort_mapping[sort_by])
-    else:
-        query = query.order_by(Ingredient.name)
-    
-    ingredients = query.paginate(page=page, per_page=per_page, error_out=False)
+    # Страница по курсору (сортировка + id), число записей - из кэша или оценка
+    try:
+        ingredients = keyset_paginate(query, (sort_mapping[sort_by], Ingredient.id),
+                                      cursor=request.args.get('cursor'), per_page=per_page,
+                                      descending=sort_order == 'desc', sort=sort_by,
+                                      count_key=('admin_ingredients', search, filter_type))
+    except InvalidCursor:
+        abort(400)
     
     form = IngredientForm()
     
@@ -69,21 +79,24 @@ def ingredients():
                          search=search,
                          sort_by=sort_by,
                          sort_order=sort_order,
-                         filter_type=filter_type)
+                         filter_type=filter_type,
+                         page_args={k: v for k, v in request.args.items() if k not in ('cursor', 'page')})
 
 @bp.route('/recipes')
 @login_required
 @admin_required
+@replica_reads
 def recipes():
-    page = request.args.get('page', 1, type=int)
     per_page = 20
     
-    query = Recipe.query
+    query = Recipe.query.options(joinedload(Recipe.creator))
     
-    # Поиск
+    # Полнотекстовый поиск
     search = request.args.get('search', '').strip()
+    rank = None
     if search:
-        query = query.filter(Recipe.name.ilike(f'%{search}%'))
+        criterion, rank, _ = Recipe.text_search(search)
+        query = query.filter(criterion)
     
     # Фильтр по типу
     filter_type = request.args.get('filter', 'all')
@@ -92,9 +105,41 @@ def recipes():
     elif filter_type == 'private':
         query = query.filter(Recipe.is_public == False)
     
-    recipes = query.order_by(Recipe.created_at.desc()).paginate(
-        page=page, per_page=per_page, error_out=False
-    )
+    # Диапазоны КБЖУ
+    query, ranges = RecipeTotals.filter_query(query, request.args)
+    
+    # Сортировка
+    sort_by = request.args.get('sort_by', 'relevance' if rank is not None else 'created_at')
+    sort_order = request.args.get('sort_order', 'desc')
+    
+    # Итоги присоединены внешним соединением: у рецепта без строки итогов они
+    # NULL и выпали бы из сравнения с курсором - считаем их нулём
+    sort_mapping = {
+        'calories': func.coalesce(RecipeTotals.calories, 0.0),
+        'proteins': func.coalesce(RecipeTotals.proteins, 0.0),
+        'fats': func.coalesce(RecipeTotals.fats, 0.0),
+        'carbs': func.coalesce(RecipeTotals.carbs, 0.0),
+        'weight': func.coalesce(RecipeTotals.weight, 0.0),
+        'created_at': Recipe.created_at
+    }
+    
+    if sort_by == 'relevance' and rank is not None:
+        sort_column, sort_order = rank, 'desc'
+    else:
+        if sort_by not in sort_mapping:
+            sort_by = 'created_at'
+        sort_column = sort_mapping[sort_by]
+    
+    try:
+        recipes = keyset_paginate(query, (sort_column, Recipe.id),
+                                  cursor=request.args.get('cursor'), per_page=per_page,
+                                  descending=sort_order != 'asc', sort=sort_by,
+                                  count_key=('admin_recipes', search, filter_type,
+                                             tuple(sorted(ranges.items()))))
+    except InvalidCursor:
+        abort(400)
+    snippets = Recipe.snippets([recipe.id for recipe in recipes.items], search)
+    summaries = Recipe.summaries([recipe.id for recipe in recipes.items], names=2)
     
     form = RecipeForm()
     
@@ -102,7 +147,13 @@ def recipes():
                          recipes=recipes,
                          form=form,
                          search=search,
-                         filter_type=filter_type)
+                         snippets=snippets,
+                         summaries=summaries,
+                         filter_type=filter_type,
+                         ranges=ranges,
+                         sort_by=sort_by,
+                         sort_order=sort_order,
+                         page_args={k: v for k, v in request.args.items() if k not in ('cursor', 'page')})
 
 @bp.route('/api/ingredient/toggle-public/<int:id>', methods=['POST'])
 @login_required
@@ -111,6 +162,7 @@ def toggle_ingredient_public(id):
     ingredient = Ingredient.query.get_or_404(id)
     ingredient.is_public = not ingredient.is_public
     db.session.commit()
+    solution_cache.invalidate_ingredients([id])
     
     return jsonify({
         'success': True,
@@ -128,4 +180,142 @@ def toggle_recipe_public(id):
     return jsonify({
         'success': True,
         'is_public': recipe.is_public
-    })
\ No newline at end of file
+    })
+
+@bp.route('/api/cache-stats')
+@login_required
+@admin_required
+def cache_stats():
+    """Счётчики кэша решений оптимизатора"""
+    return jsonify({
+        'success': True,
+        'solution_cache': solution_cache.stats()
+    })
+
+@bp.route('/api/solver-stats')
+@login_required
+@admin_required
+def solver_stats():
+    """Замеры оптимизатора: сводка по группам задач и последние расчёты"""
+    limit = min(request.args.get('limit', 50, type=int), 500)
+    return jsonify({
+        'success': True,
+        'summary': solver_telemetry.summary(),
+        'recent': solver_telemetry.recent(limit)
+    })
+
+@bp.route('/api/nutrients', methods=['GET'])
+@login_required
+@admin_required
+def list_nutrients():
+    """Список дополнительных нутриентов"""
+    nutrients = Nutrient.query.order_by(Nutrient.position, Nutrient.id).all()
+    return jsonify([nutrient.to_dict() for nutrient in nutrients])
+
+@bp.route('/api/nutrients', methods=['POST'])
+@login_required
+@admin_required
+def add_nutrient():
+    """Добавить дополнительный нутриент (клетчатка, сахар, натрий...)"""
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({'success': False, 'message': 'Требуется JSON'}), 400
+
+    key = (data.get('key') or '').strip().lower()
+    name = (data.get('name') or '').strip()
+    if not key.isidentifier() or not name:
+        return jsonify({'success': False, 'message': 'Укажите ключ (латиница) и название'}), 400
+
+    if key in ('calories', 'proteins', 'fats', 'carbs') or Nutrient.query.filter_by(key=key).first():
+        return jsonify({'success': False, 'message': 'Такой нутриент уже есть'}), 400
+
+    try:
+        nutrient = Nutrient(key=key, name=name, unit=(data.get('unit') or 'г').strip(),
+                            position=int(data.get('position', 0)))
+    except (TypeError, ValueError) as e:
+        return jsonify({'success': False, 'message': f'Неверный формат данных: {str(e)}'}), 400
+
+    db.session.add(nutrient)
+    db.session.commit()
+
+    return jsonify({'success': True, 'nutrient': nutrient.to_dict()})
+
+@bp.route('/api/nutrients/<int:id>', methods=['DELETE'])
+@login_required
+@admin_required
+def delete_nutrient(id):
+    """Удалить нутриент (значения у ингредиентов перестают учитываться)"""
+    nutrient = Nutrient.query.get_or_404(id)
+    db.session.delete(nutrient)
+    db.session.commit()
+
+    return jsonify({'success': True})
+
+_IMPORTERS = {'ingredients': import_ingredients, 'recipes': import_recipes}
+_EXPORTERS = {'ingredients': (Ingredient, export_ingredients), 'recipes': (Recipe, export_recipes)}
+
+@bp.route('/api/import/<kind>', methods=['POST'])
+@login_required
+@admin_required
+def bulk_import(kind):
+    """
+    Импорт ингредиентов или рецептов из файла CSV/JSONL (поле file)
+
+    Записи добавляются администратору; format - формат, если его не видно
+    по расширению, is_public - видимость строк без своего is_public.
+    Неверные строки пропускаются и возвращаются в errors.
+    """
+    if kind not in _IMPORTERS:
+        abort(404)
+
+    upload = request.files.get('file')
+    if upload is None or not upload.filename:
+        return jsonify({'success': False, 'message': 'Выберите файл'}), 400
+
+    try:
+        fmt = file_format(upload.filename, request.form.get('format'))
+        report = _IMPORTERS[kind](upload.stream, fmt, current_user.id,
+                                  is_public=request.form.get('is_public') in ('1', 'true', 'on'))
+        db.session.commit()
+    except (BulkImportError, UnicodeDecodeError) as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': f'Файл не импортирован: {str(e)}'}), 400
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.exception('Ошибка импорта %s', kind)
+        return jsonify({'success': False, 'message': f'Ошибка: {str(e)}'}), 500
+
+    return jsonify({'success': True, **report.to_dict()})
+
+@bp.route('/api/export/<kind>')
+@login_required
+@admin_required
+def bulk_export(kind):
+    """
+    Потоковая выгрузка всех ингредиентов или рецептов (format=csv|jsonl,
+    filter=public|private) - файл передаётся порциями по мере чтения из базы
+    """
+    if kind not in _EXPORTERS:
+        abort(404)
+    model, export = _EXPORTERS[kind]
+
+    fmt = request.args.get('format', 'csv')
+    if fmt not in CONTENT_TYPES:
+        return jsonify({'success': False, 'message': 'Формат выгрузки: csv или jsonl'}), 400
+
+    condition = None
+    filter_type = request.args.get('filter', 'all')
+    if filter_type == 'public':
+        condition = model.is_public == True
+    elif filter_type == 'private':
+        condition = model.is_public == False
+
+    def generate():
+        # Генератор выполняется после возврата из обработчика: чтение с
+        # реплики включается здесь, а не декоратором
+        with replica_reads():
+            yield from export(fmt, condition)
+
+    return Response(stream_with_context(generate()), content_type=CONTENT_TYPES[fmt], headers={
+        'Content-Disposition': f'attachment; filename={kind}.{fmt}'
+    })
@@ -0,0 +1,696 @@
+import csv
+import io
+import json
+import tempfile
+from datetime import datetime
+from itertools import groupby
+from sqlalchemy import (Boolean, Column, Float, Integer, JSON, MetaData, String, Table, Text,
+                        and_, exists, func, literal, or_, select)
+from app import db
+from app.models import (Ingredient, IngredientNutrientValues, Nutrient, Recipe, RecipeIngredient,
+                        RecipeTotals, recipe_ingredients)
+from app.cache import solution_cache
+
+# Форматы файлов импорта и выгрузки
+BULK_FORMATS = ('csv', 'jsonl')
+CONTENT_TYPES = {'csv': 'text/csv; charset=utf-8', 'jsonl': 'application/x-ndjson; charset=utf-8'}
+
+# Столбцы CSV (и ключи JSONL). Дополнительные нутриенты ингредиента в CSV -
+# столбцы с ключами Nutrient, в JSONL - объект extra_nutrients
+INGREDIENT_FIELDS = ('name', 'calories', 'proteins', 'fats', 'carbs', 'is_public')
+RECIPE_FIELDS = ('name', 'description', 'instructions', 'image_url', 'is_public')
+# Строка CSV рецепта - одна строка состава; строки подряд с одним названием - один рецепт
+RECIPE_ITEM_FIELDS = ('ingredient', 'ingredient_id', 'amount')
+
+# Сколько ошибок строк возвращать в отчёте (считаются все)
+MAX_REPORTED_ERRORS = 100
+# Сколько строк промежуточной таблицы держать в памяти до записи на диск
+# (COPY) или до вставки пачкой (другие драйверы и базы)
+STAGE_SPOOL_BYTES = 8 * 1024 * 1024
+STAGE_BATCH_ROWS = 1000
+# Строк выгрузки на одно чтение из курсора и на одну порцию ответа
+EXPORT_BATCH_ROWS = 1000
+
+# Столбцы CSV, которых может не быть в файле (ингредиент состава - по
+# названию или по id)
+_OPTIONAL_FIELDS = {'is_public', 'description', 'image_url', 'ingredient', 'ingredient_id'}
+
+_TRUE = {'1', 'true', 'yes', 'да', 'y'}
+_FALSE = {'0', 'false', 'no', 'нет', 'n'}
+
+# Промежуточные таблицы импорта: временные, вне db.metadata (create_all их
+# не создаёт), в PostgreSQL удаляются и при коммите
+_staging = MetaData()
+
+stage_ingredient = Table(
+    'stage_ingredient', _staging,
+    Column('line', Integer, nullable=False),
+    Column('name', String(100), nullable=False),
+    Column('calories', Float, nullable=False),
+    Column('proteins', Float, nullable=False),
+    Column('fats', Float, nullable=False),
+    Column('carbs', Float, nullable=False),
+    Column('is_public', Boolean, nullable=False),
+    Column('extra', JSON),
+    prefixes=['TEMPORARY'], postgresql_on_commit='DROP'
+)
+
+stage_recipe = Table(
+    'stage_recipe', _staging,
+    Column('line', Integer, nullable=False),
+    Column('name', String(200), nullable=False),
+    Column('description', Text),
+    Column('instructions', Text, nullable=False),
+    Column('image_url', String(500)),
+    Column('is_public', Boolean, nullable=False),
+    prefixes=['TEMPORARY'], postgresql_on_commit='DROP'
+)
+
+stage_recipe_item = Table(
+    'stage_recipe_item', _staging,
+    Column('line', Integer, nullable=False),
+    Column('recipe_line', Integer, nullable=False),
+    Column('ingredient_id', Integer),
+    Column('ingredient', String(100)),
+    Column('amount', Integer, nullable=False),
+    prefixes=['TEMPORARY'], postgresql_on_commit='DROP'
+)
+
+
+class BulkImportError(ValueError):
+    """Файл нельзя импортировать целиком (формат, заголовок)"""
+
+
+class ImportReport:
+    """Итог импорта: добавлено, обновлено и ошибки строк (номер строки файла, текст)"""
+
+    def __init__(self):
+        self.inserted = 0
+        self.updated = 0
+        self.errors = []
+        self.errors_total = 0
+
+    def error(self, line, message):
+        self.errors_total += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'message': message})
+
+    def to_dict(self):
+        return {
+            'inserted': self.inserted,
+            'updated': self.updated,
+            'errors': sorted(self.errors, key=lambda error: error['line']),
+            'errors_total': self.errors_total
+        }
+
+
+def file_format(filename, requested=None):
+    """
+    Формат файла: явно заданный или по расширению имени
+
+    Raises:
+        BulkImportError: формат не из BULK_FORMATS
+    """
+    fmt = requested or (filename.rsplit('.', 1)[-1] if filename and '.' in filename else '')
+    fmt = fmt.lower()
+    if fmt == 'ndjson':
+        fmt = 'jsonl'
+    if fmt not in BULK_FORMATS:
+        raise BulkImportError('Формат файла должен быть CSV или JSONL')
+    return fmt
+
+
+# --- Импорт ---
+
+def import_ingredients(stream, fmt, user_id, is_public=False):
+    """
+    Импорт ингредиентов пользователя user_id из файла CSV/JSONL
+
+    Строки проверяются по одной, верные загружаются в промежуточную таблицу
+    (в PostgreSQL - COPY) и сливаются с каталогом запросами по множеству:
+    ингредиент пользователя с тем же названием (в PostgreSQL - без учёта
+    регистра)
+    обновляется, остальные добавляются. Неверные строки пропускаются и
+    попадают в отчёт. Коммит - за вызывающим кодом.
+
+    Args:
+        stream: двоичный поток файла
+        fmt: формат из BULK_FORMATS
+        is_public: видимость строк без is_public
+
+    Raises:
+        BulkImportError: неизвестные столбцы CSV или нет обязательных
+    """
+    report = ImportReport()
+    keys = [nutrient.key for nutrient in Nutrient.query.order_by(Nutrient.position, Nutrient.id)]
+    connection = db.session.connection()
+    _create_staging(connection, stage_ingredient)
+
+    names = {}
+    with _StageWriter(connection, stage_ingredient) as writer:
+        for line, record in _records(stream, fmt, report, INGREDIENT_FIELDS, keys):
+            try:
+                row = _ingredient_row(record, keys, is_public)
+            except ValueError as e:
+                report.error(line, str(e))
+                continue
+            first = names.setdefault(row['name'].lower(), line)
+            if first != line:
+                report.error(line, f'Ингредиент «{row["name"]}» уже есть в файле (строка {first})')
+                continue
+            writer.add(line=line, **row)
+
+    _merge_ingredients(user_id, report)
+    stage_ingredient.drop(connection)
+    return report
+
+
+def import_recipes(stream, fmt, user_id, is_public=False):
+    """
+    Импорт рецептов пользователя user_id с составом из файла CSV/JSONL
+
+    Ингредиент состава задаётся названием (ingredient) или id (ingredient_id):
+    среди общих и ингредиентов пользователя, название важнее id. Рецепт
+    пользователя с тем же названием обновляется, его состав заменяется;
+    рецепт с ненайденным ингредиентом пропускается целиком. Итоги КБЖУ
+    пересчитываются одним запросом. Коммит - за вызывающим кодом.
+
+    Raises:
+        BulkImportError: неизвестные столбцы CSV или нет обязательных
+    """
+    report = ImportReport()
+    connection = db.session.connection()
+    _create_staging(connection, stage_recipe, stage_recipe_item)
+
+    names = {}
+    with _StageWriter(connection, stage_recipe) as recipes, \
+            _StageWriter(connection, stage_recipe_item) as items:
+        for line, record, item_records in _recipe_records(stream, fmt, report):
+            try:
+                row = _recipe_row(record, is_public)
+            except ValueError as e:
+                report.error(line, str(e))
+                continue
+            item_rows, failed = [], False
+            for item_line, item in item_records:
+                try:
+                    item_rows.append((item_line, _recipe_item_row(item)))
+                except ValueError as e:
+                    report.error(item_line, str(e))
+                    failed = True
+            if failed:
+                continue
+            if not item_rows:
+                report.error(line, f'В рецепте «{row["name"]}» нет ингредиентов')
+                continue
+            first = names.setdefault(row['name'].lower(), line)
+            if first != line:
+                report.error(line, f'Рецепт «{row["name"]}» уже есть в файле (строка {first})')
+                continue
+            recipes.add(line=line, **row)
+            for item_line, item in item_rows:
+                items.add(line=item_line, recipe_line=line, **item)
+
+    _merge_recipes(user_id, report)
+    stage_recipe_item.drop(connection)
+    stage_recipe.drop(connection)
+    return report
+
+
+def _records(stream, fmt, report, fields, extra_keys=()):
+    """Записи файла: (номер строки, словарь); строки, которые нельзя разобрать, - в отчёт"""
+    text_stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        reader = csv.DictReader(text_stream)
+        header = reader.fieldnames or []
+        missing = [field for field in fields if field not in header and field not in _OPTIONAL_FIELDS]
+        unknown = [field for field in header if field not in fields and field not in extra_keys]
+        if missing:
+            raise BulkImportError(f'Нет столбцов: {", ".join(missing)}')
+        if unknown:
+            raise BulkImportError(f'Неизвестные столбцы: {", ".join(unknown)}')
+        nutrient_columns = [key for key in header if key in extra_keys]
+        for record in reader:
+            if None in record:
+                report.error(reader.line_num, 'Лишние значения в строке')
+                continue
+            if nutrient_columns:
+                record['extra_nutrients'] = {key: record.pop(key) for key in nutrient_columns}
+            yield reader.line_num, record
+        return
+
+    for line, raw in enumerate(text_stream, start=1):
+        if not raw.strip():
+            continue
+        try:
+            record = json.loads(raw)
+        except ValueError:
+            report.error(line, 'Некорректный JSON')
+            continue
+        if not isinstance(record, dict):
+            report.error(line, 'Строка должна быть объектом JSON')
+            continue
+        yield line, record
+
+
+def _recipe_records(stream, fmt, report):
+    """Рецепты файла: (строка, поля рецепта, [(строка, поля состава)])"""
+    if fmt == 'jsonl':
+        for line, record in _records(stream, fmt, report, RECIPE_FIELDS):
+            items = record.get('ingredients') or []
+            if not isinstance(items, list):
+                report.error(line, 'ingredients должен быть списком')
+                continue
+            yield line, record, [(line, item) for item in items]
+        return
+
+    # CSV: строки подряд с одним названием - состав одного рецепта, поля
+    # рецепта берутся из первой. Строка с тем же названием, но другими полями
+    # рецепта - начало другого рецепта (import_recipes сообщит о повторе
+    # названия), а не продолжение состава
+    block = []
+    for line, record in _records(stream, fmt, report, RECIPE_FIELDS + RECIPE_ITEM_FIELDS):
+        if block and not _same_recipe(block[0][1], record):
+            yield _csv_recipe(block)
+            block = []
+        block.append((line, record))
+    if block:
+        yield _csv_recipe(block)
+
+
+def _same_recipe(first, record):
+    """Строка CSV продолжает рецепт first: то же название, остальные поля пусты или те же"""
+    def value(row, field):
+        return (row.get(field) or '').strip()
+
+    if value(record, 'name') != value(first, 'name'):
+        return False
+    return all(not value(record, field) or value(record, field) == value(first, field)
+               for field in RECIPE_FIELDS[1:])
+
+
+def _csv_recipe(block):
+    line, record = block[0]
+    return line, record, [(item_line, item) for item_line, item in block
+                          if any(item.get(field) for field in RECIPE_ITEM_FIELDS)]
+
+
+def _text(record, field, limit, required=False):
+    value = record.get(field)
+    value = '' if value is None else str(value).strip()
+    if required and not value:
+        raise ValueError(f'Не заполнено поле {field}')
+    if len(value) > limit:
+        raise ValueError(f'Поле {field} длиннее {limit} символов')
+    return value or None
+
+
+def _number(record, field, required=True):
+    value = record.get(field)
+    if value is None or value == '':
+        if required:
+            raise ValueError(f'Не заполнено поле {field}')
+        return None
+    try:
+        number = float(str(value).replace(',', '.')) if isinstance(value, str) else float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'Поле {field} должно быть числом')
+    if not number >= 0 or number == float('inf'):
+        raise ValueError(f'Поле {field} должно быть неотрицательным числом')
+    return number
+
+
+def _flag(record, field, default):
+    value = record.get(field)
+    if value is None or value == '':
+        return default
+    if isinstance(value, bool):
+        return value
+    value = str(value).strip().lower()
+    if value in _TRUE:
+        return True
+    if value in _FALSE:
+        return False
+    raise ValueError(f'Поле {field} должно быть да/нет')
+
+
+def _ingredient_row(record, keys, is_public):
+    row = {
+        'name': _text(record, 'name', 100, required=True),
+        'calories': _number(record, 'calories'),
+        'proteins': _number(record, 'proteins'),
+        'fats': _number(record, 'fats'),
+        'carbs': _number(record, 'carbs'),
+        'is_public': _flag(record, 'is_public', is_public),
+        'extra': None
+    }
+    extra = record.get('extra_nutrients')
+    if extra is not None:
+        if not isinstance(extra, dict):
+            raise ValueError('extra_nutrients должен быть объектом')
+        unknown = [key for key in extra if key not in keys]
+        if unknown:
+            raise ValueError(f'Неизвестные нутриенты: {", ".join(unknown)}')
+        # Нулевые значения не хранятся (как Ingredient.set_extra_nutrients)
+        values = {key: _number(extra, key, required=False) for key in extra}
+        row['extra'] = {key: value for key, value in values.items() if value}
+    return row
+
+
+def _recipe_row(record, is_public):
+    return {
+        'name': _text(record, 'name', 200, required=True),
+        'description': _text(record, 'description', 100000),
+        'instructions': _text(record, 'instructions', 100000, required=True),
+        'image_url': _text(record, 'image_url', 500),
+        'is_public': _flag(record, 'is_public', is_public)
+    }
+
+
+def _recipe_item_row(item):
+    if not isinstance(item, dict):
+        raise ValueError('Ингредиент состава должен быть объектом')
+    name = _text(item, 'ingredient', 100)
+    ingredient_id = None
+    if name is None:
+        try:
+            ingredient_id = int(item.get('ingredient_id') or 0)
+        except (TypeError, ValueError):
+            ingredient_id = 0
+        if ingredient_id <= 0:
+            raise ValueError('Ингредиент состава задаётся названием или id')
+    # Граммы в составе целые (recipe_ingredients.amount_grams)
+    amount = round(_number(item, 'amount'))
+    if amount <= 0:
+        raise ValueError('Количество ингредиента должно быть больше нуля')
+    return {'ingredient': name, 'ingredient_id': ingredient_id, 'amount': amount}
+
+
+def _create_staging(connection, *tables):
+    for table in tables:
+        table.drop(connection, checkfirst=True)
+        table.create(connection)
+
+
+class _StageWriter:
+    """
+    Запись строк в промежуточную таблицу
+
+    PostgreSQL (psycopg2 и psycopg 3): строки пишутся в CSV (в памяти, сверх
+    STAGE_SPOOL_BYTES - во временный файл) и загружаются одним COPY при
+    закрытии. Другие базы - вставка пачками по STAGE_BATCH_ROWS строк.
+    """
+
+    def __init__(self, connection, table):
+        self.connection = connection
+        self.table = table
+        self.columns = [column.name for column in table.columns]
+        self.rows = []
+        self.buffer = self.writer = None
+
+        cursor = connection.connection.dbapi_connection.cursor()
+        if hasattr(cursor, 'copy_expert') or hasattr(cursor, 'copy'):
+            self.cursor = cursor
+            self.buffer = tempfile.SpooledTemporaryFile(max_size=STAGE_SPOOL_BYTES, mode='w+',
+                                                        encoding='utf-8', newline='')
+            self.writer = csv.writer(self.buffer)
+        else:
+            cursor.close()
+
+    def add(self, **row):
+        if self.writer is None:
+            self.rows.append(row)
+            if len(self.rows) >= STAGE_BATCH_ROWS:
+                self._insert()
+            return
+        # Пустое значение без кавычек в COPY CSV - NULL
+        self.writer.writerow([_copy_value(row.get(column)) for column in self.columns])
+
+    def _insert(self):
+        if self.rows:
+            self.connection.execute(self.table.insert(), self.rows)
+            self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.writer is None:
+            if exc_type is None:
+                self._insert()
+            return False
+        try:
+            if exc_type is None:
+                self.buffer.seek(0)
+                sql = f'COPY {self.table.name} ({", ".join(self.columns)}) FROM STDIN WITH (FORMAT csv)'
+                if hasattr(self.cursor, 'copy_expert'):
+                    self.cursor.copy_expert(sql, self.buffer)
+                else:
+                    with self.cursor.copy(sql) as copy:
+                        for chunk in iter(lambda: self.buffer.read(64 * 1024), ''):
+                            copy.write(chunk)
+        finally:
+            self.buffer.close()
+            self.cursor.close()
+        return False
+
+
+def _copy_value(value):
+    if value is None:
+        return None
+    if isinstance(value, dict):
+        return json.dumps(value, ensure_ascii=False)
+    if isinstance(value, str) and value == '':
+        return None
+    return value
+
+
+def _merge_ingredients(user_id, report):
+    """Слить промежуточную таблицу с ингредиентами пользователя"""
+    s = stage_ingredient.c
+    same_name = and_(Ingredient.user_id == user_id, func.lower(Ingredient.name) == func.lower(s.name))
+    session = db.session
+
+    updated_ids = list(session.execute(
+        select(Ingredient.id).join(stage_ingredient, same_name)
+    ).scalars())
+    if updated_ids:
+        session.execute(
+            Ingredient.__table__.update()
+            .where(Ingredient.__table__.c.user_id == user_id,
+                   func.lower(Ingredient.__table__.c.name) == func.lower(s.name))
+            .values(calories=s.calories, proteins=s.proteins, fats=s.fats, carbs=s.carbs,
+                    is_public=s.is_public)
+        )
+
+    result = session.execute(Ingredient.__table__.insert().from_select(
+        ['name', 'calories', 'proteins', 'fats', 'carbs', 'is_public', 'user_id', 'created_at'],
+        select(s.name, s.calories, s.proteins, s.fats, s.carbs, s.is_public,
+               literal(user_id, Integer), literal(datetime.utcnow(), db.DateTime))
+        .where(~exists().where(same_name)).order_by(s.line)
+    ))
+    report.inserted = max(result.rowcount, 0)
+    report.updated = len(updated_ids)
+
+    # Дополнительные нутриенты заменяются у строк, где они заданы
+    with_extra = select(Ingredient.id, s.extra).join(stage_ingredient, same_name) \
+        .where(s.extra.isnot(None))
+    values = IngredientNutrientValues.__table__
+    session.execute(values.delete().where(
+        values.c.ingredient_id.in_(select(with_extra.subquery().c.id))
+    ))
+    session.execute(values.insert().from_select(['ingredient_id', 'values'], with_extra))
+
+    # Запись в обход ORM: сбросить кэши, как это сделали бы события моделей
+    if report.inserted or updated_ids:
+        _changed(session, catalog=True, lists=True, user_id=user_id)
+    if updated_ids:
+        solution_cache.invalidate_ingredients(updated_ids)
+        RecipeTotals.refresh(ingredient_ids=updated_ids)
+
+
+def _merge_recipes(user_id, report):
+    """Найти ингредиенты состава и слить рецепты с рецептами пользователя"""
+    s, i = stage_recipe.c, stage_recipe_item.c
+    session = db.session
+    visible = or_(Ingredient.is_public == True, Ingredient.user_id == user_id)
+
+    # Ингредиент по названию (при нескольких видимых - с меньшим id) или по id
+    by_name = select(func.min(Ingredient.id)).where(
+        visible, func.lower(Ingredient.name) == func.lower(i.ingredient)
+    ).scalar_subquery()
+    session.execute(stage_recipe_item.update().where(i.ingredient.isnot(None))
+                    .values(ingredient_id=by_name))
+    unresolved = session.execute(
+        select(i.line, i.recipe_line, i.ingredient, i.ingredient_id).where(or_(
+            i.ingredient_id.is_(None),
+            ~exists().where(Ingredient.id == i.ingredient_id, visible)
+        )).order_by(i.line)
+    ).all()
+    for line, recipe_line, name, ingredient_id in unresolved:
+        report.error(line, f'Ингредиент «{name or ingredient_id}» не найден')
+    bad_recipes = {row.recipe_line for row in unresolved}
+    if bad_recipes:
+        session.execute(stage_recipe.delete().where(s.line.in_(bad_recipes)))
+
+    recipe = Recipe.__table__
+    same_name = and_(recipe.c.user_id == user_id, func.lower(recipe.c.name) == func.lower(s.name))
+    updated_ids = list(session.execute(select(recipe.c.id).join(stage_recipe, same_name)).scalars())
+    # Состав из файла: повторы ингредиента в рецепте складываются
+    amounts = (select(recipe.c.id, i.ingredient_id, func.sum(i.amount))
+               .select_from(stage_recipe)
+               .join(recipe, same_name)
+               .join(stage_recipe_item, i.recipe_line == s.line)
+               .group_by(recipe.c.id, i.ingredient_id))
+
+    if updated_ids:
+        session.execute(recipe.update().where(same_name).values(
+            description=s.description, instructions=s.instructions, image_url=s.image_url,
+            is_public=s.is_public
+        ))
+        # Состав существующих рецептов - разницей с текущим: строки без
+        # изменений не переписываются
+        new_amounts = {recipe_id: {} for recipe_id in updated_ids}
+        for recipe_id, ingredient_id, grams in session.execute(amounts.where(
+                recipe.c.id.in_(updated_ids))):
+            new_amounts[recipe_id][ingredient_id] = grams
+        for existing in Recipe.query.filter(Recipe.id.in_(updated_ids)).order_by(Recipe.id):
+            RecipeIngredient.write_amounts(existing, new_amounts[existing.id])
+
+    result = session.execute(recipe.insert().from_select(
+        ['name', 'description', 'instructions', 'image_url', 'is_public', 'user_id', 'created_at'],
+        select(s.name, s.description, s.instructions, s.image_url, s.is_public,
+               literal(user_id, Integer), literal(datetime.utcnow(), db.DateTime))
+        .where(~exists().where(same_name)).order_by(s.line)
+    ))
+    report.inserted = max(result.rowcount, 0)
+    report.updated = len(updated_ids)
+
+    # Состав новых рецептов - одним INSERT ... SELECT
+    session.execute(recipe_ingredients.insert().from_select(
+        ['recipe_id', 'ingredient_id', 'amount_grams'],
+        amounts.where(recipe.c.id.notin_(updated_ids)) if updated_ids else amounts
+    ))
+
+    recipe_ids = list(session.execute(select(recipe.c.id).join(stage_recipe, same_name)).scalars())
+    if recipe_ids:
+        RecipeTotals.refresh(recipe_ids)
+        _changed(session, recipes=True, lists=True, user_id=user_id)
+
+
+def _changed(session, user_id, catalog=False, recipes=False, lists=False):
+    """
+    Отметить в сессии изменения, сделанные запросами по множеству: кэши
+    каталога КБЖУ, индекса рецептов и числа записей списков сбрасываются
+    после коммита теми же обработчиками, что и при изменении моделей
+    """
+    for key, enabled in (('catalog_invalidate', catalog), ('recipe_index_invalidate', recipes)):
+        if enabled:
+            pending = session.info.setdefault(key, [False, set()])
+            pending[0] = True
+            pending[1].add(user_id)
+    if lists:
+        session.info['list_counts_changed'] = True
+
+
+# --- Выгрузка ---
+
+def export_ingredients(fmt, condition=None):
+    """
+    Выгрузка ингредиентов порциями строк (генератор для потокового ответа)
+
+    Строки читаются курсором по EXPORT_BATCH_ROWS (в PostgreSQL - на
+    стороне сервера), в памяти процесса - только текущая порция. Формат
+    тот же, что у импорта.
+    """
+    keys = [nutrient.key for nutrient in Nutrient.query.order_by(Nutrient.position, Nutrient.id)]
+    query = select(
+        Ingredient.name, Ingredient.calories, Ingredient.proteins, Ingredient.fats,
+        Ingredient.carbs, Ingredient.is_public, IngredientNutrientValues.values
+    ).outerjoin(
+        IngredientNutrientValues, IngredientNutrientValues.ingredient_id == Ingredient.id
+    ).order_by(Ingredient.id)
+    if condition is not None:
+        query = query.where(condition)
+
+    def records(rows):
+        for *fields, extra in rows:
+            record = dict(zip(INGREDIENT_FIELDS, fields))
+            record['extra_nutrients'] = extra or {}
+            yield record
+
+    if fmt == 'csv':
+        def csv_row(record):
+            extra = record.pop('extra_nutrients')
+            return [*record.values(), *[extra.get(key, '') for key in keys]]
+        return _export_csv(query, [*INGREDIENT_FIELDS, *keys], records, csv_row)
+    return _export_jsonl(query, records)
+
+
+def export_recipes(fmt, condition=None):
+    """
+    Выгрузка рецептов с составом порциями строк (генератор)
+
+    Рецепт и его состав читаются одним запросом, упорядоченным по рецепту:
+    строки одного рецепта идут подряд. В CSV - строка на ингредиент состава.
+    """
+    query = select(
+        Recipe.id, Recipe.name, Recipe.description, Recipe.instructions, Recipe.image_url,
+        Recipe.is_public, Ingredient.name, recipe_ingredients.c.ingredient_id,
+        recipe_ingredients.c.amount_grams
+    ).outerjoin(
+        recipe_ingredients, recipe_ingredients.c.recipe_id == Recipe.id
+    ).outerjoin(
+        Ingredient, Ingredient.id == recipe_ingredients.c.ingredient_id
+    ).order_by(Recipe.id, recipe_ingredients.c.ingredient_id)
+    if condition is not None:
+        query = query.where(condition)
+
+    if fmt == 'csv':
+        def csv_records(rows):
+            for row in rows:
+                yield row[1:]
+        return _export_csv(query, [*RECIPE_FIELDS, *RECIPE_ITEM_FIELDS], csv_records,
+                           lambda row: list(row))
+
+    def records(rows):
+        for _, group in groupby(rows, key=lambda row: row[0]):
+            group = list(group)
+            record = dict(zip(RECIPE_FIELDS, group[0][1:6]))
+            record['ingredients'] = [
+                {'ingredient': name, 'ingredient_id': ingredient_id, 'amount': amount}
+                for *_, name, ingredient_id, amount in group if ingredient_id is not None
+            ]
+            yield record
+    return _export_jsonl(query, records)
+
+
+def _stream_rows(query):
+    """Строки запроса порциями: курсор на стороне сервера в PostgreSQL"""
+    result = db.session.execute(query.execution_options(yield_per=EXPORT_BATCH_ROWS))
+    for partition in result.partitions():
+        yield from partition
+
+
+def _export_csv(query, header, records, to_row):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    for count, record in enumerate(records(_stream_rows(query)), start=1):
+        writer.writerow(to_row(record))
+        if count % EXPORT_BATCH_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _export_jsonl(query, records):
+    chunk = []
+    for record in records(_stream_rows(query)):
+        chunk.append(json.dumps(record, ensure_ascii=False))
+        if len(chunk) >= EXPORT_BATCH_ROWS:
+            yield '\n'.join(chunk) + '\n'
+            chunk = []
+    if chunk:
+        yield '\n'.join(chunk) + '\n'
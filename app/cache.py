@@ -0,0 +1,134 @@
+import threading
+import time
+from collections import OrderedDict
+from app.solvers import NUTRIENT_KEYS
+
+# Шаг округления целей в ключе кэша: 2000 и 2000.4 ккал - одна и та же задача
+TARGET_QUANTUM = 1.0
+
+
+class SolutionCache:
+    """
+    LRU-кэш решений оптимизатора с временем жизни записей.
+
+    Хранит найденные количества (или текст ошибки), а не готовый результат:
+    словарь результата содержит объекты Ingredient и собирается заново для
+    текущих целей. В ключ входят значения КБЖУ ингредиентов, поэтому после
+    изменения ингредиента старые записи просто перестают совпадать - в том
+    числе в других процессах. invalidate_ingredients сразу освобождает их
+    в текущем процессе. Подбор рецептов к найденному решению запоминают
+    блоки индекса рецептов (app.recipe_index.RANK_CACHE_SIZE).
+    """
+
+    def __init__(self, maxsize=256, ttl=600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()   # ключ -> (время записи, значение, id ингредиентов)
+        self._by_ingredient = {}        # id ингредиента -> множество ключей
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def configure(self, maxsize=None, ttl=None):
+        """Изменить размер и время жизни (из конфигурации приложения)"""
+        with self._lock:
+            if maxsize is not None:
+                self.maxsize = maxsize
+            if ttl is not None:
+                self.ttl = ttl
+            while len(self._entries) > self.maxsize:
+                self._evict_oldest()
+
+    @staticmethod
+    def make_key(ingredients, targets, initial_amounts=None, solver=None, solver_options=None):
+        """Ключ задачи: ингредиенты с их нутриентами, округлённые цели, начальные количества, метод"""
+        extra_keys = tuple(sorted(key for key in targets if key not in NUTRIENT_KEYS))
+        return (
+            tuple((ing.id, ing.calories, ing.proteins, ing.fats, ing.carbs)
+                  + tuple(ing.extra_nutrients.get(key, 0) for key in extra_keys)
+                  for ing in ingredients),
+            tuple(sorted((key, round(float(value) / TARGET_QUANTUM)) for key, value in targets.items())),
+            tuple(float(amount) for amount in initial_amounts) if initial_amounts is not None else None,
+            solver,
+            tuple(sorted((solver_options or {}).items())),
+        )
+
+    def get(self, key):
+        """Значение по ключу или None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl:
+                self._remove(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        """Сохранить значение, вытеснив самые старые записи при переполнении"""
+        if self.maxsize <= 0:
+            return
+
+        ingredient_ids = [item[0] for item in key[0]]
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (time.monotonic(), value, ingredient_ids)
+            for ingredient_id in ingredient_ids:
+                self._by_ingredient.setdefault(ingredient_id, set()).add(key)
+
+            while len(self._entries) > self.maxsize:
+                self._evict_oldest()
+
+    def invalidate_ingredients(self, ingredient_ids):
+        """Удалить все решения, в которых участвуют эти ингредиенты"""
+        with self._lock:
+            for ingredient_id in ingredient_ids:
+                for key in list(self._by_ingredient.get(ingredient_id, ())):
+                    self._remove(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_ingredient.clear()
+
+    def stats(self):
+        """Счётчики для администратора"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total * 100, 1) if total else 0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
+
+    def _evict_oldest(self):
+        key = next(iter(self._entries))
+        self._remove(key)
+        self.evictions += 1
+
+    def _remove(self, key):
+        _, _, ingredient_ids = self._entries.pop(key)
+        for ingredient_id in ingredient_ids:
+            keys = self._by_ingredient.get(ingredient_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_ingredient[ingredient_id]
+
+
+solution_cache = SolutionCache()
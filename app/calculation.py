@@ -1,161 +1,403 @@
+import math
+import time
 import numpy as np
-from scipy.optimize import minimize
-
-def calculate_optimal_diet(available_ingredients, targets, initial_amounts=None):
+from scipy.optimize import OptimizeResult
+from app.telemetry import solver_telemetry
+from app.solvers import (SOLVERS, DEFAULT_SOLVER, MAX_TOTAL_WEIGHT, PORTION_STEP, NUTRIENT_KEYS,
+                         nutrient_matrix, amount_bounds, initial_guess, round_portions,
+                         solve_lsq_batch, weight_is_valid, solve_lsq, solve_slsqp,
+                         select_ingredients)
+
+# Методы, которые умеют стартовать с предыдущего решения
+WARM_START_SOLVERS = ('auto', 'lsq', 'slsqp')
+
+# Автоматический подбор ингредиентов: сколько выбирать по умолчанию и максимум
+DEFAULT_AUTO_INGREDIENTS = 5
+MAX_AUTO_INGREDIENTS = 15
+
+def calculate_optimal_diet(available_ingredients, targets, initial_amounts=None,
+                           solver=DEFAULT_SOLVER, solver_options=None, cache=None,
+                           nutrients=None, warm_start=None):
     """
     Рассчитать оптимальные количества ингредиентов для достижения целевых КБЖУ
 
     Args:
         available_ingredients: список объектов Ingredient
-        targets: словарь с ключами 'calories', 'proteins', 'fats', 'carbs'
+        targets: словарь с ключами 'calories', 'proteins', 'fats', 'carbs' и,
+            при необходимости, ключами дополнительных нутриентов (Nutrient.key)
         initial_amounts: начальные количества (если None, то не учитывается)
+        solver: метод расчёта из app.solvers.SOLVERS ('auto', 'lsq', 'slsqp', 'milp')
+        solver_options: дополнительные параметры метода (для 'milp': step,
+            min_portion, tolerance, time_limit)
+        cache: кэш решений (app.cache.SolutionCache), если None - не используется
+        nutrients: готовая матрица нутриентов на 1г в порядке target_keys(targets)
+            (срез каталога app.catalog), если None - строится по available_ingredients
+        warm_start: предыдущее решение с теми же ингредиентами
+            ({'x': количества, 'dual': множители}, как result['solution'])
+            для тёплого старта непрерывных методов
 
     Returns:
-        Словарь с оптимальными количествами ингредиентов
+        Словарь с оптимальными количествами ингредиентов; в 'solution' -
+        неокруглённые количества и множители для следующего тёплого старта
     """
+    error = _check_problem(available_ingredients, initial_amounts, solver)
+    if error:
+        return error
+
+    solver_options = solver_options or {}
+    step = solver_options.get('step', PORTION_STEP)
+
+    key = None
+    if cache is not None:
+        key = cache.make_key(available_ingredients, targets, initial_amounts,
+                             solver, solver_options)
+        cached = cache.get(key)
+        if cached is not None:
+            weights, message = cached
+            if weights is None:
+                return {'success': False, 'error': message}
+            return _with_solution(build_diet_result(available_ingredients, weights, targets, step,
+                                                    nutrients),
+                                  weights, None)
 
-    if not available_ingredients:
+    n_ingredients = len(available_ingredients)
+
+    # Матрица питательных веществ на 1г (каждый столбец - ингредиент)
+    keys = target_keys(targets)
+    if nutrients is None:
+        nutrients = nutrient_matrix(available_ingredients, keys)
+
+    # Границы (0-1000г, либо в 2 раза от указанного пользователем количества)
+    lower, upper = amount_bounds(initial_amounts, n_ingredients)
+    x0 = initial_guess(initial_amounts, n_ingredients, lower, upper)
+
+    # Тёплый старт с предыдущего решения (целочисленный режим его не поддерживает)
+    warm = {}
+    if warm_start and solver in WARM_START_SOLVERS:
+        start = warm_start.get('x')
+        if start is not None and len(start) == n_ingredients:
+            warm['start'] = np.clip(np.asarray(start, dtype=float), lower, upper)
+        if warm_start.get('dual') is not None:
+            warm['dual'] = np.asarray(warm_start['dual'], dtype=float)
+
+    # Оптимизация
+    target_vector = _target_vector(targets, keys)
+    started = time.perf_counter()
+    result = SOLVERS[solver](nutrients, target_vector, lower, upper, x0, **solver_options, **warm)
+    solver_telemetry.record(solver, result, nutrients, target_vector, getattr(result, 'x', None),
+                            time.perf_counter() - started, warm=bool(warm))
+
+    if not result.success:
+        message = f'Ошибка оптимизации: {result.message}'
+        if key is not None:
+            cache.put(key, (None, message))
         return {
             'success': False,
-            'error': 'Нет доступных ингредиентов'
+            'error': message
         }
 
-    # Преобразуем данные в массивы NumPy
-    n_ingredients = len(available_ingredients)
+    if key is not None:
+        cache.put(key, (np.array(result.x, dtype=float), None))
 
-    # Матрица питательных веществ (каждый столбец - ингредиент)
-    nutrients = np.zeros((4, n_ingredients))
-    for i, ing in enumerate(available_ingredients):
-        nutrients[0, i] = ing.calories  # калории на 100г
-        nutrients[1, i] = ing.proteins  # белки на 100г
-        nutrients[2, i] = ing.fats      # жиры на 100г
-        nutrients[3, i] = ing.carbs     # углеводы на 100г
-
-    # Целевые значения
-    target_vector = np.array([
-        targets['calories'],
-        targets['proteins'],
-        targets['fats'],
-        targets['carbs']
-    ])
-
-    def objective(x):
-        """Целевая функция - минимизация отклонения от целевых значений"""
-        # x - вектор весов (сколько грамм каждого ингредиента)
-        # Насчитываем фактические КБЖУ
-        actual = nutrients @ (x / 100.0)  # делим на 100, т.к. КБЖУ на 100г
-
-        # Квадратичная ошибка
-        error = np.sum((actual - target_vector) ** 2)
-
-        # Штраф за отрицательные значения
-        penalty = 1000 * np.sum(np.maximum(-x, 0) ** 2)
-
-        # Штраф за слишком большие значения (больше 1000г)
-        large_penalty = 0.01 * np.sum(np.maximum(x - 1000, 0) ** 2)
-
-        # Если есть начальные количества, штрафуем за сильное отклонение
-        if initial_amounts is not None:
-            for i in range(n_ingredients):
-                if initial_amounts[i] > 0:
-                    # Штраф за изменение больше чем в 2 раза
-                    if x[i] > initial_amounts[i] * 2 or x[i] < initial_amounts[i] * 0.5:
-                        error += 100 * ((x[i] - initial_amounts[i]) ** 2)
-
-        return error + penalty + large_penalty
-
-    # Начальное приближение (равные доли, сумма = 500г)
-    if initial_amounts is not None and len(initial_amounts) == n_ingredients:
-        # Используем указанные пользователем количества как начальное приближение
-        x0 = np.array(initial_amounts, dtype=float)
-    else:
-        # Равные доли, сумма = 500г
-        x0 = np.ones(n_ingredients) * (500 / max(n_ingredients, 1))
-
-    # Границы (0-1000г для каждого ингредиента)
-    bounds = [(0, 1000) for _ in range(n_ingredients)]
-
-    # Ограничения
-    constraints = [
-        {'type': 'ineq', 'fun': lambda x: np.sum(x) - 200},   # минимум 200г
-        {'type': 'ineq', 'fun': lambda x: 5000 - np.sum(x)},  # максимум 5000г
-    ]
+    return _with_solution(build_diet_result(available_ingredients, result.x, targets, step,
+                                            nutrients),
+                          result.x, getattr(result, 'dual', None))
 
-    # Оптимизация
-    result = minimize(
-        objective,
-        x0,
-        bounds=bounds,
-        constraints=constraints,
-        method='SLSQP',
-        options={'maxiter': 1000, 'ftol': 1e-6}
-    )
+def _with_solution(diet, weights, dual):
+    """Добавить к успешному результату неокруглённое решение для тёплого старта"""
+    if diet['success']:
+        diet['solution'] = {
+            'x': np.asarray(weights, dtype=float),
+            'dual': None if dual is None else np.asarray(dual, dtype=float)
+        }
+    return diet
+
+def calculate_optimal_diet_batch(available_ingredients, targets_list, initial_amounts=None,
+                                 solver=DEFAULT_SOLVER, solver_options=None, nutrients=None):
+    """
+    Рассчитать оптимальные количества для одного набора ингредиентов и многих целей
+
+    Матрица КБЖУ и границы строятся один раз. Для 'auto' и 'lsq' все цели
+    решаются вместе векторным методом (solve_lsq_batch); в режиме 'auto' цели,
+    где активны ограничения на общий вес, дорешиваются SLSQP по одной. Для
+    'slsqp' векторный метод не запускается: каждая цель решается SLSQP,
+    начиная с решения предыдущей (цели перебираются по возрастанию калорий,
+    чтобы соседние решения были близки).
+
+    Args:
+        available_ingredients: список объектов Ingredient
+        targets_list: список словарей целей, как в calculate_optimal_diet,
+            с одинаковым набором нутриентов
+        initial_amounts: начальные количества (если None, то не учитывается)
+        solver: метод расчёта из app.solvers.SOLVERS
+        solver_options: дополнительные параметры метода
+        nutrients: готовая матрица КБЖУ на 1г, если None - строится по ингредиентам
 
-    if result.success:
-        # Округляем до 5 грамм и фильтруем маленькие значения
-        optimal_weights = np.round(result.x / 5) * 5
-
-        # Собираем результат
-        result_dict = {}
-        total_weight = 0
-
-        for i, ing in enumerate(available_ingredients):
-            weight = float(optimal_weights[i])
-            if weight >= 5:  # включаем только если больше или равно 5г
-                result_dict[ing.id] = {
-                    'ingredient': ing,
-                    'grams': weight,
-                    'nutrition': {
-                        'calories': ing.calories * weight / 100,
-                        'proteins': ing.proteins * weight / 100,
-                        'fats': ing.fats * weight / 100,
-                        'carbs': ing.carbs * weight / 100
-                    }
+    Returns:
+        Список результатов calculate_optimal_diet в порядке targets_list
+    """
+    if not targets_list:
+        return []
+
+    error = _check_problem(available_ingredients, initial_amounts, solver)
+    if error:
+        return [dict(error) for _ in targets_list]
+
+    if solver not in ('auto', 'lsq', 'slsqp'):
+        # Для целочисленного режима векторного пути нет
+        return [calculate_optimal_diet(available_ingredients, targets, initial_amounts,
+                                       solver, solver_options, nutrients=nutrients)
+                for targets in targets_list]
+
+    n_ingredients = len(available_ingredients)
+    keys = target_keys(targets_list[0])
+    if nutrients is None:
+        nutrients = nutrient_matrix(available_ingredients, keys)
+    lower, upper = amount_bounds(initial_amounts, n_ingredients)
+    x0 = initial_guess(initial_amounts, n_ingredients, lower, upper)
+
+    target_matrix = np.array([_target_vector(t, keys) for t in targets_list]).T
+    batch = solver != 'slsqp'
+    if batch:
+        started = time.perf_counter()
+        candidates, converged, n_iter = solve_lsq_batch(nutrients, target_matrix, lower, upper, x0)
+        solver_telemetry.record('lsq_batch', OptimizeResult(nit=n_iter, success=bool(converged.all())),
+                                nutrients, target_matrix, candidates, time.perf_counter() - started,
+                                batch=len(targets_list))
+
+    results = [None] * len(targets_list)
+    previous = x0
+
+    for index in np.argsort(target_matrix[0], kind='stable'):
+        if batch and converged[index] and weight_is_valid(candidates[:, index]):
+            weights = candidates[:, index]
+        else:
+            target_vector = target_matrix[:, index]
+            result = None
+            started = time.perf_counter()
+            if batch and not converged[index]:
+                # Векторный метод не сошёлся - решаем эту цель отдельно
+                result = solve_lsq(nutrients, target_vector, lower, upper, x0)
+            if solver == 'slsqp' or (solver == 'auto' and (result is None or not result.success)):
+                # Активны ограничения на общий вес - дорешиваем с тёплого старта
+                result = solve_slsqp(nutrients, target_vector, lower, upper, x0, start=previous)
+            if result is not None:
+                solver_telemetry.record(solver, result, nutrients, target_vector,
+                                        getattr(result, 'x', None), time.perf_counter() - started)
+
+            if result is None or not result.success:
+                message = result.message if result is not None else 'Общий вес вне допустимых границ'
+                results[index] = {
+                    'success': False,
+                    'error': f'Ошибка оптимизации: {message}'
                 }
-                total_weight += weight
+                continue
+            weights = result.x
 
-        if not result_dict:
-            return {
-                'success': False,
-                'error': 'Не удалось найти подходящие количества ингредиентов'
-            }
+        previous = weights
+        results[index] = build_diet_result(available_ingredients, weights, targets_list[index],
+                                           nutrients=nutrients)
+
+    return results
 
-        # Рассчитываем итоговые КБЖУ
-        total_nutrition = {
-            'calories': 0,
-            'proteins': 0,
-            'fats': 0,
-            'carbs': 0
+def build_diet_result(available_ingredients, weights, targets, step=PORTION_STEP, nutrients=None):
+    """
+    Собрать словарь результата из найденных количеств
+
+    Итоги и отклонения считаются одной матричной операцией по всем
+    нутриентам целей, словари собираются только для вывода.
+    """
+    keys = target_keys(targets)
+    if nutrients is None:
+        nutrients = nutrient_matrix(available_ingredients, keys)
+
+    # Округляем до шага порции и фильтруем маленькие значения
+    # (целочисленный режим уже возвращает целые порции)
+    optimal_weights = round_portions(weights, step)
+    used = np.flatnonzero(optimal_weights > 0)
+
+    if len(used) == 0:
+        return {
+            'success': False,
+            'error': 'Не удалось найти подходящие количества ингредиентов'
+        }
+
+    # Вклад каждого используемого ингредиента (нутриенты x ингредиенты) и итоги
+    contributions = nutrients[:, used] * optimal_weights[used]
+    totals = contributions.sum(axis=1)
+    goals = _target_vector(targets, keys)
+    positive = goals > 0
+    deviations = np.zeros(len(keys))
+    deviations[positive] = (totals[positive] - goals[positive]) / goals[positive] * 100
+
+    result_dict = {}
+    for column, i in enumerate(used):
+        ing = available_ingredients[i]
+        result_dict[ing.id] = {
+            'ingredient': ing,
+            'grams': float(optimal_weights[i]),
+            'nutrition': dict(zip(keys, contributions[:, column].tolist()))
+        }
+
+    return {
+        'ingredients': result_dict,
+        'total_nutrition': {key: round(value, 1) for key, value in zip(keys, totals.tolist())},
+        'target_nutrition': targets,
+        'deviations': {key: round(value, 1) for key, value in zip(keys, deviations.tolist())},
+        'total_weight': round(float(optimal_weights[used].sum()), 1),
+        'success': True
+    }
+
+def result_to_dict(result):
+    """Результат расчёта в виде, пригодном для JSON (без объектов Ingredient)"""
+    if not result['success']:
+        return {'success': False, 'error': result.get('error')}
+
+    return {
+        'success': True,
+        'ingredients': [
+            {
+                'id': ing_id,
+                'name': data['ingredient'].name,
+                'grams': data['grams'],
+                'nutrition': {k: round(v, 1) for k, v in data['nutrition'].items()}
+            }
+            for ing_id, data in result['ingredients'].items()
+        ],
+        'total_nutrition': result['total_nutrition'],
+        'target_nutrition': result['target_nutrition'],
+        'deviations': result['deviations'],
+        'total_weight': result['total_weight']
+    }
+
+def recipes_to_dict(best_recipes):
+    """Результат find_best_recipes в виде, пригодном для JSON"""
+    return [
+        {
+            'id': item['recipe'].id,
+            'name': item['recipe'].name,
+            'score': item['score'],
+            'matching_count': item['matching_count'],
+            'match_percentage': item['match_percentage'],
+            'weight_coverage': item['weight_coverage'],
+            'recipe_weight': item['recipe_weight'],
+            'nutrition': item['nutrition']
         }
+        for item in best_recipes
+    ]
+
+def solver_settings(config, integer_portions=False, min_portion=None, tolerance=None):
+    """
+    Метод расчёта и его параметры по настройкам приложения и выбору пользователя
+
+    Args:
+        config: конфигурация приложения (DIET_SOLVER, MILP_TIME_LIMIT)
+        integer_portions: целочисленный режим (порции по 5г)
+        min_portion: минимальная порция в граммах
+        tolerance: допуск по КБЖУ в процентах
 
-        for ing_data in result_dict.values():
-            for key in total_nutrition:
-                total_nutrition[key] += ing_data['nutrition'][key]
+    Returns:
+        (solver, solver_options)
+    """
+    if not integer_portions:
+        return config.get('DIET_SOLVER', DEFAULT_SOLVER), None
+
+    # Целочисленный режим: порции по 5г, либо 0, либо не меньше минимальной
+    return 'milp', {
+        'min_portion': 5 if min_portion is None else min_portion,
+        'tolerance': (10 if tolerance is None else tolerance) / 100,
+        'time_limit': config.get('MILP_TIME_LIMIT', 2.0)
+    }
+
+def choose_ingredients(catalog_ids, nutrients, targets, max_ingredients=DEFAULT_AUTO_INGREDIENTS):
+    """
+    Подобрать ингредиенты из всего каталога под цели
+
+    Args:
+        catalog_ids: id ингредиентов каталога
+        nutrients: матрица нутриентов каталога на 1г (строки в порядке
+            target_keys(targets), столбцы в порядке catalog_ids)
+        targets: словарь целевых значений
+        max_ingredients: сколько ингредиентов выбрать (не больше)
+
+    Returns:
+        Список (id ингредиента, количество в граммах), лучшие первыми
+    """
+    if not catalog_ids:
+        return []
+
+    k = max(1, min(int(max_ingredients), MAX_AUTO_INGREDIENTS))
+    indices, grams = select_ingredients(nutrients, _target_vector(targets, target_keys(targets)), k)
+    return [(catalog_ids[i], float(amount)) for i, amount in zip(indices, grams)]
 
-        # Рассчитываем отклонения
-        deviations = {}
-        for key in total_nutrition:
-            if targets[key] > 0:
-                deviations[key] = round((total_nutrition[key] - targets[key])
-                                        / targets[key] * 100, 1)
-            else:
-                deviations[key] = 0
+def _check_problem(available_ingredients, initial_amounts, solver):
+    """Проверить входные данные, вернуть словарь ошибки или None"""
+    if not available_ingredients:
+        return {
+            'success': False,
+            'error': 'Нет доступных ингредиентов'
+        }
 
+    if solver not in SOLVERS:
         return {
-            'ingredients': result_dict,
-            'total_nutrition': {k: round(v, 1) for k, v in total_nutrition.items()},
-            'target_nutrition': targets,
-            'deviations': deviations,
-            'total_weight': round(total_weight, 1),
-            'success': True
+            'success': False,
+            'error': f'Неизвестный метод расчёта: {solver}'
         }
-    else:
+
+    lower, _ = amount_bounds(initial_amounts, len(available_ingredients))
+    if lower.sum() > MAX_TOTAL_WEIGHT:
         return {
             'success': False,
-            'error': f'Ошибка оптимизации: {result.message}'
+            'error': f'Указанные количества слишком велики: даже вдвое меньшие '
+                     f'дают больше {MAX_TOTAL_WEIGHT}г'
         }
 
-def find_best_recipes(optimal_ingredients, available_recipes, top_n=3):
+    return None
+
+def target_keys(targets):
+    """Нутриенты задачи: КБЖУ, затем дополнительные по алфавиту"""
+    return NUTRIENT_KEYS + tuple(sorted(key for key in targets if key not in NUTRIENT_KEYS))
+
+def parse_targets(data, extra_keys=()):
+    """
+    Цели из запроса: КБЖУ обязательны, дополнительные нутриенты - если заданы
+
+    Args:
+        data: словарь значений (JSON или поля формы)
+        extra_keys: ключи известных дополнительных нутриентов
+
+    Raises:
+        KeyError, TypeError, ValueError при неверных данных
+    """
+    targets = {key: float(data[key]) for key in NUTRIENT_KEYS}
+    for key in extra_keys:
+        if data.get(key) not in (None, ''):
+            targets[key] = float(data[key])
+    return targets
+
+def parse_portion_settings(data):
+    """
+    Минимальная порция и допуск целочисленного режима из запроса (None - по умолчанию)
+
+    Raises:
+        TypeError, ValueError при нечисловых, бесконечных или отрицательных значениях
+    """
+    settings = []
+    for key in ('min_portion', 'tolerance'):
+        value = data.get(key)
+        if value is not None:
+            value = float(value)
+            if not math.isfinite(value) or value < 0:
+                raise ValueError(f'{key} должен быть неотрицательным числом')
+        settings.append(value)
+    return tuple(settings)
+
+def _target_vector(targets, keys=NUTRIENT_KEYS):
+    """Целевые значения в порядке keys"""
+    return np.array([targets[key] for key in keys], dtype=float)
+
+def find_best_recipes(optimal_ingredients, available_recipes, top_n=3,
+                      catalog=None, recipe_amounts=None):
     """
     Найти лучшие рецепты на основе оптимальных ингредиентов
 
@@ -163,6 +405,9 @@ def find_best_recipes(optimal_ingredients, available_recipes, top_n=3):
         optimal_ingredients: результат calculate_optimal_diet['ingredients']
         available_recipes: список доступных рецептов
         top_n: сколько рецептов вернуть
+        catalog: каталог КБЖУ (app.catalog.CatalogView) и recipe_amounts -
+            состав рецептов {id рецепта: [(id ингредиента, граммы)]}; если
+            заданы, состав и КБЖУ рецептов считаются без запросов к ORM
 
     Returns:
         Список рецептов с оценкой соответствия
@@ -174,61 +419,91 @@ def find_best_recipes(optimal_ingredients, available_recipes, top_n=3):
     optimal_ingredient_ids = set(optimal_ingredients.keys())
     optimal_ingredient_weights = {id: data['grams'] for id, data in optimal_ingredients.items()}
 
+    from_catalog = catalog is not None and recipe_amounts is not None
     scored_recipes = []
 
     for recipe in available_recipes:
-        # Получаем ID ингредиентов рецепта
-        recipe_ingredient_ids = {ing.id for ing in recipe.ingredients}
+        if from_catalog:
+            amounts = recipe_amounts.get(recipe.id, [])
+        else:
+            amounts = [(item.ingredient_id, item.amount_grams) for item in recipe.items]
 
-        if not recipe_ingredient_ids:
+        scored = _score_recipe(amounts, optimal_ingredient_ids, optimal_ingredient_weights)
+        if scored is None:
             continue
 
-        # 1. Количество совпадающих ингредиентов
-        matching_ingredients = optimal_ingredient_ids.intersection(recipe_ingredient_ids)
-        matching_count = len(matching_ingredients)
+        # КБЖУ рецепта - только для рецептов, прошедших отбор
+        if from_catalog:
+            scored['nutrition'] = recipe_nutrition_from_catalog(recipe, amounts, catalog)
+        else:
+            scored['nutrition'] = recipe.calculate_nutrition()
+        scored['recipe'] = recipe
+        scored_recipes.append(scored)
 
-        # 2. Процент совпадения по ингредиентам
-        match_percentage = matching_count / len(recipe_ingredient_ids) * 100
+    # Сортируем по убыванию оценки
+    scored_recipes.sort(key=lambda x: x['score'], reverse=True)
 
-        # 3. Суммарный вес совпадающих ингредиентов
-        total_matching_weight = 0
-        for ing_id in matching_ingredients:
-            total_matching_weight += optimal_ingredient_weights.get(ing_id, 0)
+    return scored_recipes[:top_n]
 
-        # 4. Общий вес рецепта
-        recipe_weight = 0
-        for ingredient in recipe.ingredients:
-            amount = recipe.get_ingredient_amount(ingredient.id)
-            if amount:
-                recipe_weight += amount
+def _score_recipe(amounts, optimal_ingredient_ids, optimal_ingredient_weights):
+    """
+    Оценка одного рецепта по составу [(id ингредиента, граммы)]
 
-        if recipe_weight == 0:
-            continue
+    Returns:
+        Словарь оценки без рецепта и КБЖУ, или None, если рецепт пуст
+    """
+    recipe_ingredient_ids = {ing_id for ing_id, _ in amounts}
+    if not recipe_ingredient_ids:
+        return None
+
+    matching_ingredients = optimal_ingredient_ids.intersection(recipe_ingredient_ids)
+    matching_weight = sum(optimal_ingredient_weights.get(ing_id, 0)
+                          for ing_id in matching_ingredients)
+    recipe_weight = sum(grams or 0 for _, grams in amounts)
+    if recipe_weight == 0:
+        return None
+
+    score, match_percentage, weight_coverage = recipe_scores(
+        len(matching_ingredients), matching_weight, len(recipe_ingredient_ids), recipe_weight
+    )
+    return {
+        'score': round(float(score), 2),
+        'matching_count': len(matching_ingredients),
+        'match_percentage': round(float(match_percentage), 1),
+        'weight_coverage': round(float(weight_coverage), 1),
+        'recipe_weight': round(recipe_weight, 1)
+    }
+
+def recipe_scores(matching_count, matching_weight, ingredient_count, recipe_weight):
+    """
+    Оценка соответствия рецептов оптимальному набору (числа или массивы numpy)
 
-        # 5. Процент покрытия по весу
-        weight_coverage = min(total_matching_weight / recipe_weight * 100, 100)
-
-        # Итоговая оценка (можно настроить коэффициенты)
-        score = (
-            match_percentage * 0.4 +          # 40% за совпадение ингредиентов
-            weight_coverage * 0.4 +           # 40% за покрытие веса
-            (matching_count * 10) * 0.2       # 20% за количество совпадений
-        )
-
-        # Рассчитываем КБЖУ рецепта
-        recipe_nutrition = recipe.calculate_nutrition()
-
-        scored_recipes.append({
-            'recipe': recipe,
-            'score': round(score, 2),
-            'matching_count': matching_count,
-            'match_percentage': round(match_percentage, 1),
-            'weight_coverage': round(weight_coverage, 1),
-            'recipe_weight': round(recipe_weight, 1),
-            'nutrition': recipe_nutrition
-        })
+    Единственное место формулы: ею пользуются find_best_recipes и
+    app.recipe_index для оценки сразу многих рецептов.
 
-    # Сортируем по убыванию оценки
-    scored_recipes.sort(key=lambda x: x['score'], reverse=True)
+    Returns:
+        (оценка, процент совпадения, процент покрытия по весу)
+    """
+    match_percentage = matching_count / ingredient_count * 100
+    weight_coverage = np.minimum(matching_weight / recipe_weight * 100, 100)
+    score = (
+        match_percentage * 0.4 +
+        weight_coverage * 0.4 +
+        (matching_count * 10) * 0.2
+    )
+    return score, match_percentage, weight_coverage
+
+def recipe_nutrition_from_catalog(recipe, amounts, catalog):
+    """КБЖУ рецепта по составу [(id ингредиента, граммы)] и матрице каталога"""
+    if all(ing_id in catalog for ing_id, _ in amounts):
+        ids = [ing_id for ing_id, _ in amounts]
+        grams = np.array([grams or 0 for _, grams in amounts], dtype=float)
+        totals = catalog.nutrients[:, catalog.columns(ids)] @ grams
+        return {
+            key: round(float(value), 1)
+            for key, value in zip(catalog.keys, totals)
+            if key in NUTRIENT_KEYS or value
+        }
 
-    return scored_recipes[:top_n]
+    # В публичном рецепте есть чужой личный ингредиент - его нет в каталоге
+    return recipe.calculate_nutrition()
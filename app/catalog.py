@@ -0,0 +1,253 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+import numpy as np
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+from app import db
+from app.models import Ingredient, IngredientNutrientValues, Nutrient
+from app.solvers import NUTRIENT_KEYS
+
+# Лёгкая строка каталога: те же поля, что читают расчёт и шаблоны у Ingredient
+CatalogIngredient = namedtuple(
+    'CatalogIngredient',
+    ['id', 'name', 'calories', 'proteins', 'fats', 'carbs', 'is_public', 'user_id',
+     'extra_nutrients']
+)
+
+
+class CatalogView:
+    """
+    Каталог ингредиентов, видимый одному пользователю: общие плюс личные.
+
+    nutrients - непрерывная матрица нутриентов на 1 г (строки - keys: КБЖУ
+    и дополнительные нутриенты, столбцы - ингредиенты), index - номер столбца
+    по id ингредиента. Срезы сразу подходят оптимизатору, объекты Ingredient
+    для этого не нужны.
+    """
+
+    def __init__(self, rows, nutrients, keys, definitions):
+        self.rows = rows
+        self.nutrients = nutrients
+        self.keys = keys
+        self.definitions = definitions
+        self._key_rows = {key: row for row, key in enumerate(keys)}
+        self.ids = [row.id for row in rows]
+        self.index = {ingredient_id: col for col, ingredient_id in enumerate(self.ids)}
+        self._by_name = None
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, ingredient_id):
+        return ingredient_id in self.index
+
+    def columns(self, ingredient_ids):
+        """Номера столбцов для id (невидимые пользователю пропускаются)"""
+        return [self.index[i] for i in ingredient_ids if i in self.index]
+
+    def matrix(self, keys=NUTRIENT_KEYS, cols=None):
+        """Матрица на 1 г по нутриентам keys (и столбцам cols, если заданы)"""
+        rows = [self._key_rows[key] for key in keys]
+        if cols is None:
+            return self.nutrients[rows]
+        return self.nutrients[np.ix_(rows, cols)]
+
+    def select(self, ingredient_ids, keys=NUTRIENT_KEYS):
+        """Строки и срез матрицы по нутриентам keys для выбранных id в их порядке"""
+        cols = self.columns(ingredient_ids)
+        return [self.rows[c] for c in cols], self.matrix(keys, cols)
+
+    def load_selected(self, items, keys=NUTRIENT_KEYS):
+        """
+        Выбранные ингредиенты без запросов к базе
+
+        Args:
+            items: список словарей {'ingredient_id': ..., 'amount': ...}
+            keys: нутриенты задачи (calculation.target_keys)
+
+        Returns:
+            (строки, количества, срез матрицы КБЖУ) в порядке items, только
+            видимые пользователю, без повторов
+        """
+        amounts = {}
+        for item in items or []:
+            ingredient_id = int(item['ingredient_id'])
+            if ingredient_id in self.index and ingredient_id not in amounts:
+                amounts[ingredient_id] = float(item.get('amount', 100))
+
+        rows, nutrients = self.select(list(amounts), keys)
+        return rows, list(amounts.values()), nutrients
+
+    def sorted_by_name(self):
+        """Строки по алфавиту (для выпадающих списков)"""
+        if self._by_name is None:
+            self._by_name = sorted(self.rows, key=lambda row: row.name)
+        return self._by_name
+
+
+class NutrientCatalog:
+    """
+    Кэш матриц нутриентов: одна для общих ингредиентов и по одной на личные
+    ингредиенты каждого пользователя.
+
+    При добавлении, изменении и удалении ингредиента (и его дополнительных
+    нутриентов) через ORM соответствующие блоки сбрасываются, при изменении
+    списка нутриентов - все (события SQLAlchemy ниже). Время жизни ограничивает
+    устаревание в других процессах и после изменений в обход ORM.
+    """
+
+    def __init__(self, ttl=60, max_users=256):
+        self.ttl = ttl
+        self.max_users = max_users
+        self._definitions = None        # (время загрузки, ключи, описания нутриентов)
+        self._public = None             # (время построения, строки, матрица)
+        self._private = OrderedDict()   # id пользователя -> (время, строки, матрица)
+        self._views = OrderedDict()     # id пользователя -> CatalogView
+        self._lock = threading.Lock()
+
+    def configure(self, ttl=None, max_users=None):
+        """Изменить время жизни и число пользователей в кэше"""
+        with self._lock:
+            if ttl is not None:
+                self.ttl = ttl
+            if max_users is not None:
+                self.max_users = max_users
+
+    def view(self, user_id):
+        """Каталог пользователя (строится при первом обращении)"""
+        # Без autoflush: иначе flush изменённого в сессии ингредиента вызовет
+        # сброс каталога (события ниже) под уже захваченной блокировкой
+        with self._lock, db.session.no_autoflush:
+            now = time.monotonic()
+            if self._definitions is None or now - self._definitions[0] > self.ttl:
+                definitions = [n.to_dict() for n in Nutrient.query.order_by(Nutrient.position,
+                                                                            Nutrient.id)]
+                keys = NUTRIENT_KEYS + tuple(n['key'] for n in definitions)
+                if self._definitions is None or keys != self._definitions[1]:
+                    self._public = None
+                    self._private.clear()
+                    self._views.clear()
+                self._definitions = (now, keys, definitions)
+            _, keys, definitions = self._definitions
+
+            if self._public is None or now - self._public[0] > self.ttl:
+                self._public = (now,) + _load_block(Ingredient.is_public == True, keys)
+                self._views.clear()
+
+            private = self._private.get(user_id)
+            if private is None or now - private[0] > self.ttl:
+                private = (now,) + _load_block((Ingredient.user_id == user_id)
+                                               & (Ingredient.is_public == False), keys)
+                self._private[user_id] = private
+                self._views.pop(user_id, None)
+            self._private.move_to_end(user_id)
+
+            view = self._views.get(user_id)
+            if view is None:
+                rows = self._public[1] + private[1]
+                nutrients = np.asfortranarray(np.hstack([self._public[2], private[2]]))
+                view = CatalogView(rows, nutrients, keys, definitions)
+                self._views[user_id] = view
+            self._views.move_to_end(user_id)
+
+            while len(self._private) > self.max_users:
+                oldest, _ = self._private.popitem(last=False)
+                self._views.pop(oldest, None)
+
+            return view
+
+    def invalidate(self, public=False, user_ids=(), definitions=False):
+        """Сбросить общий блок, личные блоки пользователей и/или список нутриентов"""
+        with self._lock:
+            if definitions:
+                self._definitions = None
+            if public:
+                self._public = None
+                self._views.clear()
+            for user_id in user_ids:
+                self._private.pop(user_id, None)
+                self._views.pop(user_id, None)
+
+    def clear(self):
+        self.invalidate(public=True, user_ids=list(self._private), definitions=True)
+
+
+def _load_block(condition, keys):
+    """Строки и матрица нутриентов keys на 1 г одним запросом по столбцам"""
+    rows = [
+        CatalogIngredient(*row[:8], row[8] or {})
+        for row in db.session.query(
+            Ingredient.id, Ingredient.name, Ingredient.calories, Ingredient.proteins,
+            Ingredient.fats, Ingredient.carbs, Ingredient.is_public, Ingredient.user_id,
+            IngredientNutrientValues.values
+        ).outerjoin(
+            IngredientNutrientValues, IngredientNutrientValues.ingredient_id == Ingredient.id
+        ).filter(condition).order_by(Ingredient.id)
+    ]
+
+    nutrients = np.zeros((len(keys), len(rows)))
+    nutrients[:len(NUTRIENT_KEYS)] = np.array([row[2:6] for row in rows], dtype=float).reshape(-1, 4).T
+    extra_rows = {key: i for i, key in enumerate(keys) if key not in NUTRIENT_KEYS}
+    for col, row in enumerate(rows):
+        for key, value in row.extra_nutrients.items():
+            if key in extra_rows:
+                nutrients[extra_rows[key], col] = value
+    return rows, nutrients / 100.0
+
+
+nutrient_catalog = NutrientCatalog()
+
+
+def _ingredient_changed(mapper, connection, target):
+    """
+    Сбросить блоки каталога, в которых был или стал виден ингредиент.
+
+    Сбрасываем сразу и ещё раз после коммита: между flush и коммитом другой
+    запрос мог перестроить блок по старым данным.
+    """
+    public_history = inspect(target).attrs.is_public.history
+    was_public = bool(public_history.deleted and public_history.deleted[0])
+    owner_history = inspect(target).attrs.user_id.history
+    public = bool(target.is_public) or was_public
+    user_ids = {u for u in (target.user_id, *(owner_history.deleted or ())) if u is not None}
+
+    nutrient_catalog.invalidate(public=public, user_ids=user_ids)
+
+    session = object_session(target)
+    if session is not None:
+        pending = session.info.setdefault('catalog_invalidate', [False, set()])
+        pending[0] = pending[0] or public
+        pending[1].update(user_ids)
+
+
+def _after_commit(session):
+    pending = session.info.pop('catalog_invalidate', None)
+    if pending is not None:
+        nutrient_catalog.invalidate(public=pending[0], user_ids=pending[1])
+
+
+def _after_rollback(session):
+    session.info.pop('catalog_invalidate', None)
+
+
+def _values_changed(mapper, connection, target):
+    """Изменились дополнительные нутриенты ингредиента"""
+    if target.ingredient is not None:
+        _ingredient_changed(mapper, connection, target.ingredient)
+    else:
+        # Владелец неизвестен без запроса во время flush - сбрасываем всё
+        nutrient_catalog.invalidate(public=True, user_ids=list(nutrient_catalog._private))
+
+
+def _nutrients_changed(mapper, connection, target):
+    """Изменился список нутриентов: перестраиваем все блоки"""
+    nutrient_catalog.invalidate(definitions=True)
+
+
+for _event in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(Ingredient, _event, _ingredient_changed)
+    event.listen(IngredientNutrientValues, _event, _values_changed)
+    event.listen(Nutrient, _event, _nutrients_changed)
+event.listen(Session, 'after_commit', _after_commit)
+event.listen(Session, 'after_rollback', _after_rollback)
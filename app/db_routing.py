@@ -0,0 +1,213 @@
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from flask import current_app, g, has_app_context, has_request_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.exc import OperationalError
+
+# Ключ реплики только для чтения в SQLALCHEMY_BINDS
+REPLICA_BIND = 'replica'
+
+# Отставание реплики (с): 0, если всё полученное уже применено - иначе
+# простаивающая основная база выглядела бы как растущее отставание
+REPLICA_LAG_SQL = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+
+def engine_options(config, url):
+    """
+    Параметры движка из профиля пула DB_POOL_PROFILE (config.DB_POOL_PROFILES)
+
+    Для SQLite и конфигураций без профилей - параметры SQLAlchemy по
+    умолчанию (SQLite в памяти - одно соединение на процесс).
+
+    Raises:
+        ValueError: неизвестный профиль
+    """
+    profiles = config.get('DB_POOL_PROFILES')
+    if not profiles or make_url(url).get_backend_name() == 'sqlite':
+        return {}
+
+    name = config.get('DB_POOL_PROFILE', 'web')
+    if name not in profiles:
+        raise ValueError(f'Неизвестный профиль пула соединений: {name}')
+    return dict(profiles[name])
+
+
+def configure_engines(app):
+    """
+    Параметры движков до db.init_app: профиль пула для основной базы и
+    реплика REPLICA_DATABASE_URL (если задана) как bind 'replica'.
+    Явно заданные SQLALCHEMY_ENGINE_OPTIONS не перезаписываются.
+    """
+    config = app.config
+    options = engine_options(config, config['SQLALCHEMY_DATABASE_URI'])
+    config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', options)
+
+    replica_url = config.get('REPLICA_DATABASE_URL')
+    if replica_url:
+        replica = {'url': replica_url, **engine_options(config, replica_url)}
+        if make_url(replica_url).get_backend_name() == 'postgresql':
+            # Недоступная реплика не должна держать запрос дольше таймаута
+            replica['connect_args'] = {'connect_timeout': config.get('REPLICA_CONNECT_TIMEOUT', 2)}
+        config['SQLALCHEMY_BINDS'] = {**config.get('SQLALCHEMY_BINDS', {}), REPLICA_BIND: replica}
+
+    replica_monitor.configure(config.get('REPLICA_MAX_LAG'), config.get('REPLICA_CHECK_INTERVAL'))
+
+
+class ReplicaMonitor:
+    """
+    Состояние реплики: доступна ли и не отстаёт ли больше max_lag секунд.
+
+    Проверка - один запрос к реплике не чаще раза в interval секунд, между
+    проверками используется последний результат. Ошибка соединения с
+    репликой во время запроса сразу помечает её недоступной до следующей
+    проверки: чтение уходит на основную базу.
+    """
+
+    def __init__(self, max_lag=5.0, interval=5.0):
+        self.max_lag = max_lag
+        self.interval = interval
+        self._checked = {}      # id движка -> (время проверки, доступна ли, отставание)
+        self._lock = threading.Lock()
+
+    def configure(self, max_lag=None, interval=None):
+        """Изменить допустимое отставание и период проверки"""
+        with self._lock:
+            if max_lag is not None:
+                self.max_lag = max_lag
+            if interval is not None:
+                self.interval = interval
+            self._checked.clear()
+
+    def available(self, engine):
+        """Можно ли читать с реплики"""
+        now = time.monotonic()
+        with self._lock:
+            checked = self._checked.get(id(engine))
+            if checked is not None and now - checked[0] < self.interval:
+                return checked[1]
+
+        try:
+            with engine.connect() as connection:
+                lag = float(connection.execute(REPLICA_LAG_SQL).scalar() or 0)
+            healthy = lag <= self.max_lag
+        except Exception as e:
+            current_app.logger.warning('Реплика недоступна, чтение с основной базы: %s', e)
+            lag, healthy = None, False
+
+        with self._lock:
+            self._checked[id(engine)] = (now, healthy, lag)
+        return healthy
+
+    def mark_failed(self, engine):
+        """Пометить реплику недоступной до следующей проверки"""
+        with self._lock:
+            self._checked[id(engine)] = (time.monotonic(), False, None)
+
+    def status(self, engine):
+        """Последняя проверка: {'available', 'lag'} или None"""
+        with self._lock:
+            checked = self._checked.get(id(engine))
+        return None if checked is None else {'available': checked[1], 'lag': checked[2]}
+
+
+replica_monitor = ReplicaMonitor()
+
+
+def replica_engine():
+    """Движок реплики, если она настроена и сейчас пригодна для чтения"""
+    engines = current_app.extensions['sqlalchemy'].engines
+    engine = engines.get(REPLICA_BIND)
+    if engine is None or not replica_monitor.available(engine):
+        return None
+    return engine
+
+
+def _wants_replica():
+    if not has_request_context() or not g.get('db_replica_reads'):
+        return False
+    # Сразу после своих изменений пользователь читает с основной базы,
+    # чтобы увидеть их, даже если реплика ещё не догнала
+    return session.get('db_primary_until', 0) <= time.time()
+
+
+class RoutingSession(Session):
+    """
+    Сессия, отправляющая чтение на реплику внутри replica_reads.
+
+    Запись (flush) и всё вне replica_reads идёт на основную базу так же,
+    как в обычной сессии Flask-SQLAlchemy.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and has_app_context() and _wants_replica():
+            engine = replica_engine()
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def replica_reads(view=None):
+    """
+    Чтение с реплики: декоратор GET-обработчиков или контекстный менеджер
+    для отдельного участка кода (with replica_reads(): ...)
+    """
+    if view is not None:
+        @wraps(view)
+        def decorated(*args, **kwargs):
+            if request.method != 'GET':
+                return view(*args, **kwargs)
+            with _replica_block():
+                return view(*args, **kwargs)
+        return decorated
+    return _replica_block()
+
+
+@contextmanager
+def _replica_block():
+    previous = g.get('db_replica_reads', False)
+    g.db_replica_reads = True
+    try:
+        yield
+    finally:
+        g.db_replica_reads = previous
+
+
+def _mark_replica_failed(context):
+    """Ошибка соединения с репликой: до следующей проверки - основная база"""
+    engine = context.engine
+    failed = context.is_disconnect or isinstance(context.sqlalchemy_exception, OperationalError)
+    if failed and engine is not None and has_app_context():
+        if current_app.extensions['sqlalchemy'].engines.get(REPLICA_BIND) is engine:
+            replica_monitor.mark_failed(engine)
+
+
+def _after_flush(db_session, flush_context):
+    db_session.info['db_written'] = True
+
+
+def _after_commit(db_session):
+    # После своих изменений - чтение с основной базы REPLICA_STICKY_SECONDS
+    if db_session.info.pop('db_written', False) and has_request_context():
+        sticky = current_app.config.get('REPLICA_STICKY_SECONDS', 0)
+        if sticky and REPLICA_BIND in current_app.config.get('SQLALCHEMY_BINDS', {}):
+            session['db_primary_until'] = time.time() + sticky
+
+
+def _after_rollback(db_session):
+    db_session.info.pop('db_written', None)
+
+
+event.listen(Engine, 'handle_error', _mark_replica_failed)
+event.listen(RoutingSession, 'after_flush', _after_flush)
+event.listen(RoutingSession, 'after_commit', _after_commit)
+event.listen(RoutingSession, 'after_rollback', _after_rollback)
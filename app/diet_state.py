@@ -0,0 +1,50 @@
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+
+STATE_SALT = 'diet-state'
+
+# Сколько секунд токен состояния действителен
+STATE_MAX_AGE = 3600
+
+
+def dump_state(secret_key, user_id, ingredient_ids, initial_amounts, targets,
+               solver, solver_options, solution):
+    """
+    Подписанный токен состояния расчёта для быстрого пересчёта
+
+    В токене - состав задачи (ингредиенты, начальные количества, метод),
+    цели и неокруглённое решение с множителями для тёплого старта. Подпись
+    не даёт подменить ингредиенты, а сами ингредиенты при пересчёте всё равно
+    берутся из каталога пользователя.
+    """
+    dual = solution.get('dual')
+    payload = {
+        'u': user_id,
+        'i': list(ingredient_ids),
+        'a': list(initial_amounts) if initial_amounts is not None else None,
+        't': {key: float(value) for key, value in targets.items()},
+        's': solver,
+        'o': solver_options,
+        'x': [round(float(value), 3) for value in solution['x']],
+        'd': [float(value) for value in dual] if dual is not None else None
+    }
+    return URLSafeTimedSerializer(secret_key, salt=STATE_SALT).dumps(payload)
+
+
+def load_state(secret_key, token, user_id, max_age=STATE_MAX_AGE):
+    """Проверить токен и вернуть состояние или None (чужой, испорченный, устаревший)"""
+    try:
+        payload = URLSafeTimedSerializer(secret_key, salt=STATE_SALT).loads(token, max_age=max_age)
+    except BadSignature:
+        return None
+
+    if payload.get('u') != user_id:
+        return None
+
+    return {
+        'ingredient_ids': payload['i'],
+        'initial_amounts': payload['a'],
+        'targets': payload['t'],
+        'solver': payload['s'],
+        'solver_options': payload['o'],
+        'warm_start': {'x': payload['x'], 'dual': payload['d']}
+    }
@@ -1,6 +1,6 @@
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, BooleanField, SubmitField, TextAreaField, FloatField, IntegerField, SelectField
-from wtforms.validators import DataRequired, Email, EqualTo, Length, ValidationError, Optional
+from wtforms.validators import DataRequired, Email, EqualTo, Length, ValidationError, Optional, NumberRange
 from app.models import User
 
 class LoginForm(FlaskForm):
@@ -59,4 +59,12 @@ class CalculationForm(FlaskForm):
     target_proteins = FloatField('Целевые белки (г)', validators=[DataRequired()])
     target_fats = FloatField('Целевые жиры (г)', validators=[DataRequired()])
     target_carbs = FloatField('Целевые углеводы (г)', validators=[DataRequired()])
+    integer_portions = BooleanField('Целые порции по 5г')
+    min_portion = IntegerField('Минимальная порция (г)', default=5,
+                               validators=[Optional(), NumberRange(min=0)])
+    tolerance = FloatField('Допуск по КБЖУ (%)', default=10,
+                           validators=[Optional(), NumberRange(min=0)])
+    auto_select = BooleanField('Подобрать ингредиенты автоматически')
+    max_ingredients = IntegerField('Сколько ингредиентов подобрать', default=5,
+                                   validators=[Optional(), NumberRange(min=1, max=15)])
     submit = SubmitField('Рассчитать')
\ No newline at end of file
@@ -0,0 +1,220 @@
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import func, update
+from app import db
+from app.models import CalculationJob
+from app.calculation import (calculate_optimal_diet, result_to_dict,
+                             recipes_to_dict, solver_settings, choose_ingredients,
+                             target_keys, DEFAULT_AUTO_INGREDIENTS)
+from app.cache import solution_cache
+from app.catalog import nutrient_catalog
+from app.recipe_match import best_recipes
+
+STATUS_PENDING = 'pending'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+
+def enqueue_calculation(user_id, payload):
+    """Поставить расчёт в очередь"""
+    job = CalculationJob(user_id=user_id, payload=payload, status=STATUS_PENDING)
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def claim_next_job(worker_name):
+    """
+    Взять следующее задание из очереди.
+
+    SELECT ... FOR UPDATE SKIP LOCKED: задания, которые уже забирает другой
+    воркер (на любой машине), пропускаются без ожидания блокировки.
+    """
+    job = (CalculationJob.query
+           .filter(CalculationJob.status == STATUS_PENDING)
+           .order_by(CalculationJob.id)
+           .with_for_update(skip_locked=True)
+           .first())
+
+    if job is None:
+        db.session.rollback()
+        return None
+
+    job.status = STATUS_RUNNING
+    job.attempts += 1
+    job.worker = worker_name
+    job.started_at = job.heartbeat_at = datetime.utcnow()
+    db.session.commit()
+    return job
+
+
+@contextmanager
+def heartbeat(job_id, worker_name, interval):
+    """
+    Пока выполняется блок, раз в interval секунд обновлять отметку задания.
+
+    Отметка пишется из отдельного потока своим соединением, поэтому долгий
+    расчёт не считается зависшим, а транзакция сессии воркера не затрагивается.
+    """
+    engine = db.engine
+    logger = current_app.logger
+    statement = (update(CalculationJob.__table__)
+                 .where(CalculationJob.id == job_id, CalculationJob.worker == worker_name))
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(interval):
+            try:
+                with engine.begin() as connection:
+                    connection.execute(statement.values(heartbeat_at=datetime.utcnow()))
+            except Exception:
+                logger.exception('Не удалось обновить отметку задания %s', job_id)
+
+    thread = threading.Thread(target=beat, name=f'job-heartbeat-{job_id}', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def run_calculation(user_id, payload):
+    """Выполнить расчёт задания и вернуть результат в виде JSON"""
+    targets = {key: float(value) for key, value in payload['targets'].items()}
+    keys = target_keys(targets)
+    catalog = nutrient_catalog.view(user_id)
+
+    if payload.get('auto_select'):
+        chosen = choose_ingredients(catalog.ids, catalog.matrix(keys), targets,
+                                    payload.get('max_ingredients') or DEFAULT_AUTO_INGREDIENTS)
+        ingredients, _, nutrients = catalog.load_selected(
+            [{'ingredient_id': ingredient_id} for ingredient_id, _ in chosen], keys
+        )
+        amounts = None
+    else:
+        ingredients, amounts, nutrients = catalog.load_selected(payload.get('ingredients'), keys)
+
+    solver, solver_options = solver_settings(current_app.config,
+                                             payload.get('integer_portions', False),
+                                             payload.get('min_portion'),
+                                             payload.get('tolerance'))
+
+    result = calculate_optimal_diet(ingredients, targets, amounts,
+                                    solver=solver, solver_options=solver_options,
+                                    cache=solution_cache, nutrients=nutrients)
+    data = result_to_dict(result)
+
+    if result['success']:
+        data['best_recipes'] = recipes_to_dict(
+            best_recipes(user_id, result['ingredients'], catalog)
+        )
+
+    return data
+
+
+def process_job(job, worker_name, heartbeat_interval=30):
+    """
+    Выполнить взятое задание и сохранить результат или ошибку.
+
+    Результат сохраняется, только если задание всё ещё за этим воркером:
+    если его успели вернуть в очередь и отдать другому, чужой статус не
+    перезаписывается.
+
+    Args:
+        job: задание, взятое claim_next_job
+        worker_name: имя воркера, взявшего задание
+        heartbeat_interval: как часто обновлять отметку задания, с
+
+    Returns:
+        True, если результат сохранён
+    """
+    job_id = job.id
+
+    with heartbeat(job_id, worker_name, heartbeat_interval):
+        try:
+            values = {'result': run_calculation(job.user_id, job.payload),
+                      'status': STATUS_DONE, 'error': None}
+        except Exception as e:
+            db.session.rollback()
+            values = {'status': STATUS_FAILED, 'error': str(e)}
+
+    values['finished_at'] = datetime.utcnow()
+    saved = CalculationJob.query.filter(
+        CalculationJob.id == job_id,
+        CalculationJob.worker == worker_name,
+        CalculationJob.status == STATUS_RUNNING
+    ).update(values, synchronize_session=False)
+    db.session.commit()
+
+    if not saved:
+        current_app.logger.warning('Задание %s больше не за воркером %s, результат отброшен',
+                                   job_id, worker_name)
+    return bool(saved)
+
+
+def requeue_stale_jobs(timeout, max_attempts):
+    """
+    Вернуть в очередь задания, зависшие в статусе running (воркер упал).
+
+    Зависшим считается задание, отметка которого не обновлялась timeout секунд.
+    Задания, исчерпавшие max_attempts, помечаются как failed.
+    """
+    deadline = datetime.utcnow() - timedelta(seconds=timeout)
+    stale = CalculationJob.query.filter(
+        CalculationJob.status == STATUS_RUNNING,
+        func.coalesce(CalculationJob.heartbeat_at, CalculationJob.started_at) < deadline
+    )
+
+    failed = stale.filter(CalculationJob.attempts >= max_attempts).update(
+        {'status': STATUS_FAILED, 'error': 'Превышено число попыток',
+         'finished_at': datetime.utcnow()},
+        synchronize_session=False
+    )
+    requeued = stale.filter(CalculationJob.attempts < max_attempts).update(
+        {'status': STATUS_PENDING, 'worker': None},
+        synchronize_session=False
+    )
+    db.session.commit()
+    return requeued, failed
+
+
+def work(poll_interval=1.0, once=False, worker_name=None):
+    """
+    Цикл воркера: забирать и выполнять задания, пока очередь не пуста.
+
+    Зависшие задания ищутся не чаще раза в JOB_REQUEUE_INTERVAL секунд.
+
+    Args:
+        poll_interval: пауза при пустой очереди, с
+        once: выйти, как только очередь опустеет
+        worker_name: имя воркера в заданиях (по умолчанию host:pid)
+    """
+    worker_name = worker_name or f'{socket.gethostname()}:{os.getpid()}'
+    timeout = current_app.config.get('JOB_STALE_TIMEOUT', 600)
+    max_attempts = current_app.config.get('JOB_MAX_ATTEMPTS', 3)
+    heartbeat_interval = current_app.config.get('JOB_HEARTBEAT_INTERVAL', 30)
+    requeue_interval = current_app.config.get('JOB_REQUEUE_INTERVAL', 60)
+    next_requeue = 0.0
+    processed = 0
+
+    while True:
+        if time.monotonic() >= next_requeue:
+            requeue_stale_jobs(timeout, max_attempts)
+            next_requeue = time.monotonic() + requeue_interval
+
+        job = claim_next_job(worker_name)
+        if job is None:
+            if once:
+                return processed
+            time.sleep(poll_interval)
+            continue
+
+        process_job(job, worker_name, heartbeat_interval)
+        processed += 1
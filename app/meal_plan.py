@@ -0,0 +1,179 @@
+import numpy as np
+from scipy import sparse
+from scipy.optimize import linprog
+from app.solvers import MAX_GRAMS, MIN_PORTION, nutrient_matrix, round_portions
+from app.calculation import NUTRIENT_KEYS
+
+DAYS_PER_WEEK = 7
+
+# Вес отклонения от дневной цели относительно отклонения от цели приёма пищи
+DAY_WEIGHT = 2.0
+
+# Один ингредиент не может дать больше этой доли калорий приёма пищи
+MAX_MEAL_SHARE = 1.5
+
+# Сколько раз можно перерешать задачу, запрещая лишние появления ингредиентов
+MAX_VARIETY_ROUNDS = 30
+
+
+def plan_week(available_ingredients, meal_targets, day_targets=None, days=DAYS_PER_WEEK,
+              max_weekly_uses=None):
+    """
+    Составить план питания на неделю одной задачей оптимизации
+
+    Переменные - граммы каждого ингредиента в каждом приёме пищи каждого дня.
+    Матрицы ограничений собираются из матрицы КБЖУ блоками (scipy.sparse.kron),
+    поэтому вся неделя решается одним вызовом HiGHS вместо days * meals
+    отдельных расчётов. Минимизируется сумма относительных отклонений
+    от целей приёмов пищи и дней (задача ЛП).
+
+    Ограничение разнообразия решается не целочисленной задачей (HiGHS
+    не успевает доказать оптимальность за разумное время), а повторными
+    ЛП: у ингредиента, который встречается чаще max_weekly_uses, остаются
+    приёмы с наибольшими граммами, в остальных он запрещается. Обычно
+    хватает нескольких раундов по 10-20 мс.
+
+    Args:
+        available_ingredients: список объектов Ingredient
+        meal_targets: список словарей КБЖУ, по одному на приём пищи в день
+        day_targets: словарь КБЖУ на день (если None, то не учитывается)
+        days: число дней
+        max_weekly_uses: в скольких приёмах пищи за период может встречаться
+            один ингредиент (если None, то без ограничения)
+
+    Returns:
+        Словарь с планом по дням и приёмам пищи
+    """
+    if not available_ingredients:
+        return {'success': False, 'error': 'Нет доступных ингредиентов'}
+
+    if not meal_targets:
+        return {'success': False, 'error': 'Укажите цели хотя бы для одного приёма пищи'}
+
+    n = len(available_ingredients)
+    n_meals = len(meal_targets)
+    n_slots = days * n_meals
+    n_nutrients = len(NUTRIENT_KEYS)
+    per_gram = nutrient_matrix(available_ingredients)
+    nutrients = sparse.csr_matrix(per_gram)
+
+    meal_vectors = np.array([[t[key] for key in NUTRIENT_KEYS] for t in meal_targets], dtype=float)
+    meal_goal = np.tile(meal_vectors.ravel(), days)
+    use_day = day_targets is not None
+    day_vector = np.array([day_targets[key] for key in NUTRIENT_KEYS], dtype=float) if use_day else None
+
+    # Порядок переменных: x (n_slots * n), s+/s- по приёмам (n_slots * 4),
+    # [u+/u- по дням (days * 4)]
+    n_x = n_slots * n
+    n_s = n_slots * n_nutrients
+    n_u = days * n_nutrients if use_day else 0
+
+    meal_scale = 1 / np.maximum(np.abs(meal_goal), 1.0)
+    cost = [np.zeros(n_x), meal_scale, meal_scale]
+    if use_day:
+        day_scale = DAY_WEIGHT / np.maximum(np.abs(np.tile(day_vector, days)), 1.0)
+        cost += [day_scale, day_scale]
+    cost = np.concatenate(cost)
+
+    # КБЖУ каждого приёма пищи: A x_slot - s+ + s- = цель приёма
+    eye_s = sparse.identity(n_s, format='csr')
+    meal_rows = [sparse.kron(sparse.identity(n_slots), nutrients), -eye_s, eye_s]
+    if use_day:
+        meal_rows.append(sparse.csr_matrix((n_s, 2 * n_u)))
+    rows = [sparse.hstack(meal_rows)]
+    goal = [meal_goal]
+
+    # КБЖУ каждого дня: сумма по приёмам - u+ + u- = цель дня
+    if use_day:
+        eye_u = sparse.identity(n_u, format='csr')
+        day_block = sparse.kron(sparse.identity(days),
+                                sparse.kron(np.ones((1, n_meals)), nutrients))
+        rows.append(sparse.hstack([day_block, sparse.csr_matrix((n_u, 2 * n_s)), -eye_u, eye_u]))
+        goal.append(np.tile(day_vector, days))
+
+    a_eq = sparse.vstack(rows, format='csr')
+    b_eq = np.concatenate(goal)
+
+    # Верхняя граница граммов ингредиента в каждом приёме
+    max_grams = np.full(n_x, float(MAX_GRAMS))
+    meal_calories = np.repeat(np.tile(meal_vectors[:, 0], days), n)
+    calories_per_gram = np.tile(per_gram[0], n_slots)
+    limited = (calories_per_gram > 0) & (meal_calories > 0)
+    max_grams[limited] = np.minimum(max_grams[limited],
+                                    MAX_MEAL_SHARE * meal_calories[limited] / calories_per_gram[limited])
+    upper = np.concatenate([max_grams, np.full(2 * n_s + 2 * n_u, np.inf)])
+    bounds = np.column_stack([np.zeros(len(cost)), upper])
+
+    for _ in range(MAX_VARIETY_ROUNDS + 1):
+        result = linprog(cost, A_eq=a_eq, b_eq=b_eq, bounds=bounds, method='highs')
+        if not result.success:
+            return {'success': False, 'error': f'Ошибка оптимизации: {result.message}'}
+
+        grams = round_portions(result.x[:n_x]).reshape(n_slots, n)
+        if max_weekly_uses is None:
+            break
+
+        excess = _excess_uses(grams, max_weekly_uses)
+        if not excess.any():
+            break
+        bounds[:n_x, 1][excess.ravel()] = 0
+    else:
+        # Раунды закончились: лишние появления просто убираются из плана
+        grams[excess] = 0
+
+    return _build_plan(available_ingredients, grams.reshape(days, n_meals, n),
+                       meal_targets, day_targets)
+
+
+def _excess_uses(grams, max_uses):
+    """
+    Маска лишних появлений ингредиентов (приёмы x ингредиенты): у каждого
+    ингредиента остаются max_uses приёмов с наибольшими граммами
+    """
+    used = grams >= MIN_PORTION
+    order = np.argsort(-grams, axis=0, kind='stable')
+    rank = np.empty_like(order)
+    np.put_along_axis(rank, order, np.arange(grams.shape[0])[:, None], axis=0)
+    return used & (rank >= max_uses)
+
+
+def _build_plan(available_ingredients, grams, meal_targets, day_targets):
+    """Собрать словарь плана из матрицы граммов (дни x приёмы x ингредиенты)"""
+    per_gram = nutrient_matrix(available_ingredients)
+    days = []
+    uses = {}
+
+    for day_index, day_grams in enumerate(grams):
+        meals = []
+        for meal_index, meal_grams in enumerate(day_grams):
+            totals = per_gram @ meal_grams
+            ingredients = []
+            for i in np.flatnonzero(meal_grams):
+                ing = available_ingredients[i]
+                ingredients.append({'id': ing.id, 'name': ing.name, 'grams': float(meal_grams[i])})
+                uses[ing.id] = uses.get(ing.id, 0) + 1
+
+            meals.append({
+                'meal': meal_index + 1,
+                'ingredients': ingredients,
+                'total_nutrition': _nutrition_dict(totals),
+                'target_nutrition': meal_targets[meal_index],
+                'total_weight': float(meal_grams.sum())
+            })
+
+        days.append({
+            'day': day_index + 1,
+            'meals': meals,
+            'total_nutrition': _nutrition_dict(per_gram @ day_grams.sum(axis=0)),
+            'target_nutrition': day_targets
+        })
+
+    return {
+        'success': True,
+        'days': days,
+        'ingredient_uses': uses
+    }
+
+
+def _nutrition_dict(values):
+    return {key: round(float(value), 1) for key, value in zip(NUTRIENT_KEYS, values)}
@@ -1,5 +1,11 @@
+from collections import namedtuple
 from datetime import datetime
 from flask_login import UserMixin
+from markupsafe import escape, Markup
+from sqlalchemy import DDL, case, cast, event, func, insert, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import contains_eager, selectinload, undefer
 from werkzeug.security import generate_password_hash, check_password_hash
 from app import db
 
@@ -7,9 +13,52 @@ from app import db
 recipe_ingredients = db.Table('recipe_ingredients',
     db.Column('recipe_id', db.Integer, db.ForeignKey('recipe.id', ondelete='CASCADE'), primary_key=True),
     db.Column('ingredient_id', db.Integer, db.ForeignKey('ingredient.id', ondelete='CASCADE'), primary_key=True),
-    db.Column('amount_grams', db.Integer, nullable=False, default=100)
+    db.Column('amount_grams', db.Integer, nullable=False, default=100),
+    # Рецепты по ингредиенту (подбор рецептов, пересчёт итогов)
+    db.Index('ix_recipe_ingredients_ingredient_id', 'ingredient_id')
 )
 
+def trgm_available(bind):
+    """Можно ли создать индексы pg_trgm (PostgreSQL с установленным расширением)"""
+    return bind.dialect.name == 'postgresql' and bind.execute(
+        text("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+    ).scalar() is not None
+
+def _if_trgm(ddl, target, bind, **kw):
+    return trgm_available(bind)
+
+# Триграммные индексы для поиска по названию (ILIKE '%...%'): расширение
+# создаётся до таблиц (create_all; в миграциях - свой шаг). Без pg_trgm
+# на сервере индексы просто не создаются
+event.listen(db.metadata, 'before_create',
+             DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(callable_=_if_trgm))
+
+def _name_trgm_index(table):
+    """GIN-индекс pg_trgm по name"""
+    return db.Index(f'ix_{table}_name_trgm', 'name', postgresql_using='gin',
+                    postgresql_ops={'name': 'gin_trgm_ops'}).ddl_if(callable_=_if_trgm)
+
+def _public_index(table, column):
+    """Частичный индекс общих записей (только PostgreSQL)"""
+    return db.Index(f'ix_{table}_public_{column}', column,
+                    postgresql_where=db.text('is_public')).ddl_if(dialect='postgresql')
+
+def visible_query(model, user_id, *criteria, options=()):
+    """
+    Записи model (Ingredient, Recipe), видимые пользователю: общие и его
+    личные, с условиями criteria
+
+    Вместо user_id = X OR is_public - UNION ALL двух веток: общие по
+    частичному индексу, личные по индексу user_id. Сортировка, пагинация
+    и опции загрузки применяются к результату как к обычному запросу;
+    options - опции обеих веток (например, undefer для отложенных столбцов,
+    по которым сортируется результат).
+    """
+    public = model.query.options(*options).filter(model.is_public == True, *criteria)
+    own = model.query.options(*options).filter(model.user_id == user_id,
+                                               model.is_public.isnot(True), *criteria)
+    return public.union_all(own)
+
 class User(UserMixin, db.Model):
     tablename = 'user'
     
@@ -30,11 +79,16 @@ class User(UserMixin, db.Model):
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
     
-    def repr(self):
+    def __repr__(self):
         return f'<User {self.username}>'
 
 class Ingredient(db.Model):
     tablename = 'ingredient'
+    __table_args__ = (
+        db.Index('ix_ingredient_user_id_name', 'user_id', 'name'),
+        _public_index('ingredient', 'name'),
+        _name_trgm_index('ingredient'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -44,10 +98,41 @@ class Ingredient(db.Model):
     carbs = db.Column(db.Float, nullable=False)     # на 100г
     is_public = db.Column(db.Boolean, default=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     
-    # Связь с рецептами
-    recipes = db.relationship('Recipe', secondary=recipe_ingredients, back_populates='ingredients')
+    # Связь с рецептами (только чтение, записи - через RecipeIngredient)
+    recipes = db.relationship('Recipe', secondary=recipe_ingredients, back_populates='ingredients',
+                              viewonly=True)
+    recipe_items = db.relationship('RecipeIngredient', back_populates='ingredient',
+                                   cascade='all, delete-orphan')
+
+    # Дополнительные нутриенты (клетчатка, сахар, натрий...) - см. Nutrient;
+    # загружаются вместе с ингредиентом, чтобы КБЖУ рецепта не требовало запросов
+    extra = db.relationship('IngredientNutrientValues', uselist=False, backref='ingredient',
+                            cascade='all, delete-orphan', lazy='joined')
+
+    @property
+    def extra_nutrients(self):
+        """Значения дополнительных нутриентов на 100г: {ключ: значение}"""
+        return dict(self.extra.values) if self.extra is not None else {}
+
+    @staticmethod
+    def existing_ids(ingredient_ids):
+        """Какие из id ингредиентов есть в базе (один запрос IN)"""
+        ingredient_ids = list(ingredient_ids)
+        if not ingredient_ids:
+            return set()
+        return set(db.session.execute(
+            select(Ingredient.id).where(Ingredient.id.in_(ingredient_ids))
+        ).scalars())
+
+    def set_extra_nutrients(self, values):
+        """Заменить значения дополнительных нутриентов (нулевые не хранятся)"""
+        values = {key: float(value) for key, value in (values or {}).items() if value}
+        if self.extra is None:
+            self.extra = IngredientNutrientValues(values=values)
+        else:
+            self.extra.values = values
     
     def to_dict(self):
         return {
@@ -58,14 +143,65 @@ class Ingredient(db.Model):
             'fats': self.fats,
             'carbs': self.carbs,
             'is_public': self.is_public,
-            'user_id': self.user_id
+            'user_id': self.user_id,
+            'extra_nutrients': self.extra_nutrients
         }
     
-    def repr(self):
+    def __repr__(self):
         return f'<Ingredient {self.name}>'
 
+class Nutrient(db.Model):
+    """Дополнительный нутриент (КБЖУ хранятся в столбцах Ingredient)"""
+    __tablename__ = 'nutrient'
+
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(32), unique=True, nullable=False)   # 'fiber', 'sugar', 'sodium'
+    name = db.Column(db.String(64), nullable=False)
+    unit = db.Column(db.String(16), nullable=False, default='г')
+    position = db.Column(db.Integer, nullable=False, default=0)   # порядок вывода
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'key': self.key,
+            'name': self.name,
+            'unit': self.unit,
+            'position': self.position
+        }
+
+class IngredientNutrientValues(db.Model):
+    """
+    Значения дополнительных нутриентов ингредиента одной строкой
+
+    Отдельная таблица, чтобы не менять таблицу ingredient: create_all
+    создаёт её и в существующей базе.
+    """
+    __tablename__ = 'ingredient_nutrient_values'
+
+    ingredient_id = db.Column(db.Integer, db.ForeignKey('ingredient.id', ondelete='CASCADE'),
+                              primary_key=True)
+    values = db.Column(db.JSON, nullable=False, default=dict)   # {ключ нутриента: значение на 100г}
+
+# Состав рецепта для карточки списка: число ингредиентов и названия первых
+# (по весу в составе) - см. Recipe.summaries
+RecipeSummary = namedtuple('RecipeSummary', ['ingredient_count', 'ingredient_names'])
+
+# Конфигурация полнотекстового поиска рецептов (PostgreSQL)
+FULLTEXT_CONFIG = 'russian'
+
+# Разделители совпадений в ts_headline: заменяются на <mark> после
+# экранирования текста рецепта
+_HEADLINE_START, _HEADLINE_STOP = '\x02', '\x03'
+
 class Recipe(db.Model):
     tablename = 'recipe'
+    __table_args__ = (
+        db.Index('ix_recipe_user_id_created_at', 'user_id', 'created_at'),
+        _public_index('recipe', 'created_at'),
+        _name_trgm_index('recipe'),
+        db.Index('ix_recipe_search_vector', 'search_vector',
+                 postgresql_using='gin').ddl_if(dialect='postgresql'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
@@ -74,45 +210,161 @@ class Recipe(db.Model):
     image_url = db.Column(db.String(500))
     is_public = db.Column(db.Boolean, default=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    
-    # Связь с ингредиентами
-    ingredients = db.relationship('Ingredient', secondary=recipe_ingredients, back_populates='recipes')
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    # Полнотекстовый индекс названия (вес A), описания (B) и инструкций (C);
+    # в PostgreSQL заполняется триггером recipe_search_vector_update, в
+    # других базах не используется
+    search_vector = db.deferred(db.Column(TSVECTOR().with_variant(db.Text(), 'sqlite')))
     
+    # Связь с ингредиентами (только чтение, записи - через RecipeIngredient)
+    ingredients = db.relationship('Ingredient', secondary=recipe_ingredients, back_populates='recipes',
+                                  viewonly=True)
+
+    # Состав с количествами: строки recipe_ingredients вместе с ингредиентами
+    items = db.relationship('RecipeIngredient', back_populates='recipe', cascade='all, delete-orphan')
+
+    # Сохранённые вес и КБЖУ рецепта (RecipeTotals.refresh) - для списков,
+    # фильтров и сортировки без пересчёта по составу
+    totals = db.relationship('RecipeTotals', uselist=False, back_populates='recipe',
+                             cascade='all, delete-orphan', lazy='joined')
+
+    @staticmethod
+    def with_items():
+        """
+        Опция запроса: состав всех рецептов выборки одним дополнительным запросом
+
+            Recipe.query.options(Recipe.with_items())
+        """
+        return selectinload(Recipe.items)
+
+    @staticmethod
+    def text_search(search):
+        """
+        Условие поиска рецептов по тексту и оценка релевантности
+
+        В PostgreSQL - полнотекстовый поиск по search_vector (websearch-синтаксис:
+        слова, "фраза", -исключение) с оценкой ts_rank, в других базах -
+        ILIKE по названию без оценки.
+
+        Returns:
+            (условие, оценка для сортировки или None, опции загрузки для
+            visible_query)
+        """
+        if db.engine.dialect.name != 'postgresql':
+            return Recipe.name.ilike(f'%{search}%'), None, ()
+
+        tsquery = func.websearch_to_tsquery(FULLTEXT_CONFIG, search)
+        return (Recipe.search_vector.op('@@')(tsquery),
+                # float8: значение оценки точно возвращается в курсоре страницы
+                cast(func.ts_rank(Recipe.search_vector, tsquery), db.Float),
+                (undefer(Recipe.search_vector),))
+
+    @staticmethod
+    def snippets(recipe_ids, search):
+        """
+        Фрагменты описания и инструкций с выделенными совпадениями
+
+        ts_headline дорогой, поэтому считается только для рецептов страницы.
+
+        Returns:
+            {id рецепта: Markup с <mark>...</mark>} (пусто вне PostgreSQL)
+        """
+        if not recipe_ids or not search or db.engine.dialect.name != 'postgresql':
+            return {}
+
+        options = (f'StartSel={_HEADLINE_START}, StopSel={_HEADLINE_STOP}, '
+                   'MaxFragments=2, MaxWords=20, MinWords=5, FragmentDelimiter=" … "')
+        document = func.concat_ws(' ', Recipe.description, Recipe.instructions)
+        rows = db.session.query(
+            Recipe.id,
+            func.ts_headline(FULLTEXT_CONFIG, document,
+                             func.websearch_to_tsquery(FULLTEXT_CONFIG, search), options)
+        ).filter(Recipe.id.in_(list(recipe_ids)))
+
+        snippets = {}
+        for recipe_id, headline in rows:
+            if headline and _HEADLINE_START in headline:
+                snippets[recipe_id] = Markup(str(escape(headline))
+                                             .replace(_HEADLINE_START, '<mark>')
+                                             .replace(_HEADLINE_STOP, '</mark>'))
+        return snippets
+
+    @staticmethod
+    def summaries(recipe_ids, names=3):
+        """
+        Состав рецептов страницы списка одним сгруппированным запросом
+
+        Строки состава нумеруются по рецепту (row_number, сначала самые
+        тяжёлые), группировка по рецепту даёт число ингредиентов и названия
+        первых names (условные MAX по номеру строки - одинаково в PostgreSQL
+        и SQLite). КБЖУ карточек - из RecipeTotals (nutrition_totals), по
+        ним же фильтруется и сортируется список.
+
+        Returns:
+            {id рецепта: RecipeSummary} для всех recipe_ids
+        """
+        recipe_ids = list(recipe_ids)
+        summaries = {recipe_id: RecipeSummary(0, []) for recipe_id in recipe_ids}
+        if not recipe_ids:
+            return summaries
+
+        links = recipe_ingredients.c
+        position = func.row_number().over(
+            partition_by=links.recipe_id,
+            order_by=(links.amount_grams.desc(), links.ingredient_id)
+        )
+        ranked = select(
+            links.recipe_id, Ingredient.name, position.label('position')
+        ).join(Ingredient, Ingredient.id == links.ingredient_id).where(
+            links.recipe_id.in_(recipe_ids)
+        ).subquery()
+
+        rows = db.session.execute(select(
+            ranked.c.recipe_id,
+            func.count(),
+            *[func.max(case((ranked.c.position == n, ranked.c.name))) for n in range(1, names + 1)]
+        ).group_by(ranked.c.recipe_id))
+
+        for recipe_id, count, *first in rows:
+            summaries[recipe_id] = RecipeSummary(count, [name for name in first if name is not None])
+        return summaries
+
     def get_ingredient_amount(self, ingredient_id):
         """Получить количество ингредиента в рецепте"""
-        from sqlalchemy import select
-        
-        stmt = select(recipe_ingredients.c.amount_grams).where(
-            recipe_ingredients.c.recipe_id == self.id,
-            recipe_ingredients.c.ingredient_id == ingredient_id
-        )
-        result = db.session.execute(stmt).fetchone()
-        return result[0] if result else 0
+        for item in self.items:
+            if item.ingredient_id == ingredient_id:
+                return item.amount_grams
+        return 0
     
     def calculate_nutrition(self):
-        """Рассчитать КБЖУ для всего рецепта"""
-        total_calories = 0
-        total_proteins = 0
-        total_fats = 0
-        total_carbs = 0
-        
-        for ingredient in self.ingredients:
-            amount = self.get_ingredient_amount(ingredient.id)
+        """Рассчитать КБЖУ (и дополнительные нутриенты) для всего рецепта"""
+        totals = {'calories': 0, 'proteins': 0, 'fats': 0, 'carbs': 0}
+
+        for item in self.items:
+            ingredient, amount = item.ingredient, item.amount_grams
             if amount:
-                # Пересчитываем КБЖУ на фактическое количество
-                total_calories += (ingredient.calories * amount / 100)
-                total_proteins += (ingredient.proteins * amount / 100)
-                total_fats += (ingredient.fats * amount / 100)
-                total_carbs += (ingredient.carbs * amount / 100)
-        
-        return {
-            'calories': round(total_calories, 1),
-            'proteins': round(total_proteins, 1),
-            'fats': round(total_fats, 1),
-            'carbs': round(total_carbs, 1)
-        }
-    
+                # Пересчитываем на фактическое количество
+                totals['calories'] += ingredient.calories * amount / 100
+                totals['proteins'] += ingredient.proteins * amount / 100
+                totals['fats'] += ingredient.fats * amount / 100
+                totals['carbs'] += ingredient.carbs * amount / 100
+                for key, value in ingredient.extra_nutrients.items():
+                    totals[key] = totals.get(key, 0) + value * amount / 100
+
+        return {key: round(value, 1) for key, value in totals.items()}
+
+    def nutrition_totals(self):
+        """
+        КБЖУ рецепта из сохранённых итогов (если их ещё нет - расчёт по составу)
+
+        Дополнительных нутриентов в итогах нет (см. RecipeTotals) - они
+        только в calculate_nutrition.
+        """
+        if self.totals is None:
+            return self.calculate_nutrition()
+        return self.totals.to_dict()
+
     def to_dict(self):
         data = {
             'id': self.id,
@@ -126,15 +378,296 @@ class Recipe(db.Model):
             'ingredients': []
         }
         
-        for ingredient in self.ingredients:
-            amount = self.get_ingredient_amount(ingredient.id)
-            if amount:
+        for item in self.items:
+            if item.amount_grams:
                 data['ingredients'].append({
-                    **ingredient.to_dict(),
-                    'amount_grams': amount
+                    **item.ingredient.to_dict(),
+                    'amount_grams': item.amount_grams
                 })
         
         return data
     
-    def repr(self):
-        return f'<Recipe {self.name}>'
\ No newline at end of file
+    def __repr__(self):
+        return f'<Recipe {self.name}>'
+
+# Триггер поддержки Recipe.search_vector (PostgreSQL); тот же SQL - в миграции
+RECIPE_SEARCH_TRIGGER = f"""
+CREATE OR REPLACE FUNCTION recipe_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('{FULLTEXT_CONFIG}', coalesce(NEW.name, '')), 'A') ||
+        setweight(to_tsvector('{FULLTEXT_CONFIG}', coalesce(NEW.description, '')), 'B') ||
+        setweight(to_tsvector('{FULLTEXT_CONFIG}', coalesce(NEW.instructions, '')), 'C');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS recipe_search_vector_update ON recipe;
+CREATE TRIGGER recipe_search_vector_update
+    BEFORE INSERT OR UPDATE OF name, description, instructions ON recipe
+    FOR EACH ROW EXECUTE FUNCTION recipe_search_vector_update();
+"""
+
+event.listen(Recipe.__table__, 'after_create',
+             DDL(RECIPE_SEARCH_TRIGGER).execute_if(dialect='postgresql'))
+
+class RecipeIngredient(db.Model):
+    """Ингредиент рецепта с количеством (строка таблицы recipe_ingredients)"""
+    __table__ = recipe_ingredients
+
+    recipe = db.relationship('Recipe', back_populates='items')
+    # Ингредиент загружается тем же запросом, что и состав
+    ingredient = db.relationship('Ingredient', back_populates='recipe_items', lazy='joined')
+
+    def __repr__(self):
+        return f'<RecipeIngredient {self.recipe_id}:{self.ingredient_id} {self.amount_grams}г>'
+
+    @staticmethod
+    def write_amounts(recipe, amounts):
+        """
+        Записать состав рецепта разницей с текущим
+
+        Текущий состав читается одним запросом с блокировкой строки рецепта
+        (одновременные правки одного рецепта выполняются по очереди), затем
+        не больше трёх запросов: DELETE убранных, один многострочный INSERT
+        добавленных и один UPDATE с CASE для изменённых количеств. Строки
+        без изменений не трогаются. Коммит и RecipeTotals.refresh - за
+        вызывающим кодом.
+
+        Args:
+            recipe: рецепт (уже с id)
+            amounts: {id ингредиента: граммы} - новый состав целиком
+
+        Returns:
+            Число добавленных, изменённых и удалённых строк
+        """
+        table = recipe_ingredients
+        db.session.flush()
+        db.session.execute(select(Recipe.id).where(Recipe.id == recipe.id).with_for_update())
+        current = dict(db.session.execute(
+            select(table.c.ingredient_id, table.c.amount_grams).where(table.c.recipe_id == recipe.id)
+        ).all())
+
+        removed = [ingredient_id for ingredient_id in current if ingredient_id not in amounts]
+        added = [{'recipe_id': recipe.id, 'ingredient_id': ingredient_id, 'amount_grams': grams}
+                 for ingredient_id, grams in amounts.items() if ingredient_id not in current]
+        changed = {ingredient_id: grams for ingredient_id, grams in amounts.items()
+                   if ingredient_id in current and current[ingredient_id] != grams}
+
+        if removed:
+            db.session.execute(table.delete().where(table.c.recipe_id == recipe.id,
+                                                    table.c.ingredient_id.in_(removed)))
+        if added:
+            db.session.execute(insert(table).values(added))
+        if changed:
+            db.session.execute(
+                table.update()
+                .where(table.c.recipe_id == recipe.id, table.c.ingredient_id.in_(list(changed)))
+                .values(amount_grams=case(changed, value=table.c.ingredient_id))
+            )
+
+        count = len(removed) + len(added) + len(changed)
+        if count:
+            _composition_changed(recipe)
+        return count
+
+class RecipeTotals(db.Model):
+    """
+    Вес и КБЖУ рецепта целиком, пересчитываются при изменении состава
+    и ингредиентов (refresh в той же транзакции)
+
+    Отдельная таблица, как IngredientNutrientValues; итоги рецептов,
+    созданных до её появления, досчитывает миграция 8d4f2a6c1b57
+    (в коде - refresh_missing).
+
+    Хранятся только вес и КБЖУ: дополнительные нутриенты (Nutrient) лежат
+    у ингредиентов JSON-словарём, а не столбцами, и в итоги не попадают.
+    Поэтому списки рецептов, их фильтры и сортировки видят только КБЖУ;
+    дополнительные нутриенты рецепта считает calculate_nutrition по составу.
+    """
+    __tablename__ = 'recipe_totals'
+
+    recipe_id = db.Column(db.Integer, db.ForeignKey('recipe.id', ondelete='CASCADE'), primary_key=True)
+    weight = db.Column(db.Float, nullable=False, default=0)              # г
+    calories = db.Column(db.Float, nullable=False, default=0, index=True)
+    proteins = db.Column(db.Float, nullable=False, default=0, index=True)
+    fats = db.Column(db.Float, nullable=False, default=0)
+    carbs = db.Column(db.Float, nullable=False, default=0)
+
+    recipe = db.relationship('Recipe', back_populates='totals')
+
+    # Диапазоны фильтра списков рецептов: параметр запроса -> столбец
+    RANGE_FILTERS = ('calories', 'proteins')
+
+    def to_dict(self):
+        return {
+            'calories': round(self.calories, 1),
+            'proteins': round(self.proteins, 1),
+            'fats': round(self.fats, 1),
+            'carbs': round(self.carbs, 1)
+        }
+
+    @staticmethod
+    def refresh(recipe_ids=None, ingredient_ids=None):
+        """
+        Пересчитать итоги рецептов одним INSERT ... SELECT ... ON CONFLICT
+        DO UPDATE по составу
+
+        Строки рецептов сначала блокируются (FOR UPDATE, по возрастанию id):
+        одновременные пересчёты одного рецепта (правка ингредиента и правка
+        рецепта) выполняются по очереди, и второй считает по составу,
+        закоммиченному первым.
+
+        Args:
+            recipe_ids: id рецептов
+            ingredient_ids: или id изменённых ингредиентов - пересчитываются
+                все рецепты, где они есть
+
+        Коммит - за вызывающим кодом. Изменённые id копятся в
+        session.info['recipe_totals_changed'] (None - все рецепты) для
+        поиска по КБЖУ (app.recipe_search).
+        """
+        db.session.flush()
+        if recipe_ids is not None:
+            recipes = list(recipe_ids)
+        elif ingredient_ids is not None:
+            recipes = list(db.session.execute(
+                select(recipe_ingredients.c.recipe_id).where(
+                    recipe_ingredients.c.ingredient_id.in_(list(ingredient_ids))
+                ).distinct()
+            ).scalars())
+        else:
+            recipes = select(Recipe.id)
+        _totals_changed(recipes if isinstance(recipes, list) else None)
+        if isinstance(recipes, list) and not recipes:
+            return
+
+        db.session.execute(select(Recipe.id).where(Recipe.id.in_(recipes))
+                           .order_by(Recipe.id).with_for_update())
+
+        # Запросы по таблице, а не по модели: загруженные в сессию итоги
+        # обновятся после коммита
+        RecipeTotals._insert(Recipe.id.in_(recipes), upsert=True)
+
+    @staticmethod
+    def refresh_missing():
+        """Посчитать итоги рецептов, у которых их нет (созданы до появления таблицы)"""
+        db.session.flush()
+        _totals_changed(None)
+        RecipeTotals._insert(Recipe.id.notin_(select(RecipeTotals.recipe_id)))
+
+    @staticmethod
+    def _insert(condition, upsert=False):
+        grams = func.coalesce(recipe_ingredients.c.amount_grams, 0)
+
+        def total(column):
+            return func.coalesce(func.sum(column * grams / 100.0), 0)
+
+        rows = select(
+            Recipe.id,
+            func.coalesce(func.sum(grams), 0),
+            total(Ingredient.calories),
+            total(Ingredient.proteins),
+            total(Ingredient.fats),
+            total(Ingredient.carbs)
+        ).select_from(Recipe).outerjoin(
+            recipe_ingredients, recipe_ingredients.c.recipe_id == Recipe.id
+        ).outerjoin(
+            Ingredient, Ingredient.id == recipe_ingredients.c.ingredient_id
+        ).where(condition).group_by(Recipe.id)
+
+        columns = ['recipe_id', 'weight', 'calories', 'proteins', 'fats', 'carbs']
+        table = RecipeTotals.__table__
+        # ON CONFLICT есть в PostgreSQL и SQLite (их insert() различаются);
+        # в других базах - удаление и вставка под той же блокировкой рецептов
+        insert_into = {'postgresql': postgresql.insert,
+                       'sqlite': sqlite.insert}.get(db.engine.dialect.name)
+        if not upsert or insert_into is None:
+            if upsert:
+                db.session.execute(table.delete().where(table.c.recipe_id.in_(
+                    select(Recipe.id).where(condition))))
+            db.session.execute(table.insert().from_select(columns, rows))
+            return
+
+        stmt = insert_into(table).from_select(columns, rows)
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=[table.c.recipe_id],
+            set_={column: stmt.excluded[column] for column in columns[1:]}
+        ))
+
+    @staticmethod
+    def filter_query(query, args):
+        """
+        Отбор рецептов по диапазонам КБЖУ из параметров запроса
+        (min_calories, max_calories, min_proteins, max_proteins)
+
+        Returns:
+            (запрос с присоединёнными итогами, словарь применённых границ для шаблона)
+        """
+        query = query.outerjoin(RecipeTotals, RecipeTotals.recipe_id == Recipe.id).options(
+            contains_eager(Recipe.totals))
+        ranges = {}
+        for key in RecipeTotals.RANGE_FILTERS:
+            column = getattr(RecipeTotals, key)
+            for bound in ('min', 'max'):
+                value = args.get(f'{bound}_{key}', type=float)
+                if value is None:
+                    continue
+                ranges[f'{bound}_{key}'] = value
+                query = query.filter(column >= value if bound == 'min' else column <= value)
+        return query, ranges
+
+def _totals_changed(recipe_ids):
+    """Отметить в сессии рецепты с пересчитанными итогами (None - все)"""
+    info = db.session.info
+    if recipe_ids is None or info.get('recipe_totals_changed', set()) is None:
+        info['recipe_totals_changed'] = None
+    else:
+        info.setdefault('recipe_totals_changed', set()).update(recipe_ids)
+
+def _composition_changed(recipe):
+    """
+    Отметить в сессии изменённый состав рецепта для индекса подбора
+    рецептов (app.recipe_index): состав пишется запросами в обход ORM,
+    и событий Recipe при правке одного состава нет
+    """
+    pending = db.session.info.setdefault('recipe_index_invalidate', [False, set()])
+    pending[0] = pending[0] or bool(recipe.is_public)
+    pending[1].add(recipe.user_id)
+
+class CalculationJob(db.Model):
+    """Фоновый расчёт рациона (очередь заданий в PostgreSQL)"""
+    __tablename__ = 'calculation_job'
+    __table_args__ = (
+        # Частичный индекс для выборки очередного задания воркером
+        db.Index('ix_calculation_job_pending', 'id', postgresql_where=db.text("status = 'pending'")),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False, index=True)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, running, done, failed
+    payload = db.Column(db.JSON, nullable=False)
+    result = db.Column(db.JSON)
+    error = db.Column(db.Text)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    worker = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    # Воркер обновляет отметку, пока выполняет задание; по ней ищутся зависшие
+    heartbeat_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'result': self.result,
+            'error': self.error,
+            'attempts': self.attempts,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+    def __repr__(self):
+        return f'<CalculationJob {self.id} {self.status}>'
@@ -0,0 +1,266 @@
+import base64
+import binascii
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from sqlalchemy import event, literal, tuple_
+from sqlalchemy.orm import Session, object_session
+from app import db
+from app.models import Ingredient, Recipe
+
+# Если планировщик PostgreSQL оценивает выборку больше чем в столько строк,
+# точный COUNT(*) не выполняется - показывается оценка
+EXACT_COUNT_LIMIT = 10000
+
+
+class InvalidCursor(ValueError):
+    """Курсор повреждён или выдан для другой сортировки"""
+
+
+class KeysetPage:
+    """
+    Страница списка при пагинации по ключу (курсору)
+
+    items - записи страницы, next_cursor/prev_cursor - курсоры соседних
+    страниц (None, если страницы нет), total - число записей (оценка,
+    если total_estimated).
+    """
+
+    def __init__(self, items, per_page, next_cursor, prev_cursor, total, total_estimated):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+        self.total_estimated = total_estimated
+
+    def __iter__(self):
+        return iter(self.items)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def to_dict(self):
+        """Поля пагинации для JSON-ответа (без записей)"""
+        return {
+            'next_cursor': self.next_cursor,
+            'prev_cursor': self.prev_cursor,
+            'per_page': self.per_page,
+            'total': self.total,
+            'total_estimated': self.total_estimated
+        }
+
+
+def encode_cursor(values, backward, sort):
+    """Курсор: значения ключей граничной записи, направление и сортировка"""
+    data = {'k': [_encode_value(value) for value in values], 'b': backward, 's': sort}
+    raw = json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, sort, size):
+    """
+    Значения ключей и направление из курсора
+
+    Raises:
+        InvalidCursor: курсор нельзя разобрать, или он выдан для другой
+            сортировки, или в нём не size ключей
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        data = json.loads(raw)
+        values = [_decode_value(value) for value in data['k']]
+        backward = bool(data['b'])
+        cursor_sort = data['s']
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise InvalidCursor('Некорректный курсор')
+    if cursor_sort != sort or len(values) != size:
+        raise InvalidCursor('Курсор выдан для другой сортировки')
+    return values, backward
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        return datetime.fromisoformat(value['dt'])
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    raise TypeError(value)
+
+
+def keyset_paginate(query, keys, cursor=None, per_page=20, descending=False, sort='',
+                    count_key=None):
+    """
+    Страница запроса по ключу вместо OFFSET
+
+    Записи упорядочиваются по keys (последний ключ - уникальный, обычно id)
+    в одном направлении, и следующая страница выбирается условием
+    (ключи) > (ключи последней записи) - его обслуживает индекс по ключам,
+    глубина страницы на время не влияет. Значения ключей выбираются тем же
+    запросом, поэтому ключом может быть и выражение (например, оценка
+    релевантности). Ключи не должны быть NULL: строка с NULL в ключе не
+    проходит сравнение с курсором и пропадает из списка, поэтому столбцы,
+    допускающие NULL (например, из внешнего соединения), передаются как
+    coalesce(столбец, значение).
+
+    Args:
+        query: запрос без сортировки (можно результат visible_query)
+        keys: выражения сортировки
+        cursor: курсор из next_cursor/prev_cursor предыдущей страницы
+        per_page: записей на странице
+        descending: сортировка по убыванию
+        sort: подпись сортировки - курсор другой сортировки не принимается
+        count_key: ключ кэша числа записей (None - не считать)
+
+    Raises:
+        InvalidCursor: курсор не подходит к этому списку
+    """
+    signature = f'{sort}:{"desc" if descending else "asc"}'
+    total, estimated = (list_counts.count(query, count_key)
+                        if count_key is not None else (None, False))
+
+    backward = False
+    if cursor:
+        values, backward = decode_cursor(cursor, signature, len(keys))
+        bound = tuple_(*[literal(value, type_=key.type) for key, value in zip(keys, values)])
+        # Назад - в обратном порядке от первой записи текущей страницы
+        after = descending == backward
+        query = query.filter(tuple_(*keys) > bound if after else tuple_(*keys) < bound)
+
+    reverse = descending != backward
+    labels = [key.label(f'keyset_{i}') for i, key in enumerate(keys)]
+    rows = query.add_columns(*labels).order_by(
+        *[label.desc() if reverse else label.asc() for label in labels]
+    ).limit(per_page + 1).all()
+
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backward:
+        rows.reverse()
+
+    def boundary(row, to_backward):
+        return encode_cursor(row[-len(keys):], to_backward, signature)
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if more or backward:
+            next_cursor = boundary(rows[-1], False)
+        if (more and backward) or (cursor and not backward):
+            prev_cursor = boundary(rows[0], True)
+
+    return KeysetPage([row[0] for row in rows], per_page, next_cursor, prev_cursor,
+                      total, estimated)
+
+
+class ListCounts:
+    """
+    Число записей списков с временем жизни.
+
+    При листании списка число не пересчитывается на каждой странице: оно
+    хранится ttl секунд по ключу списка (пользователь и фильтры). На больших
+    выборках PostgreSQL вместо COUNT(*) берётся оценка планировщика (EXPLAIN).
+    Изменения ингредиентов и рецептов в этом процессе сбрасывают кэш после
+    коммита, в других процессах он устаревает по времени.
+    """
+
+    def __init__(self, ttl=60, maxsize=1024, exact_limit=EXACT_COUNT_LIMIT):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.exact_limit = exact_limit
+        self._entries = OrderedDict()   # ключ -> (время, число, оценка ли)
+        self._lock = threading.Lock()
+
+    def configure(self, ttl=None, exact_limit=None):
+        """Изменить время жизни и порог точного подсчёта"""
+        with self._lock:
+            if ttl is not None:
+                self.ttl = ttl
+            if exact_limit is not None:
+                self.exact_limit = exact_limit
+
+    def count(self, query, key):
+        """
+        Число записей запроса: из кэша, оценка планировщика или COUNT(*)
+
+        Args:
+            query: запрос списка
+            key: ключ кэша
+
+        Returns:
+            (число записей, оценка ли это)
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] <= self.ttl:
+                self._entries.move_to_end(key)
+                return entry[1], entry[2]
+
+        # Без сортировки и присоединённых опциями таблиц: на число строк они
+        # не влияют, а оценку планировщика портят
+        query = query.order_by(None).enable_eagerloads(False)
+        total, estimated = _planner_rows(query), True
+        if total is None or total <= self.exact_limit:
+            total, estimated = query.count(), False
+
+        with self._lock:
+            self._entries[key] = (now, total, estimated)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return total, estimated
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def _planner_rows(query):
+    """Оценка числа строк запроса планировщиком PostgreSQL (None в других базах)"""
+    if db.engine.dialect.name != 'postgresql':
+        return None
+    compiled = query.statement.compile(dialect=db.engine.dialect,
+                                       compile_kwargs={'render_postcompile': True})
+    plan = db.session.connection().exec_driver_sql(
+        f'EXPLAIN (FORMAT JSON) {compiled}', compiled.params
+    ).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+list_counts = ListCounts()
+
+
+def _list_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info['list_counts_changed'] = True
+
+
+def _after_commit(session):
+    if session.info.pop('list_counts_changed', False):
+        list_counts.clear()
+
+
+def _after_rollback(session):
+    session.info.pop('list_counts_changed', None)
+
+
+for _model in (Ingredient, Recipe):
+    for _event in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(_model, _event, _list_changed)
+event.listen(Session, 'after_commit', _after_commit)
+event.listen(Session, 'after_rollback', _after_rollback)
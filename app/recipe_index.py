@@ -0,0 +1,312 @@
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from scipy import sparse
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+from app import db
+from app.models import Recipe, recipe_ingredients, visible_query
+from app.calculation import recipe_scores, recipe_nutrition_from_catalog
+
+# Сколько последних подборов помнит блок индекса: повторный расчёт с теми же
+# количествами (попадание в кэш решений) не оценивает рецепты заново
+RANK_CACHE_SIZE = 64
+
+
+class RecipeIndexBlock:
+    """
+    Часть индекса для одной группы рецептов (общие или личные одного пользователя)
+
+    matrix - разреженная матрица граммов (строки - рецепты recipe_ids,
+    столбцы - ингредиенты ingredient_ids) в CSR, pattern - она же с единицами
+    для подсчёта совпадений, by_ingredient - копия в CSC (списки рецептов по
+    ингредиенту). weights и counts - общий вес и число ингредиентов рецепта.
+    Рецепты без ингредиентов и с нулевым весом в индекс не попадают: их всё
+    равно нельзя оценить.
+
+    Блок не меняется после построения, поэтому результаты rank запоминаются
+    в нём самом (LRU на RANK_CACHE_SIZE рационов) и сбрасываются вместе с
+    блоком - по событиям Recipe и времени жизни индекса.
+    """
+
+    def __init__(self, rows):
+        # (id рецепта, id ингредиента, граммы); пустые граммы (NULL) - ноль
+        data = np.array(list(rows), dtype=float).reshape(-1, 3)
+        grams = np.nan_to_num(data[:, 2])
+
+        recipe_ids, row = np.unique(data[:, 0].astype(np.int64), return_inverse=True)
+        self.ingredient_ids, col = np.unique(data[:, 1].astype(np.int64), return_inverse=True)
+        matrix = sparse.csr_matrix((grams, (row, col)),
+                                   shape=(len(recipe_ids), len(self.ingredient_ids)))
+        matrix.sum_duplicates()
+
+        weights = np.asarray(matrix.sum(axis=1)).ravel()
+        keep = weights > 0
+        self.matrix = matrix[keep]
+        self.recipe_ids = recipe_ids[keep]
+        self.weights = weights[keep]
+        self.counts = np.diff(self.matrix.indptr)
+        self.pattern = sparse.csr_matrix((np.ones_like(self.matrix.data), self.matrix.indices,
+                                          self.matrix.indptr), shape=self.matrix.shape)
+        self.by_ingredient = self.matrix.tocsc()
+        self.rows = {int(recipe_id): i for i, recipe_id in enumerate(self.recipe_ids)}
+        self.columns = {int(ingredient_id): j for j, ingredient_id in enumerate(self.ingredient_ids)}
+        self._ranks = OrderedDict()     # (граммы рациона, top_n) -> результат rank
+        self._ranks_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.recipe_ids)
+
+    def amounts(self, row):
+        """Состав рецепта [(id ингредиента, граммы)] по номеру строки"""
+        start, end = self.matrix.indptr[row], self.matrix.indptr[row + 1]
+        return list(zip(self.ingredient_ids[self.matrix.indices[start:end]].tolist(),
+                        self.matrix.data[start:end].tolist()))
+
+    def rows_with(self, ingredient_ids):
+        """Номера строк рецептов, где есть хотя бы один из ингредиентов"""
+        cols = [self.columns[i] for i in ingredient_ids if i in self.columns]
+        if not cols:
+            return np.zeros(0, dtype=int)
+        return np.unique(self.by_ingredient[:, cols].indices)
+
+    def rank(self, optimal_weights, top_n=3):
+        """
+        Лучшие рецепты блока по оценке find_best_recipes
+
+        Совпадения и вес совпадающих ингредиентов всех рецептов считаются
+        одним произведением матрицы-шаблона CSR на два столбца (признак
+        ингредиента рациона и его граммы), лучшие отбираются argpartition
+        без полной сортировки.
+
+        Args:
+            optimal_weights: {id ингредиента: граммы в рационе}
+            top_n: сколько рецептов вернуть
+
+        Returns:
+            Список (оценка, номер строки, совпадений, % совпадения, % покрытия),
+            лучшие первыми; при равной оценке - меньший id рецепта
+        """
+        key = (tuple(sorted(optimal_weights.items())), top_n)
+        with self._ranks_lock:
+            ranked = self._ranks.get(key)
+            if ranked is not None:
+                self._ranks.move_to_end(key)
+                return ranked
+
+        ranked = self._rank(optimal_weights, top_n)
+        with self._ranks_lock:
+            self._ranks[key] = ranked
+            while len(self._ranks) > RANK_CACHE_SIZE:
+                self._ranks.popitem(last=False)
+        return ranked
+
+    def _rank(self, optimal_weights, top_n):
+        vectors = np.zeros((len(self.ingredient_ids), 2))
+        for ingredient_id, grams in optimal_weights.items():
+            col = self.columns.get(ingredient_id)
+            if col is not None:
+                vectors[col] = (1.0, grams)
+        if len(self) == 0 or not vectors[:, 0].any():
+            return []
+
+        matching = self.pattern @ vectors
+        candidates = np.flatnonzero(matching[:, 0])
+
+        score, match_percentage, weight_coverage = recipe_scores(
+            matching[candidates, 0], matching[candidates, 1],
+            self.counts[candidates], self.weights[candidates]
+        )
+        score = np.round(score, 2)
+
+        if len(candidates) > top_n:
+            # Порог top_n-й оценки; равные ему оставляем, чтобы порядок не зависел
+            # от того, какие из равных попали в раздел
+            threshold = score[np.argpartition(-score, top_n - 1)[top_n - 1]]
+            chosen = np.flatnonzero(score >= threshold)
+        else:
+            chosen = np.arange(len(candidates))
+
+        order = chosen[np.lexsort((self.recipe_ids[candidates[chosen]], -score[chosen]))][:top_n]
+        return [(float(score[i]), int(candidates[i]), int(matching[candidates[i], 0]),
+                 float(match_percentage[i]), float(weight_coverage[i]))
+                for i in order]
+
+
+class RecipeIndex:
+    """
+    Инвертированный индекс ингредиент -> рецепты для подбора рецептов.
+
+    Подбор рецептов оценивает все видимые рецепты по разреженным матрицам
+    индекса и загружает из базы только победителей (best_recipes); рецепты
+    без общих с рационом ингредиентов не рассматриваются.
+    Устроен как app.catalog.NutrientCatalog: общий блок и блоки личных
+    рецептов по пользователям, сброс по событиям Recipe и по времени жизни
+    (состав рецептов пишется в обход ORM, и другие процессы об изменениях
+    не знают).
+    """
+
+    def __init__(self, ttl=60, max_users=256):
+        self.ttl = ttl
+        self.max_users = max_users
+        self._public = None             # (время построения, RecipeIndexBlock)
+        self._private = OrderedDict()   # id пользователя -> (время, RecipeIndexBlock)
+        self._lock = threading.Lock()
+
+    def configure(self, ttl=None, max_users=None):
+        """Изменить время жизни и число пользователей в кэше"""
+        with self._lock:
+            if ttl is not None:
+                self.ttl = ttl
+            if max_users is not None:
+                self.max_users = max_users
+
+    def blocks(self, user_id):
+        """Блоки индекса, видимые пользователю: общие рецепты и его личные"""
+        with self._lock, db.session.no_autoflush:
+            now = time.monotonic()
+            if self._public is None or now - self._public[0] > self.ttl:
+                self._public = (now, _load_block(Recipe.is_public == True))
+
+            private = self._private.get(user_id)
+            if private is None or now - private[0] > self.ttl:
+                private = (now, _load_block((Recipe.user_id == user_id)
+                                            & (Recipe.is_public == False)))
+                self._private[user_id] = private
+            self._private.move_to_end(user_id)
+
+            while len(self._private) > self.max_users:
+                self._private.popitem(last=False)
+
+            return self._public[1], private[1]
+
+    def candidates(self, user_id, ingredient_ids):
+        """
+        Рецепты, видимые пользователю и содержащие хотя бы один из ингредиентов
+
+        Returns:
+            Состав кандидатов {id рецепта: [(id ингредиента, граммы)]}
+        """
+        found = {}
+        for block in self.blocks(user_id):
+            for row in block.rows_with(ingredient_ids):
+                found[int(block.recipe_ids[row])] = block.amounts(row)
+        return found
+
+    def best_recipes(self, user_id, optimal_ingredients, catalog, top_n=3):
+        """
+        Лучшие рецепты для рассчитанного рациона (тот же результат, что
+        find_best_recipes по всем видимым рецептам)
+
+        Оценка считается по матрицам индекса, из базы загружаются и получают
+        КБЖУ только top_n победителей.
+
+        Args:
+            optimal_ingredients: результат calculate_optimal_diet['ingredients']
+            catalog: каталог КБЖУ пользователя (app.catalog.CatalogView)
+            top_n: сколько рецептов вернуть
+        """
+        if not optimal_ingredients:
+            return []
+
+        weights = {ing_id: data['grams'] for ing_id, data in optimal_ingredients.items()}
+        ranked = []
+        for block in self.blocks(user_id):
+            ranked.extend((score, int(block.recipe_ids[row]), block, row, count, match, coverage)
+                          for score, row, count, match, coverage in block.rank(weights, top_n))
+        ranked.sort(key=lambda item: (-item[0], item[1]))
+        # Пока старый блок общих рецептов не сброшен, рецепт, ставший личным,
+        # есть и в нём, и в блоке владельца - оставляем одну запись
+        unique, seen = [], set()
+        for item in ranked:
+            if item[1] not in seen:
+                seen.add(item[1])
+                unique.append(item)
+        ranked = unique[:top_n]
+
+        # Видимость победителей проверяется заново: блок мог быть построен до
+        # того, как рецепт в другом процессе стал личным или сменил владельца
+        recipes = {recipe.id: recipe for recipe in
+                   visible_query(Recipe, user_id, Recipe.id.in_([item[1] for item in ranked]))
+                   } if ranked else {}
+
+        best = []
+        for score, recipe_id, block, row, count, match, coverage in ranked:
+            recipe = recipes.get(recipe_id)
+            if recipe is None:
+                # Рецепт удалён или скрыт в другом процессе, индекс ещё не сброшен
+                continue
+            best.append({
+                'recipe': recipe,
+                'score': score,
+                'matching_count': count,
+                'match_percentage': round(match, 1),
+                'weight_coverage': round(coverage, 1),
+                'recipe_weight': round(float(block.weights[row]), 1),
+                'nutrition': recipe_nutrition_from_catalog(recipe, block.amounts(row), catalog)
+            })
+        return best
+
+    def invalidate(self, public=False, user_ids=()):
+        """Сбросить общий блок и/или личные блоки пользователей"""
+        with self._lock:
+            if public:
+                self._public = None
+            for user_id in user_ids:
+                self._private.pop(user_id, None)
+
+    def clear(self):
+        self.invalidate(public=True, user_ids=list(self._private))
+
+
+def _load_block(condition):
+    """Состав рецептов группы одним запросом по таблице связей"""
+    return RecipeIndexBlock(
+        db.session.query(
+            recipe_ingredients.c.recipe_id,
+            recipe_ingredients.c.ingredient_id,
+            recipe_ingredients.c.amount_grams
+        ).join(Recipe, Recipe.id == recipe_ingredients.c.recipe_id).filter(condition)
+    )
+
+
+recipe_index = RecipeIndex()
+
+
+def _recipe_changed(mapper, connection, target):
+    """
+    Сбросить блоки, где был или стал виден рецепт.
+
+    Состав рецепта пишется после flush самого рецепта, поэтому сбрасываем
+    и сразу, и ещё раз после коммита (как каталог КБЖУ).
+    """
+    public_history = inspect(target).attrs.is_public.history
+    was_public = bool(public_history.deleted and public_history.deleted[0])
+    owner_history = inspect(target).attrs.user_id.history
+    public = bool(target.is_public) or was_public
+    user_ids = {u for u in (target.user_id, *(owner_history.deleted or ())) if u is not None}
+
+    recipe_index.invalidate(public=public, user_ids=user_ids)
+
+    session = object_session(target)
+    if session is not None:
+        pending = session.info.setdefault('recipe_index_invalidate', [False, set()])
+        pending[0] = pending[0] or public
+        pending[1].update(user_ids)
+
+
+def _after_commit(session):
+    pending = session.info.pop('recipe_index_invalidate', None)
+    if pending is not None:
+        recipe_index.invalidate(public=pending[0], user_ids=pending[1])
+
+
+def _after_rollback(session):
+    session.info.pop('recipe_index_invalidate', None)
+
+
+for _event in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(Recipe, _event, _recipe_changed)
+event.listen(Session, 'after_commit', _after_commit)
+event.listen(Session, 'after_rollback', _after_rollback)
@@ -0,0 +1,104 @@
+from flask import current_app
+from sqlalchemy import Float, Integer, Numeric, case, cast, column, func, or_, select, values
+from app import db
+from app.models import Recipe, recipe_ingredients
+from app.calculation import recipe_nutrition_from_catalog
+from app.recipe_index import recipe_index
+
+# Способы подбора рецептов (RECIPE_MATCH_ENGINE): 'index' - разреженные
+# матрицы в памяти процесса, 'sql' - один запрос к PostgreSQL
+RECIPE_MATCH_ENGINES = ('index', 'sql')
+DEFAULT_RECIPE_MATCH_ENGINE = 'index'
+
+
+def best_recipes(user_id, optimal_ingredients, catalog, top_n=3, engine=None):
+    """
+    Лучшие рецепты для рассчитанного рациона способом из конфигурации
+
+    Результат одинаковый у всех способов - как у find_best_recipes.
+
+    Args:
+        optimal_ingredients: результат calculate_optimal_diet['ingredients']
+        catalog: каталог КБЖУ пользователя (app.catalog.CatalogView)
+        top_n: сколько рецептов вернуть
+        engine: способ из RECIPE_MATCH_ENGINES (по умолчанию RECIPE_MATCH_ENGINE)
+    """
+    engine = engine or current_app.config.get('RECIPE_MATCH_ENGINE', DEFAULT_RECIPE_MATCH_ENGINE)
+    if engine == 'sql':
+        return sql_best_recipes(user_id, optimal_ingredients, catalog, top_n)
+    if engine == 'index':
+        return recipe_index.best_recipes(user_id, optimal_ingredients, catalog, top_n)
+    raise ValueError(f'Неизвестный способ подбора рецептов: {engine}')
+
+
+def sql_best_recipes(user_id, optimal_ingredients, catalog, top_n=3):
+    """
+    Подбор рецептов одним запросом (для баз, где рецептов слишком много
+    для индекса в памяти)
+
+    Состав видимых пользователю рецептов соединяется со списком VALUES
+    (id ингредиента, граммы) рациона; число совпадений, процент совпадения
+    и покрытие по весу агрегируются по рецепту, оценка та же, что в
+    find_best_recipes (0.4/0.4/0.2), сортировка и LIMIT top_n - в базе.
+    Рассматриваются только рецепты хотя бы с одним ингредиентом рациона.
+    """
+    if not optimal_ingredients:
+        return []
+
+    optimal = values(
+        column('ingredient_id', Integer), column('grams', Float), name='optimal'
+    ).data([(int(ing_id), float(data['grams'])) for ing_id, data in optimal_ingredients.items()])
+    links = recipe_ingredients.c
+
+    matching_count = func.count(optimal.c.ingredient_id)
+    recipe_weight = func.sum(func.coalesce(links.amount_grams, 0))
+    match_percentage = cast(matching_count, Float) * 100 / func.count()
+    coverage = func.coalesce(func.sum(optimal.c.grams), 0) * 100 / func.nullif(recipe_weight, 0)
+    weight_coverage = case((coverage > 100, 100.0), else_=coverage)
+    # Округление до сотых, как в find_best_recipes: при равной оценке - меньший id
+    score = func.round(cast(match_percentage * 0.4 + weight_coverage * 0.4
+                            + matching_count * 10 * 0.2, Numeric), 2)
+
+    candidates = select(links.recipe_id).where(
+        links.ingredient_id.in_([int(ing_id) for ing_id in optimal_ingredients])
+    )
+    query = select(
+        links.recipe_id,
+        score.label('score'),
+        matching_count.label('matching_count'),
+        match_percentage.label('match_percentage'),
+        weight_coverage.label('weight_coverage'),
+        recipe_weight.label('recipe_weight')
+    ).select_from(
+        recipe_ingredients.join(Recipe, Recipe.id == links.recipe_id)
+        .outerjoin(optimal, optimal.c.ingredient_id == links.ingredient_id)
+    ).where(
+        or_(Recipe.is_public == True, Recipe.user_id == user_id),
+        links.recipe_id.in_(candidates)
+    ).group_by(links.recipe_id).having(recipe_weight > 0).order_by(
+        score.desc(), links.recipe_id
+    ).limit(top_n)
+
+    ranked = db.session.execute(query).all()
+    if not ranked:
+        return []
+
+    recipes = {recipe.id: recipe for recipe in Recipe.query.options(Recipe.with_items())
+               .filter(Recipe.id.in_([row.recipe_id for row in ranked]))}
+
+    best = []
+    for row in ranked:
+        recipe = recipes.get(row.recipe_id)
+        if recipe is None:
+            continue
+        amounts = [(item.ingredient_id, item.amount_grams) for item in recipe.items]
+        best.append({
+            'recipe': recipe,
+            'score': float(row.score),
+            'matching_count': row.matching_count,
+            'match_percentage': round(float(row.match_percentage), 1),
+            'weight_coverage': round(float(row.weight_coverage), 1),
+            'recipe_weight': round(float(row.recipe_weight), 1),
+            'nutrition': recipe_nutrition_from_catalog(recipe, amounts, catalog)
+        })
+    return best
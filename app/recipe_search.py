@@ -0,0 +1,269 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from scipy.spatial import cKDTree
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+from app import db
+from app.models import Recipe, RecipeTotals
+
+# Координаты вектора рецепта (итоги RecipeTotals)
+MACRO_KEYS = ('calories', 'proteins', 'fats', 'carbs')
+
+# Нормировка координат: граммы белков, жиров и углеводов переводятся в ккал,
+# чтобы расстояние по всем осям измерялось в одних единицах
+MACRO_SCALE = np.array([1.0, 4.0, 9.0, 4.0])
+
+# Области поиска: только общие рецепты или общие плюс свои
+SCOPES = ('public', 'all')
+
+
+class MacroSearchBlock:
+    """
+    Рецепты одной группы (общие или личные одного пользователя) для поиска
+    ближайших по КБЖУ.
+
+    Основа - id и нормированные векторы рецептов, по ним строятся деревья
+    cKDTree: по одному на набор координат цели (при первом запросе с этим
+    набором). Изменения рецептов деревья не трогают: старая строка основы
+    помечается удалённой, новый вектор попадает в added и проверяется
+    перебором. Когда изменений набирается больше rebuild_ratio от основы,
+    блок перестраивается заново.
+    """
+
+    def __init__(self, rows, rebuild_ratio=0.1, min_rebuild=64):
+        # (id рецепта, ккал, белки, жиры, углеводы)
+        data = np.array(list(rows), dtype=float).reshape(-1, 1 + len(MACRO_KEYS))
+        self.ids = data[:, 0].astype(np.int64)
+        self.vectors = data[:, 1:] * MACRO_SCALE
+        self.rows = {int(recipe_id): row for row, recipe_id in enumerate(self.ids)}
+        self.removed = frozenset()      # номера устаревших строк основы
+        self.added = {}                 # id рецепта -> нормированный вектор
+        self.rebuild_ratio = rebuild_ratio
+        self.min_rebuild = min_rebuild
+        self._trees = {}
+
+    def __len__(self):
+        return len(self.ids) - len(self.removed) + len(self.added)
+
+    def patched(self, changes):
+        """
+        Новый блок с изменёнными рецептами (основа и деревья общие с этим)
+
+        Args:
+            changes: {id рецепта: (ккал, белки, жиры, углеводы) или None,
+                если рецепт удалён или больше не входит в группу}
+        """
+        removed = set(self.removed)
+        added = dict(self.added)
+        for recipe_id, vector in changes.items():
+            row = self.rows.get(recipe_id)
+            if row is not None:
+                removed.add(row)
+            added.pop(recipe_id, None)
+            if vector is not None:
+                added[recipe_id] = np.asarray(vector, dtype=float) * MACRO_SCALE
+
+        if len(removed) + len(added) > max(self.min_rebuild, self.rebuild_ratio * len(self.ids)):
+            keep = np.ones(len(self.ids), dtype=bool)
+            keep[list(removed)] = False
+            rows = [(recipe_id, *vector) for recipe_id, vector
+                    in zip(self.ids[keep].tolist(), (self.vectors[keep] / MACRO_SCALE).tolist())]
+            rows.extend((recipe_id, *(vector / MACRO_SCALE)) for recipe_id, vector in added.items())
+            return MacroSearchBlock(rows, self.rebuild_ratio, self.min_rebuild)
+
+        block = copy.copy(self)
+        block.removed = frozenset(removed)
+        block.added = added
+        return block
+
+    def nearest(self, target, dims, k):
+        """
+        k ближайших рецептов блока
+
+        Args:
+            target: нормированный вектор цели по координатам dims
+            dims: кортеж номеров координат (MACRO_KEYS)
+            k: сколько рецептов вернуть
+
+        Returns:
+            Список (расстояние, id рецепта), ближайшие первыми
+        """
+        found = []
+        if len(self.ids):
+            tree = self._trees.get(dims)
+            if tree is None:
+                tree = self._trees[dims] = cKDTree(self.vectors[:, dims])
+            # Берём с запасом на устаревшие строки
+            distances, rows = tree.query(target, k=min(len(self.ids), k + len(self.removed)))
+            found = [(float(d), int(self.ids[r])) for d, r
+                     in zip(np.atleast_1d(distances), np.atleast_1d(rows))
+                     if r not in self.removed][:k]
+
+        if self.added:
+            ids = list(self.added)
+            vectors = np.array([self.added[i] for i in ids])[:, dims]
+            distances = np.linalg.norm(vectors - target, axis=1)
+            found.extend(zip(distances.tolist(), ids))
+            found.sort(key=lambda item: (item[0], item[1]))
+
+        return found[:k]
+
+
+class RecipeMacroSearch:
+    """
+    Поиск рецептов, ближайших к цели по КБЖУ, без расчёта рациона.
+
+    Устроен как app.recipe_index.RecipeIndex: общий блок и блоки личных
+    рецептов по пользователям, время жизни для изменений из других
+    процессов. Изменённые после коммита рецепты (итоги RecipeTotals,
+    видимость, удаление) не сбрасывают блоки, а применяются к ним
+    заплаткой при следующем поиске одним запросом по их id.
+    """
+
+    def __init__(self, ttl=60, max_users=256):
+        self.ttl = ttl
+        self.max_users = max_users
+        self._public = None             # (время построения, блок, id к обновлению)
+        self._private = OrderedDict()   # id пользователя -> (время, блок, id к обновлению)
+        self._lock = threading.Lock()
+
+    def configure(self, ttl=None, max_users=None):
+        """Изменить время жизни и число пользователей в кэше"""
+        with self._lock:
+            if ttl is not None:
+                self.ttl = ttl
+            if max_users is not None:
+                self.max_users = max_users
+
+    def blocks(self, user_id, scope='all'):
+        """Блоки области scope для пользователя (с применёнными изменениями)"""
+        with self._lock, db.session.no_autoflush:
+            now = time.monotonic()
+            if self._public is None or now - self._public[0] > self.ttl:
+                self._public = (now, _load_block(Recipe.is_public == True), set())
+            entries = [self._public]
+
+            if scope == 'all':
+                private = self._private.get(user_id)
+                if private is None or now - private[0] > self.ttl:
+                    private = (now, _load_block((Recipe.user_id == user_id)
+                                                & (Recipe.is_public == False)), set())
+                    self._private[user_id] = private
+                self._private.move_to_end(user_id)
+                entries.append(private)
+
+                while len(self._private) > self.max_users:
+                    self._private.popitem(last=False)
+
+            pending = set().union(*(entry[2] for entry in entries))
+            if not pending:
+                return [entry[1] for entry in entries]
+
+            rows = {row[0]: row for row in _load_rows(Recipe.id.in_(list(pending)))}
+            blocks = []
+            for entry in entries:
+                block = entry[1]
+                if entry[2]:
+                    is_public = entry is self._public
+                    block = block.patched({
+                        recipe_id: _vector_if(rows.get(recipe_id), is_public, user_id)
+                        for recipe_id in entry[2]
+                    })
+                    if is_public:
+                        self._public = (entry[0], block, set())
+                    else:
+                        self._private[user_id] = (entry[0], block, set())
+                blocks.append(block)
+            return blocks
+
+    def nearest(self, user_id, targets, k=5, scope='all'):
+        """
+        Рецепты, ближайшие к цели по КБЖУ
+
+        Args:
+            targets: {нутриент из MACRO_KEYS: значение}, можно не все
+            k: сколько рецептов вернуть
+            scope: 'public' - только общие, 'all' - общие и свои
+
+        Returns:
+            Список (расстояние, id рецепта), ближайшие первыми; расстояние
+            в ккал (граммы БЖУ пересчитаны по MACRO_SCALE)
+        """
+        dims = tuple(i for i, key in enumerate(MACRO_KEYS) if key in targets)
+        target = np.array([targets[MACRO_KEYS[i]] for i in dims], dtype=float) * MACRO_SCALE[list(dims)]
+
+        found = []
+        for block in self.blocks(user_id, scope):
+            found.extend(block.nearest(target, dims, k))
+        found.sort(key=lambda item: (item[0], item[1]))
+        return found[:k]
+
+    def mark_changed(self, recipe_ids):
+        """Отметить рецепты для обновления в блоках при следующем поиске"""
+        with self._lock:
+            if self._public is not None:
+                self._public[2].update(recipe_ids)
+            for entry in self._private.values():
+                entry[2].update(recipe_ids)
+
+    def clear(self):
+        with self._lock:
+            self._public = None
+            self._private.clear()
+
+
+def _load_rows(condition):
+    return db.session.query(
+        Recipe.id, RecipeTotals.calories, RecipeTotals.proteins, RecipeTotals.fats,
+        RecipeTotals.carbs, Recipe.is_public, Recipe.user_id
+    ).join(RecipeTotals, RecipeTotals.recipe_id == Recipe.id).filter(condition)
+
+
+def _load_block(condition):
+    """Векторы КБЖУ рецептов группы одним запросом по итогам"""
+    return MacroSearchBlock(row[:5] for row in _load_rows(condition))
+
+
+def _vector_if(row, public_block, user_id):
+    """Вектор рецепта, если он входит в блок, иначе None"""
+    if row is None:
+        return None
+    belongs = row.is_public if public_block else (not row.is_public and row.user_id == user_id)
+    return tuple(row[1:5]) if belongs else None
+
+
+recipe_search = RecipeMacroSearch()
+
+
+def _recipe_changed(mapper, connection, target):
+    """Видимость или владелец рецепта изменились, рецепт удалён"""
+    session = object_session(target)
+    if session is not None:
+        changed = session.info.setdefault('recipe_totals_changed', set())
+        if changed is not None:
+            changed.add(target.id)
+
+
+def _after_commit(session):
+    # Итоги пересчитываются запросами в обход ORM (RecipeTotals.refresh),
+    # их id копятся в сессии там же
+    if 'recipe_totals_changed' not in session.info:
+        return
+    changed = session.info.pop('recipe_totals_changed')
+    if changed is None:
+        recipe_search.clear()
+    else:
+        recipe_search.mark_changed(changed)
+
+
+def _after_rollback(session):
+    session.info.pop('recipe_totals_changed', None)
+
+
+for _event in ('after_update', 'after_delete'):
+    event.listen(Recipe, _event, _recipe_changed)
+event.listen(Session, 'after_commit', _after_commit)
+event.listen(Session, 'after_rollback', _after_rollback)
@@ -0,0 +1,414 @@
+import numpy as np
+from scipy import sparse
+from scipy.optimize import (lsq_linear, minimize, milp, LinearConstraint, Bounds,
+                            OptimizeResult)
+
+# Нутриенты, которые хранятся в столбцах Ingredient; дополнительные
+# (клетчатка, сахар...) описываются моделью Nutrient
+NUTRIENT_KEYS = ('calories', 'proteins', 'fats', 'carbs')
+
+# Границы задачи
+MAX_GRAMS = 1000          # максимум одного ингредиента, г
+MIN_TOTAL_WEIGHT = 200    # минимальный общий вес, г
+MAX_TOTAL_WEIGHT = 5000   # максимальный общий вес, г
+
+# Слабое притяжение к начальному приближению: делает решение единственным
+# (ингредиентов обычно больше, чем 4 уравнения КБЖУ) и близким к выбору пользователя
+REGULARIZATION = 1e-4
+
+DEFAULT_SOLVER = 'auto'
+
+# Параметры целочисленного режима по умолчанию
+PORTION_STEP = 5          # шаг порции, г
+MIN_PORTION = 5           # минимальная ненулевая порция, г
+TOLERANCE = 0.1           # допустимое отклонение по каждому нутриенту (доля от цели)
+TIME_LIMIT = 2.0          # лимит времени HiGHS, с
+DEADZONE = 0.005          # отклонение, которое не штрафуется (доля от цели)
+
+
+def nutrient_matrix(ingredients, keys=NUTRIENT_KEYS):
+    """
+    Матрица нутриентов на 1 г (строки - нутриенты keys, столбцы - ингредиенты)
+
+    КБЖУ берутся из атрибутов, дополнительные нутриенты - из extra_nutrients.
+    """
+    core = [key for key in keys if key in NUTRIENT_KEYS]
+    if len(core) == len(keys):
+        rows = [[getattr(ing, key) for key in keys] for ing in ingredients]
+    else:
+        rows = []
+        for ing in ingredients:
+            extra = ing.extra_nutrients
+            rows.append([getattr(ing, key) if key in NUTRIENT_KEYS else extra.get(key, 0)
+                         for key in keys])
+    return np.array(rows, dtype=float).reshape(-1, len(keys)).T / 100.0
+
+
+def amount_bounds(initial_amounts, n_ingredients):
+    """
+    Границы для каждого ингредиента.
+
+    Если пользователь указал количество, ингредиент может меняться не больше
+    чем в 2 раза в обе стороны - раньше это был штраф в целевой функции,
+    теперь это честные границы.
+    """
+    lower = np.zeros(n_ingredients)
+    upper = np.full(n_ingredients, float(MAX_GRAMS))
+
+    if initial_amounts is not None and len(initial_amounts) == n_ingredients:
+        amounts = np.asarray(initial_amounts, dtype=float)
+        given = amounts > 0
+        lower[given] = np.minimum(amounts[given] * 0.5, MAX_GRAMS)
+        upper[given] = np.maximum(np.minimum(amounts[given] * 2, MAX_GRAMS), lower[given])
+
+    return lower, upper
+
+
+def initial_guess(initial_amounts, n_ingredients, lower, upper):
+    """Начальное приближение: количества пользователя или равные доли на 500г"""
+    if initial_amounts is not None and len(initial_amounts) == n_ingredients:
+        x0 = np.array(initial_amounts, dtype=float)
+    else:
+        x0 = np.ones(n_ingredients) * (500 / max(n_ingredients, 1))
+    return np.clip(x0, lower, upper)
+
+
+def weight_is_valid(x):
+    """Проверить ограничения на общий вес"""
+    total = float(np.sum(x))
+    return MIN_TOTAL_WEIGHT - 1e-6 <= total <= MAX_TOTAL_WEIGHT + 1e-6
+
+
+def solve_lsq_batch(nutrients, target_matrix, lower, upper, x0, max_iter=50, tol=1e-8):
+    """
+    Та же задача, что в solve_lsq, сразу для многих целей (столбцы target_matrix).
+
+    Решается двойственная задача: по множителям μ (по одному на нутриент)
+    x(μ) = clip(x0 - A^T μ / 2λ, lower, upper) в явном виде, а сама двойственная
+    функция вогнутая и гладкая по кускам - её максимизируем полугладким методом
+    Ньютона. Каждая итерация - несколько матричных произведений и решение
+    систем 4x4 сразу для всех целей, без цикла по целям.
+
+    Returns:
+        (x, converged, n_iter) - количества (n x m), маска сошедшихся целей
+        и число итераций
+    """
+    x, _, converged, n_iter = _dual_newton(nutrients, target_matrix, lower, upper, x0,
+                                           max_iter=max_iter, tol=tol)
+    return x, converged, n_iter
+
+
+def _dual_newton(nutrients, target_matrix, lower, upper, x0, mu0=None, max_iter=50, tol=1e-8):
+    """
+    Метод Ньютона для solve_lsq_batch. mu0 - стартовые множители (4 x m),
+    например от решения с соседними целями: тогда хватает 1-2 итераций.
+
+    Returns:
+        (x, mu, converged, n_iter)
+    """
+    n_nutrients = nutrients.shape[0]
+    n_targets = target_matrix.shape[1]
+    scale = 1 / (2 * REGULARIZATION)
+    low, high, anchor = lower[:, None], upper[:, None], x0[:, None]
+    target_size = 1 + np.max(np.abs(target_matrix), axis=0)
+
+    def primal(mu):
+        return np.clip(anchor - scale * (nutrients.T @ mu), low, high)
+
+    def dual(mu, x):
+        shift = x - anchor
+        return (-0.25 * np.sum(mu ** 2, axis=0) - np.sum(mu * target_matrix, axis=0)
+                + REGULARIZATION * np.sum(shift ** 2, axis=0)
+                + np.sum((nutrients.T @ mu) * x, axis=0))
+
+    mu = np.zeros((n_nutrients, n_targets)) if mu0 is None else np.array(mu0, dtype=float)
+    x = primal(mu)
+    value = dual(mu, x)
+    converged = np.zeros(n_targets, dtype=bool)
+    stuck = np.zeros(n_targets, dtype=bool)
+
+    n_iter = 0
+    for n_iter in range(max_iter):
+        grad = nutrients @ x - target_matrix - 0.5 * mu
+        converged = np.max(np.abs(grad), axis=0) <= tol * target_size
+        active = ~converged & ~stuck
+        if not active.any():
+            break
+
+        # Направление Ньютона: (A_F A_F^T / 2λ + I/2) d = ∇g, F - свободные переменные
+        free = ((x > low) & (x < high)).astype(float)
+        hessian = (scale * np.einsum('in,nm,jn->mij', nutrients, free, nutrients)
+                   + 0.5 * np.eye(n_nutrients))
+        direction = np.linalg.solve(hessian, grad.T[..., None])[..., 0].T
+        slope = np.sum(grad * direction, axis=0)
+
+        # Поиск шага (Армихо) одновременно для всех целей
+        step = np.where(active, 1.0, 0.0)
+        accepted = ~active
+        new_mu, new_x, new_value = mu, x, value
+        for _ in range(30):
+            trial_mu = mu + step * direction
+            trial_x = primal(trial_mu)
+            trial_value = dual(trial_mu, trial_x)
+            ok = ~accepted & (trial_value >= value + 1e-4 * step * slope)
+            new_mu = np.where(ok, trial_mu, new_mu)
+            new_x = np.where(ok, trial_x, new_x)
+            new_value = np.where(ok, trial_value, new_value)
+            accepted |= ok
+            if accepted.all():
+                break
+            step = np.where(accepted, step, step / 2)
+
+        stuck |= ~accepted
+        mu, x, value = new_mu, new_x, new_value
+
+    return x, mu, converged, n_iter
+
+
+def solve_lsq(nutrients, target_vector, lower, upper, x0, start=None, dual=None):
+    """
+    Линейный МНК с ограничениями-коробками.
+
+    Решает min ||A x - t||^2 + λ||x - x0||^2 при lower <= x <= upper
+    двойственным методом Ньютона (solve_lsq_batch с одной целью), а если он
+    не сошёлся - через lsq_linear (BVLS). Ограничения на общий вес не
+    учитываются - если они нарушены, результат помечается как неуспешный.
+
+    dual - множители предыдущего решения (result.dual) для тёплого старта;
+    start принимается для единообразия с solve_slsqp и не используется.
+    """
+    mu0 = None if dual is None else np.asarray(dual, dtype=float).reshape(-1, 1)
+    x, mu, converged, n_iter = _dual_newton(nutrients, target_vector[:, None], lower, upper, x0,
+                                            mu0=mu0)
+
+    if converged[0]:
+        result = OptimizeResult(x=x[:, 0], success=True, status=0, nit=n_iter,
+                                message='Решение найдено', dual=mu[:, 0])
+    else:
+        n = nutrients.shape[1]
+        weight = np.sqrt(REGULARIZATION)
+        A = np.vstack([nutrients, weight * np.eye(n)])
+        b = np.concatenate([target_vector, weight * x0])
+        result = lsq_linear(A, b, bounds=(lower, upper), method='bvls')
+
+    if result.success and not weight_is_valid(result.x):
+        result.success = False
+        result.message = 'Общий вес вне допустимых границ'
+
+    return result
+
+
+def solve_slsqp(nutrients, target_vector, lower, upper, x0, start=None, dual=None):
+    """
+    SLSQP с точным градиентом и якобианами ограничений на общий вес.
+
+    start - точка старта (по умолчанию x0), x0 остаётся точкой притяжения.
+    dual принимается для единообразия с solve_lsq и не используется.
+    """
+    n = nutrients.shape[1]
+    ones = np.ones(n)
+
+    def objective(x):
+        residual = nutrients @ x - target_vector
+        shift = x - x0
+        return residual @ residual + REGULARIZATION * (shift @ shift)
+
+    def gradient(x):
+        residual = nutrients @ x - target_vector
+        return 2 * (nutrients.T @ residual) + 2 * REGULARIZATION * (x - x0)
+
+    constraints = [
+        {'type': 'ineq', 'fun': lambda x: np.sum(x) - MIN_TOTAL_WEIGHT, 'jac': lambda x: ones},
+        {'type': 'ineq', 'fun': lambda x: MAX_TOTAL_WEIGHT - np.sum(x), 'jac': lambda x: -ones},
+    ]
+
+    return minimize(
+        objective,
+        x0 if start is None else start,
+        jac=gradient,
+        bounds=list(zip(lower, upper)),
+        constraints=constraints,
+        method='SLSQP',
+        options={'maxiter': 1000, 'ftol': 1e-9}
+    )
+
+
+def solve_auto(nutrients, target_vector, lower, upper, x0, start=None, dual=None):
+    """
+    Быстрый путь через lsq_linear; если активны ограничения на общий вес,
+    дорешиваем SLSQP, стартуя с найденной точки.
+
+    start и dual - предыдущее решение и его множители для тёплого старта.
+    """
+    result = solve_lsq(nutrients, target_vector, lower, upper, x0, dual=dual)
+    if result.success:
+        return result
+
+    if start is None:
+        start = np.clip(result.x, lower, upper) if result.x is not None else x0
+    return solve_slsqp(nutrients, target_vector, lower, upper, x0, start=start)
+
+
+def round_portions(x, step=PORTION_STEP, min_portion=PORTION_STEP):
+    """Округлить количества до шага порции и обнулить слишком маленькие"""
+    rounded = np.round(np.asarray(x, dtype=float) / step) * step
+    rounded[rounded < min_portion] = 0
+    return rounded
+
+
+def solve_milp(nutrients, target_vector, lower, upper, x0, step=PORTION_STEP,
+               min_portion=MIN_PORTION, tolerance=TOLERANCE, time_limit=TIME_LIMIT):
+    """
+    Целочисленный режим: решаем сразу в порциях по step грамм (HiGHS).
+
+    Переменные: k - число порций каждого ингредиента, y - используется ли
+    ингредиент, d+/d- - бесплатные отклонения в пределах DEADZONE, s+/s- -
+    остальные отклонения по КБЖУ. Каждый ингредиент либо не используется,
+    либо занимает от min_portion до upper грамм. Отклонение по каждому
+    нутриенту с ненулевой целью жёстко ограничено tolerance * цель,
+    минимизируется сумма относительных отклонений сверх DEADZONE - без неё
+    HiGHS тратил бы весь лимит на доказательство оптимальности среди
+    практически одинаковых решений.
+
+    Ингредиент с ненулевой нижней границей (количество, указанное
+    пользователем) используется обязательно: y = 1.
+
+    Если за time_limit найдено хоть одно допустимое решение - возвращается
+    лучшее из найденных. Если не найдено ни одного, а время вышло -
+    округляется непрерывное решение; если оно не укладывается в допуск,
+    расчёт считается неудачным.
+    """
+    n_nutrients, n = nutrients.shape
+    max_portions = np.floor(upper / step)
+    min_portions = np.maximum(np.ceil(lower / step), np.ceil(min_portion / step))
+    min_portions = np.minimum(min_portions, max_portions)
+
+    # Порядок переменных: k (n), y (n), d+, d-, s+, s- (по m)
+    n_vars = 2 * n + 4 * n_nutrients
+    scale = np.maximum(np.abs(target_vector), 1.0)
+    free_cost = np.zeros(2 * n_nutrients)
+    cost = np.concatenate([np.zeros(2 * n), free_cost, 1 / scale, 1 / scale])
+
+    band = np.where(target_vector > 0, tolerance * target_vector, np.inf)
+    free_band = np.minimum(band, DEADZONE * scale)
+    # Количества, указанные пользователем, - жёсткая нижняя граница, как в
+    # непрерывных методах: такой ингредиент нельзя выбросить (y = 1)
+    required = (lower > 0).astype(float)
+    bounds = Bounds(
+        np.concatenate([np.zeros(n), required, np.zeros(4 * n_nutrients)]),
+        np.concatenate([max_portions, np.ones(n), free_band, free_band, band, band])
+    )
+    integrality = np.concatenate([np.ones(2 * n), np.zeros(4 * n_nutrients)])
+
+    eye_n = sparse.identity(n, format='csr')
+    eye_m = sparse.identity(n_nutrients, format='csr')
+    zeros_nm = sparse.csr_matrix((n, 4 * n_nutrients))
+
+    constraints = [
+        # A * step * k - d+ + d- - s+ + s- = t, при этом |отклонение| <= band
+        LinearConstraint(
+            sparse.hstack([sparse.csr_matrix(nutrients * step),
+                           sparse.csr_matrix((n_nutrients, n)), -eye_m, eye_m, -eye_m, eye_m]),
+            target_vector, target_vector
+        ),
+        LinearConstraint(
+            sparse.hstack([sparse.csr_matrix(nutrients * step),
+                           sparse.csr_matrix((n_nutrients, n + 4 * n_nutrients))]),
+            target_vector - band, target_vector + band
+        ),
+        # k - min_portions * y >= 0: либо 0, либо не меньше минимальной порции
+        LinearConstraint(
+            sparse.hstack([eye_n, -sparse.diags(min_portions), zeros_nm]),
+            0, np.inf
+        ),
+        # k - max_portions * y <= 0
+        LinearConstraint(
+            sparse.hstack([eye_n, -sparse.diags(max_portions), zeros_nm]),
+            -np.inf, 0
+        ),
+        # Общий вес
+        LinearConstraint(
+            np.concatenate([np.full(n, float(step)), np.zeros(n + 4 * n_nutrients)]),
+            MIN_TOTAL_WEIGHT, MAX_TOTAL_WEIGHT
+        ),
+    ]
+
+    result = milp(cost, constraints=constraints, integrality=integrality,
+                  bounds=bounds, options={'time_limit': time_limit})
+
+    if result.x is not None:
+        result.x = np.round(result.x[:n]) * step
+        result.success = True
+        if result.status != 0:
+            result.message = 'Лимит времени: использовано лучшее найденное решение'
+        return result
+
+    if result.status == 1:
+        fallback = solve_auto(nutrients, target_vector, lower, upper, x0)
+        x = round_portions(fallback.x, step, min_portion)
+        fallback.x = np.where(lower > 0, np.clip(x, min_portions * step, max_portions * step), x)
+        # Допуск, который MILP соблюдал бы жёстко, проверяем после округления
+        deviation = np.abs(nutrients @ fallback.x - target_vector)
+        if np.any(deviation > band * (1 + 1e-9)):
+            fallback.success = False
+            fallback.message = (f'Лимит времени: округлённое непрерывное решение не укладывается '
+                                f'в допуск ±{tolerance * 100:g}% по всем КБЖУ')
+            return fallback
+        fallback.message = 'Лимит времени: использовано округлённое непрерывное решение'
+        return fallback
+
+    if result.status == 2:
+        result.message = f'Невозможно уложиться в допуск ±{tolerance * 100:g}% по всем КБЖУ'
+    return result
+
+
+def select_ingredients(nutrients, target_vector, k, upper=MAX_GRAMS, tol=1e-3):
+    """
+    Жадный выбор не больше k ингредиентов из всего каталога (как OMP).
+
+    Нутриенты масштабируются на цели, чтобы белки и жиры весили столько же,
+    сколько калории. На каждом шаге добавляется столбец, который сильнее всего
+    уменьшает текущую невязку (с учётом 0 <= x <= upper), затем количества
+    выбранных пересчитываются через lsq_linear (BVLS). Шаг - одно произведение
+    4 x N на вектор, поэтому каталог в десятки тысяч ингредиентов выбирается
+    за миллисекунды.
+
+    Returns:
+        (индексы выбранных столбцов, их количества в граммах)
+    """
+    scale = 1 / np.maximum(np.abs(target_vector), 1.0)
+    columns = nutrients * scale[:, None]
+    target = target_vector * scale
+    norms = np.sum(columns ** 2, axis=0)
+    candidates = norms > 0
+
+    selected = []
+    x = np.zeros(0)
+    residual = target.copy()
+    for _ in range(min(k, int(candidates.sum()))):
+        correlation = columns.T @ residual
+        step = np.clip(correlation / np.where(candidates, norms, 1.0), 0, upper)
+        gain = np.where(candidates, step * (2 * correlation - step * norms), -np.inf)
+
+        best = int(np.argmax(gain))
+        if gain[best] <= 0:
+            break
+
+        selected.append(best)
+        candidates[best] = False
+        x = lsq_linear(columns[:, selected], target, bounds=(0, upper), method='bvls').x
+        residual = target - columns[:, selected] @ x
+        if np.linalg.norm(residual) <= tol * np.linalg.norm(target):
+            break
+
+    selected = np.array(selected, dtype=int)
+    used = x > 0
+    return selected[used], x[used]
+
+
+SOLVERS = {
+    'auto': solve_auto,
+    'lsq': solve_lsq,
+    'slsqp': solve_slsqp,
+    'milp': solve_milp,
+}
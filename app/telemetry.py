@@ -0,0 +1,150 @@
+import threading
+import time
+from collections import deque
+import numpy as np
+
+# Границы групп по числу ингредиентов в задаче (сводка для администратора)
+SIZE_BUCKETS = (5, 10, 20, 50, 200)
+
+# Границы групп по калорийности цели, ккал
+CALORIE_BUCKETS = (1000, 2000, 3000)
+
+
+class SolverTelemetry:
+    """
+    Кольцевой буфер замеров оптимизатора за последние maxsize расчётов.
+
+    На каждый вызов метода сохраняется размер задачи, итерации, вычисления
+    функции, время, сошёлся ли метод и итоговая невязка. Буфер живёт в памяти
+    процесса: после перезапуска и в других воркерах он свой.
+    """
+
+    def __init__(self, maxsize=1000):
+        self._records = deque(maxlen=maxsize)
+        self._lock = threading.Lock()
+        self.total = 0
+
+    def configure(self, maxsize=None):
+        """Изменить размер буфера (сохраняются последние записи)"""
+        if maxsize is None:
+            return
+        with self._lock:
+            self._records = deque(self._records, maxlen=maxsize)
+
+    def record(self, solver, result, nutrients, targets, weights, seconds, warm=False, batch=1):
+        """
+        Сохранить замер одного вызова метода
+
+        Args:
+            solver: имя метода из app.solvers.SOLVERS
+            result: OptimizeResult метода (или None для векторного пути)
+            nutrients: матрица задачи (нутриенты x ингредиенты)
+            targets: вектор цели (или матрица целей по столбцам для batch > 1)
+            weights: найденные количества (вектор или матрица по столбцам)
+            seconds: время вызова
+            warm: был ли тёплый старт
+            batch: сколько целей решено одним вызовом
+        """
+        targets = np.asarray(targets, dtype=float)
+        entry = {
+            'time': time.time(),
+            'solver': solver,
+            'ingredients': int(nutrients.shape[1]),
+            'nutrients': int(nutrients.shape[0]),
+            'calories': float(np.mean(targets[0])),
+            'batch': batch,
+            'warm': bool(warm),
+            'iterations': _int_or_none(getattr(result, 'nit', None)),
+            'evaluations': _int_or_none(getattr(result, 'nfev', None)),
+            'status': _int_or_none(getattr(result, 'status', None)),
+            'converged': bool(getattr(result, 'success', True)),
+            'wall_ms': round(seconds * 1000, 3),
+            'residual': _relative_residual(nutrients, targets, weights),
+        }
+        with self._lock:
+            self._records.append(entry)
+            self.total += 1
+
+    def recent(self, limit=50):
+        """Последние записи, новые первыми"""
+        with self._lock:
+            records = list(self._records)
+        return records[::-1][:limit]
+
+    def summary(self):
+        """
+        Сводка по группам (метод, число ингредиентов, калорийность цели)
+
+        Returns:
+            Словарь с общим числом замеров и списком групп, самые дорогие
+            по суммарному времени первыми
+        """
+        with self._lock:
+            records = list(self._records)
+            total = self.total
+
+        groups = {}
+        for entry in records:
+            key = (entry['solver'], _bucket(entry['ingredients'], SIZE_BUCKETS),
+                   _bucket(entry['calories'], CALORIE_BUCKETS), entry['nutrients'])
+            groups.setdefault(key, []).append(entry)
+
+        summary = []
+        for (solver, size, calories, nutrients), entries in groups.items():
+            wall = np.array([e['wall_ms'] for e in entries])
+            summary.append({
+                'solver': solver,
+                'ingredients': size,
+                'calories': calories,
+                'nutrients': nutrients,
+                'count': len(entries),
+                'failed': sum(1 for e in entries if not e['converged']),
+                'warm': sum(1 for e in entries if e['warm']),
+                'wall_ms_total': round(float(wall.sum()), 1),
+                'wall_ms_p50': round(float(np.percentile(wall, 50)), 3),
+                'wall_ms_p95': round(float(np.percentile(wall, 95)), 3),
+                'iterations_mean': _mean(e['iterations'] for e in entries),
+                'evaluations_mean': _mean(e['evaluations'] for e in entries),
+                'residual_max': max((e['residual'] for e in entries if e['residual'] is not None),
+                                    default=None),
+            })
+        summary.sort(key=lambda group: group['wall_ms_total'], reverse=True)
+
+        return {'recorded': total, 'kept': len(records), 'groups': summary}
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+            self.total = 0
+
+
+def _relative_residual(nutrients, targets, weights):
+    """||A x - t|| / ||t|| (для нескольких целей - худшая)"""
+    if weights is None:
+        return None
+    weights = np.asarray(weights, dtype=float)
+    residual = np.linalg.norm(nutrients @ weights - targets, axis=0)
+    scale = np.maximum(np.linalg.norm(targets, axis=0), 1.0)
+    return round(float(np.max(residual / scale)), 6)
+
+
+def _bucket(value, bounds):
+    """Подпись группы значения: '<=5', '6-10', ..., '>200'"""
+    low = 0
+    for bound in bounds:
+        if value <= bound:
+            return f'{low}-{bound}' if low else f'<={bound}'
+        low = bound + 1
+    return f'>{bounds[-1]}'
+
+
+def _int_or_none(value):
+    return None if value is None else int(value)
+
+
+def _mean(values):
+    values = [v for v in values if v is not None]
+    return round(sum(values) / len(values), 1) if values else None
+
+
+solver_telemetry = SolverTelemetry()
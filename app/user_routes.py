@@ -1,26 +1,59 @@
-from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for
+import math
+from flask import (Blueprint, render_template, request, jsonify, flash, redirect, url_for,
+                   current_app, abort)
 from flask_login import login_required, current_user
-from sqlalchemy import or_, text
+from sqlalchemy import func, text
 from app import db
-from app.models import Ingredient, Recipe, recipe_ingredients
+from app.models import (Ingredient, Recipe, RecipeIngredient, RecipeTotals, CalculationJob,
+                        visible_query)
 from app.forms import IngredientForm, RecipeForm, CalculationForm
-from app.calculation import calculate_optimal_diet, find_best_recipes
+from app.cache import solution_cache
+from app.catalog import nutrient_catalog
+from app.pagination import keyset_paginate, InvalidCursor
+from app.db_routing import replica_reads
+from app.recipe_match import best_recipes as match_recipes
+from app.recipe_search import recipe_search, MACRO_KEYS, SCOPES
+from app.calculation import (calculate_optimal_diet, calculate_optimal_diet_batch,
+                             result_to_dict, solver_settings,
+                             choose_ingredients, parse_targets, parse_portion_settings, target_keys,
+                             NUTRIENT_KEYS, DEFAULT_AUTO_INGREDIENTS)
+from app.jobs import enqueue_calculation
+from app.meal_plan import plan_week, DAYS_PER_WEEK
+from app.diet_state import dump_state, load_state
 
 bp = Blueprint('user', __name__)
 
+# Максимум целей в одном пакетном расчёте
+MAX_BATCH_TARGETS = 100
+
+# Максимум приёмов пищи в день в плане на неделю
+MAX_MEALS_PER_DAY = 6
+
+# Максимум рецептов в ответе поиска по КБЖУ
+MAX_NEAREST_RECIPES = 50
+
+# Максимум записей на странице списков в JSON (параметр limit)
+MAX_PAGE_SIZE = 100
+
+def _extra_nutrients_from(data):
+    """Значения дополнительных нутриентов из JSON (неизвестные ключи отбрасываются)"""
+    known = nutrient_catalog.view(current_user.id).keys[len(NUTRIENT_KEYS):]
+    values = data.get('extra_nutrients') or {}
+    return {key: float(values[key]) for key in known if values.get(key) not in (None, '')}
+
 @bp.route('/ingredients', methods=['GET'])
 @login_required
+@replica_reads
 def api_ingredients():
-    """API для получения списка ингредиентов (для выпадающих списков)"""
-    ingredients = Ingredient.query.filter(
-        or_(
-            Ingredient.user_id == current_user.id,
-            Ingredient.is_public == True
-        )
-    ).order_by(Ingredient.name).all()
-
-    return jsonify([
-        {
+    """
+    API для получения списка ингредиентов (для выпадающих списков)
+
+    Без параметров - весь список видимых ингредиентов. С limit или cursor -
+    страница по курсору (search, sort_by, sort_order - как на странице
+    ингредиентов) и курсоры соседних страниц.
+    """
+    def to_dict(ing):
+        return {
             'id': ing.id,
             'name': ing.name,
             'calories': ing.calories,
@@ -28,8 +61,67 @@ def api_ingredients():
             'fats': ing.fats,
             'carbs': ing.carbs
         }
-        for ing in ingredients
-    ])
+
+    if 'limit' not in request.args and 'cursor' not in request.args:
+        # Видимые ингредиенты уже есть в каталоге пользователя - без запроса к базе
+        return jsonify([to_dict(ing) for ing in nutrient_catalog.view(current_user.id).sorted_by_name()])
+
+    limit, error = _page_limit()
+    if error:
+        return error
+    try:
+        page, _ = _ingredient_page(lambda *criteria: visible_query(Ingredient, current_user.id, *criteria),
+                                   request.args, limit, ('api_ingredients', current_user.id))
+    except InvalidCursor as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    return jsonify({'success': True, 'ingredients': [to_dict(ing) for ing in page.items],
+                    **page.to_dict()})
+
+
+def _page_limit():
+    """Размер страницы из параметра limit: (limit, None) или (None, ответ с ошибкой)"""
+    limit = request.args.get('limit', 20, type=int)
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        return None, (jsonify({'success': False,
+                               'message': f'limit должно быть от 1 до {MAX_PAGE_SIZE}'}), 400)
+    return limit, None
+
+
+def _ingredient_page(make_query, args, per_page, count_key):
+    """
+    Страница ингредиентов по параметрам запроса (search, sort_by, sort_order, cursor)
+
+    Args:
+        make_query: функция (*условия) -> запрос видимых ингредиентов
+        count_key: ключ кэша числа записей (к нему добавляется поиск)
+
+    Returns:
+        (KeysetPage, параметры списка для шаблона)
+
+    Raises:
+        InvalidCursor: курсор не подходит к списку
+    """
+    search = args.get('search', '').strip()
+    criteria = [Ingredient.name.ilike(f'%{search}%')] if search else []
+
+    sort_by = args.get('sort_by', 'name')
+    sort_order = args.get('sort_order', 'asc')
+    sort_mapping = {
+        'name': Ingredient.name,
+        'calories': Ingredient.calories,
+        'proteins': Ingredient.proteins,
+        'fats': Ingredient.fats,
+        'carbs': Ingredient.carbs
+    }
+    if sort_by not in sort_mapping:
+        sort_by = 'name'
+
+    page = keyset_paginate(make_query(*criteria), (sort_mapping[sort_by], Ingredient.id),
+                           cursor=args.get('cursor'), per_page=per_page,
+                           descending=sort_order == 'desc', sort=sort_by,
+                           count_key=(*count_key, search))
+    return page, {'search': search, 'sort_by': sort_by, 'sort_order': sort_order}
 
 @bp.route('/ingredients', methods=['POST'])
 @login_required
@@ -61,6 +153,8 @@ def api_add_ingredient():
             user_id=current_user.id,
             is_public=data.get('is_public', False) and current_user.is_admin
         )
+        if data.get('extra_nutrients'):
+            ingredient.set_extra_nutrients(_extra_nutrients_from(data))
 
         db.session.add(ingredient)
         db.session.commit()
@@ -112,57 +206,35 @@ def api_add_recipe():
         db.session.flush()  # Получаем ID рецепта
         print(f"Recipe created with ID: {recipe.id}")
 
-        # Добавляем ингредиенты через ассоциативную таблицу
-        ingredients_added = 0
-        for i, ing_data in enumerate(data['ingredients']):
-            try:
-                ingredient_id = int(ing_data.get('ingredient_id', 0))
-                amount_grams = float(ing_data.get('amount', 0))
-
-                if ingredient_id <= 0 or amount_grams <= 0:
-                    print(f"Skipping ingredient {i+1}: invalid values")
-                    continue
-
-                # Проверяем существование ингредиента
-                ingredient = Ingredient.query.get(ingredient_id)
-                if not ingredient:
-                    print(f"Error: Ingredient {ingredient_id} not found")
-                    db.session.rollback()
-                    return jsonify({
-                        'success': False,
-                        'message': f'Ингредиент с ID {ingredient_id} не найден'
-                    }), 400
-
-                # ВСТАВКА В АССОЦИАТИВНУЮ ТАБЛИЦУ
-                # Способ 1: Используем SQLAlchemy insert
-                from sqlalchemy import insert
-
-                stmt = insert(recipe_ingredients).values(
-                    recipe_id=recipe.id,
-                    ingredient_id=ingredient_id,
-                    amount_grams=amount_grams
-                )
-                db.session.execute(stmt)
-
-                ingredients_added += 1
-                print(f"Added ingredient {ingredient_id} with amount {amount_grams}")
+        # Состав: проверка всех ингредиентов одним запросом и одна вставка
+        try:
+            amounts = _recipe_amounts((ing.get('ingredient_id', 0), ing.get('amount', 0))
+                                      for ing in data['ingredients'])
+        except (ValueError, TypeError) as e:
+            db.session.rollback()
+            return jsonify({
+                'success': False,
+                'message': f'Неверный формат данных ингредиента: {str(e)}'
+            }), 400
 
-            except (ValueError, TypeError) as e:
-                print(f"Error processing ingredient {i+1}: {str(e)}")
-                db.session.rollback()
-                return jsonify({
-                    'success': False,
-                    'message': f'Неверный формат данных ингредиента: {str(e)}'
-                }), 400
+        missing = sorted(set(amounts) - Ingredient.existing_ids(amounts))
+        if missing:
+            db.session.rollback()
+            return jsonify({
+                'success': False,
+                'message': f'Ингредиент с ID {missing[0]} не найден'
+            }), 400
 
-        if ingredients_added == 0:
+        if not amounts:
             db.session.rollback()
             return jsonify({
                 'success': False,
                 'message': 'Не добавлено ни одного валидного ингредиента'
             }), 400
 
+        ingredients_added = RecipeIngredient.write_amounts(recipe, amounts)
         print(f"Added {ingredients_added} ingredients to association table")
+        RecipeTotals.refresh([recipe.id])
         db.session.commit()
         print("Recipe saved successfully!")
 
@@ -225,6 +297,7 @@ def delete_ingredient(id):
     try:
         db.session.delete(ingredient)
         db.session.commit()
+        solution_cache.invalidate_ingredients([id])
 
         return jsonify({'success': True, 'message': 'Ингредиент удален'})
     except Exception as e:
@@ -296,17 +369,14 @@ def delete_recipe(id):
 def calculate():
     form = CalculationForm()
 
-    # Получаем доступные ингредиенты
-    available_ingredients = Ingredient.query.filter(
-        or_(
-            Ingredient.user_id == current_user.id,
-            Ingredient.is_public == True
-        )
-    ).order_by(Ingredient.name).all()
+    # Каталог КБЖУ пользователя (общие и личные ингредиенты)
+    with replica_reads():
+        catalog = nutrient_catalog.view(current_user.id)
 
     result = None
     best_recipes = []
     selected_ingredients_data = []
+    state_token = None
 
     if form.validate_on_submit():
         targets = {
@@ -315,55 +385,66 @@ def calculate():
             'fats': form.target_fats.data,
             'carbs': form.target_carbs.data
         }
-
-        # Получаем выбранные пользователем ингредиенты
-
-        selected_ingredients = []
-        selected_amounts = []
-
-        # Собираем все поля ingredient_id_*
-        for key, value in request.form.items():
-            if key.startswith('ingredient_id_'):
-                ingredient_id = int(value)
-
-                # Получаем количество из поля amount_<id>
-                amount_key = f'amount_{ingredient_id}'
-                amount = request.form.get(amount_key, 100)
-
-                # Находим ингредиент
-                ingredient = Ingredient.query.get(ingredient_id)
-                if ingredient:
-                    selected_ingredients.append(ingredient)
-                    selected_amounts.append(float(amount))
-                    selected_ingredients_data.append({
-                        'id': ingredient.id,
-                        'name': ingredient.name,
-                        'amount': float(amount),
-                        'calories': ingredient.calories,
-                        'proteins': ingredient.proteins,
-                        'fats': ingredient.fats,
-                        'carbs': ingredient.carbs
-                    })
+        # Цели по дополнительным нутриентам (поля target_<ключ>, необязательные)
+        for definition in catalog.definitions:
+            value = request.form.get(f"target_{definition['key']}", type=float)
+            if value is not None:
+                targets[definition['key']] = value
+        keys = target_keys(targets)
+
+        if form.auto_select.data:
+            # Подбираем ингредиенты из всего доступного каталога
+            chosen = choose_ingredients(catalog.ids, catalog.matrix(keys), targets,
+                                        form.max_ingredients.data or DEFAULT_AUTO_INGREDIENTS)
+            selected_ingredients, fitted_amounts, nutrients = catalog.load_selected(
+                [{'ingredient_id': ingredient_id, 'amount': grams} for ingredient_id, grams in chosen],
+                keys
+            )
+            # Количества пользователь не задавал - они не ограничивают расчёт
+            selected_amounts = None
+        else:
+            # Получаем выбранные пользователем ингредиенты из полей
+            # ingredient_id_* и amount_<id>
+            selected_ingredients, fitted_amounts, nutrients = catalog.load_selected([
+                {'ingredient_id': value, 'amount': request.form.get(f'amount_{value}', 100)}
+                for key, value in request.form.items()
+                if key.startswith('ingredient_id_')
+            ], keys)
+            selected_amounts = fitted_amounts
+
+        for ingredient, amount in zip(selected_ingredients, fitted_amounts):
+            selected_ingredients_data.append({
+                'id': ingredient.id,
+                'name': ingredient.name,
+                'amount': round(amount) if form.auto_select.data else amount,
+                'calories': ingredient.calories,
+                'proteins': ingredient.proteins,
+                'fats': ingredient.fats,
+                'carbs': ingredient.carbs
+            })
 
         if not selected_ingredients:
             flash('Выберите хотя бы один ингредиент', 'error')
         else:
             # Рассчитываем оптимальную диету с выбранными ингредиентами
-            result = calculate_optimal_diet(selected_ingredients, targets, selected_amounts)
+            solver, solver_options = solver_settings(current_app.config,
+                                                     form.integer_portions.data,
+                                                     form.min_portion.data,
+                                                     form.tolerance.data)
+
+            result = calculate_optimal_diet(selected_ingredients, targets, selected_amounts,
+                                            solver=solver, solver_options=solver_options,
+                                            cache=solution_cache, nutrients=nutrients)
 
             if result['success']:
-                # Ищем подходящие рецепты
-                available_recipes = Recipe.query.filter(
-                    or_(
-                        Recipe.user_id == current_user.id,
-                        Recipe.is_public == True
-                    )
-                ).all()
-
-                best_recipes = find_best_recipes(
-                    result['ingredients'],
-                    available_recipes
-                )
+                # Ищем подходящие рецепты (способ - RECIPE_MATCH_ENGINE)
+                best_recipes = match_recipes(current_user.id, result['ingredients'], catalog)
+
+                # Состояние для быстрого пересчёта при изменении целей
+                state_token = dump_state(current_app.config['SECRET_KEY'], current_user.id,
+                                         [ing.id for ing in selected_ingredients],
+                                         selected_amounts, targets, solver, solver_options,
+                                         result['solution'])
 
                 flash('Расчёт выполнен успешно!', 'success')
             else:
@@ -373,12 +454,218 @@ def calculate():
                          form=form,
                          result=result,
                          best_recipes=best_recipes,
-                         ingredients=available_ingredients,
-                         selected_ingredients=selected_ingredients_data)
+                         ingredients=catalog.sorted_by_name(),
+                         selected_ingredients=selected_ingredients_data,
+                         state_token=state_token,
+                         nutrient_definitions=catalog.definitions)
+
+
+@bp.route('/calculate/resolve', methods=['POST'])
+@login_required
+def api_resolve():
+    """
+    API быстрого пересчёта после изменения целей
+
+    Принимает токен состояния предыдущего расчёта и изменённые цели,
+    пересчитывает с тёплого старта и возвращает только количества и итоги.
+    """
+    data = request.get_json(silent=True)
+    if not data or not data.get('state'):
+        return jsonify({'success': False, 'message': 'Требуется токен состояния'}), 400
+
+    state = load_state(current_app.config['SECRET_KEY'], data['state'], current_user.id)
+    if state is None:
+        return jsonify({'success': False, 'message': 'Состояние устарело, выполните расчёт заново'}), 400
+
+    targets = state['targets']
+    try:
+        for key, value in (data.get('targets') or {}).items():
+            if key not in targets:
+                raise KeyError(key)
+            targets[key] = float(value)
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'success': False, 'message': f'Неверный формат данных: {str(e)}'}), 400
+
+    if any(not math.isfinite(value) or value < 0 for value in targets.values()):
+        return jsonify({'success': False, 'message': 'Значения целей должны быть неотрицательными числами'}), 400
+
+    catalog = nutrient_catalog.view(current_user.id)
+    keys = target_keys(targets)
+    if any(key not in catalog.keys for key in keys):
+        return jsonify({'success': False, 'message': 'Нутриенты изменились, выполните расчёт заново'}), 409
+
+    ingredient_ids = state['ingredient_ids']
+    selected_ingredients, _, nutrients = catalog.load_selected(
+        [{'ingredient_id': ingredient_id} for ingredient_id in ingredient_ids], keys
+    )
+    if len(selected_ingredients) != len(ingredient_ids):
+        return jsonify({'success': False, 'message': 'Ингредиенты изменились, выполните расчёт заново'}), 409
+
+    result = calculate_optimal_diet(selected_ingredients, targets, state['initial_amounts'],
+                                    solver=state['solver'], solver_options=state['solver_options'],
+                                    cache=solution_cache, nutrients=nutrients,
+                                    warm_start=state['warm_start'])
+
+    if not result['success']:
+        return jsonify({'success': False, 'message': result['error']}), 422
+
+    return jsonify({
+        'success': True,
+        'amounts': {str(ing_id): item['grams'] for ing_id, item in result['ingredients'].items()},
+        'total_nutrition': result['total_nutrition'],
+        'deviations': result['deviations'],
+        'total_weight': result['total_weight'],
+        'state': dump_state(current_app.config['SECRET_KEY'], current_user.id, ingredient_ids,
+                            state['initial_amounts'], targets, state['solver'],
+                            state['solver_options'], result['solution'])
+    })
+
+@bp.route('/calculate/batch', methods=['POST'])
+@login_required
+def api_calculate_batch():
+    """API для расчёта одного набора ингредиентов под много целей"""
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({'success': False, 'message': 'Требуется JSON'}), 400
+
+    targets_list = data.get('targets') or []
+    if not targets_list:
+        return jsonify({'success': False, 'message': 'Укажите хотя бы одну цель'}), 400
+
+    if len(targets_list) > MAX_BATCH_TARGETS:
+        return jsonify({
+            'success': False,
+            'message': f'Не больше {MAX_BATCH_TARGETS} целей за один запрос'
+        }), 400
+
+    catalog = nutrient_catalog.view(current_user.id)
+    try:
+        extra_keys = [key for key in catalog.keys if key not in NUTRIENT_KEYS and key in targets_list[0]]
+        targets_list = [parse_targets(t, extra_keys) for t in targets_list]
+        if any(target_keys(t) != target_keys(targets_list[0]) for t in targets_list):
+            raise ValueError('у всех целей должен быть одинаковый набор нутриентов')
+        selected_ingredients, selected_amounts, nutrients = catalog.load_selected(
+            data.get('ingredients'), target_keys(targets_list[0])
+        )
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'success': False, 'message': f'Неверный формат данных: {str(e)}'}), 400
+
+    if not selected_ingredients:
+        return jsonify({'success': False, 'message': 'Выберите хотя бы один ингредиент'}), 400
+
+    results = calculate_optimal_diet_batch(selected_ingredients, targets_list, selected_amounts,
+                                           solver=current_app.config.get('DIET_SOLVER', 'auto'),
+                                           nutrients=nutrients)
+
+    return jsonify({
+        'success': True,
+        'results': [result_to_dict(result) for result in results]
+    })
+
+@bp.route('/meal-plan', methods=['POST'])
+@login_required
+def api_meal_plan():
+    """API для составления плана питания на неделю"""
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({'success': False, 'message': 'Требуется JSON'}), 400
+
+    meal_targets = data.get('meal_targets') or []
+    if not meal_targets:
+        return jsonify({'success': False, 'message': 'Укажите цели хотя бы для одного приёма пищи'}), 400
+
+    if len(meal_targets) > MAX_MEALS_PER_DAY:
+        return jsonify({
+            'success': False,
+            'message': f'Не больше {MAX_MEALS_PER_DAY} приёмов пищи в день'
+        }), 400
+
+    try:
+        meal_targets = [{key: float(t[key]) for key in NUTRIENT_KEYS} for t in meal_targets]
+        day_targets = data.get('day_targets')
+        if day_targets is not None:
+            day_targets = {key: float(day_targets[key]) for key in NUTRIENT_KEYS}
+        days = int(data.get('days', DAYS_PER_WEEK))
+        max_weekly_uses = data.get('max_weekly_uses')
+        if max_weekly_uses is not None:
+            max_weekly_uses = int(max_weekly_uses)
+        selected_ingredients, _, _ = nutrient_catalog.view(current_user.id).load_selected(
+            data.get('ingredients')
+        )
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'success': False, 'message': f'Неверный формат данных: {str(e)}'}), 400
+
+    if not 1 <= days <= DAYS_PER_WEEK:
+        return jsonify({'success': False, 'message': f'Число дней должно быть от 1 до {DAYS_PER_WEEK}'}), 400
+
+    if max_weekly_uses is not None and max_weekly_uses < 1:
+        return jsonify({'success': False, 'message': 'Ограничение повторов должно быть не меньше 1'}), 400
+
+    if not selected_ingredients:
+        return jsonify({'success': False, 'message': 'Выберите хотя бы один ингредиент'}), 400
+
+    plan = plan_week(selected_ingredients, meal_targets, day_targets, days=days,
+                     max_weekly_uses=max_weekly_uses)
 
+    if not plan['success']:
+        return jsonify({'success': False, 'message': plan['error']}), 422
+
+    return jsonify(plan)
+
+@bp.route('/calculate/jobs', methods=['POST'])
+@login_required
+def api_submit_calculation():
+    """API для фонового расчёта: возвращает ID задания"""
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({'success': False, 'message': 'Требуется JSON'}), 400
+
+    try:
+        catalog = nutrient_catalog.view(current_user.id)
+        targets = parse_targets(data['targets'], catalog.keys[len(NUTRIENT_KEYS):])
+        ingredients = [
+            {'ingredient_id': int(item['ingredient_id']), 'amount': float(item.get('amount', 100))}
+            for item in data.get('ingredients') or []
+        ]
+        min_portion, tolerance = parse_portion_settings(data)
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'success': False, 'message': f'Неверный формат данных: {str(e)}'}), 400
+
+    auto_select = bool(data.get('auto_select', False))
+    if not ingredients and not auto_select:
+        return jsonify({'success': False, 'message': 'Выберите хотя бы один ингредиент'}), 400
+
+    job = enqueue_calculation(current_user.id, {
+        'targets': targets,
+        'ingredients': ingredients,
+        'auto_select': auto_select,
+        'max_ingredients': data.get('max_ingredients'),
+        'integer_portions': bool(data.get('integer_portions', False)),
+        'min_portion': min_portion,
+        'tolerance': tolerance
+    })
+
+    return jsonify({
+        'success': True,
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': url_for('user.api_calculation_job', job_id=job.id)
+    }), 202
+
+@bp.route('/calculate/jobs/<int:job_id>', methods=['GET'])
+@login_required
+def api_calculation_job(job_id):
+    """API для получения статуса и результата фонового расчёта"""
+    job = CalculationJob.query.get_or_404(job_id)
+
+    if job.user_id != current_user.id:
+        return jsonify({'success': False, 'message': 'Нет прав для просмотра'}), 403
+
+    return jsonify({'success': True, 'job': job.to_dict()})
 
 @bp.route('/my-ingredients', methods=['GET', 'POST'])
 @login_required
+@replica_reads
 def my_ingredients():
     # Обработка добавления нового ингредиента
     if request.method == 'POST' and request.content_type == 'application/x-www-form-urlencoded':
@@ -399,54 +686,28 @@ def my_ingredients():
             flash('Ингредиент успешно добавлен!', 'success')
             return redirect(url_for('user.my_ingredients'))
 
-    # Получение и фильтрация ингредиентов
-    page = request.args.get('page', 1, type=int)
-    per_page = 20
-
+    # Получение и фильтрация ингредиентов (админ видит и общие)
     if current_user.is_admin:
-        query = Ingredient.query.filter(
-            (Ingredient.user_id == current_user.id) |
-            (Ingredient.is_public == True)
-        )
-    else:
-        query = Ingredient.query.filter(
-            (Ingredient.user_id == current_user.id)
-        )
-
-    # Поиск
-    search = request.args.get('search', '').strip()
-    if search:
-        query = query.filter(Ingredient.name.ilike(f'%{search}%'))
-
-    # Сортировка
-    sort_by = request.args.get('sort_by', 'name')
-    sort_order = request.args.get('sort_order', 'asc')
-
-    sort_mapping = {
-        'calories': Ingredient.calories,
-        'proteins': Ingredient.proteins,
-        'fats': Ingredient.fats,
-        'carbs': Ingredient.carbs
-    }
-
-    if sort_by in sort_mapping:
-        if sort_order == 'desc':
-            query = query.order_by(sort_mapping[sort_by].desc())
-        else:
-            query = query.order_by(sort_mapping[sort_by])
+        def make_query(*criteria):
+            return visible_query(Ingredient, current_user.id, *criteria)
     else:
-        query = query.order_by(Ingredient.name)
+        def make_query(*criteria):
+            return Ingredient.query.filter(Ingredient.user_id == current_user.id, *criteria)
 
-    ingredients = query.paginate(page=page, per_page=per_page, error_out=False)
+    try:
+        ingredients, params = _ingredient_page(
+            make_query, request.args, 20,
+            ('my_ingredients', current_user.id, current_user.is_admin))
+    except InvalidCursor:
+        abort(400)
 
     form = IngredientForm()
 
     return render_template('user/my_ingredients.html',
                          ingredients=ingredients,
                          form=form,
-                         search=search,
-                         sort_by=sort_by,
-                         sort_order=sort_order)
+                         page_args={k: v for k, v in request.args.items() if k not in ('cursor', 'page')},
+                         **params)
 
 @bp.route('/ingredient/<int:ingredient_id>/details', methods=['GET'])
 @login_required
@@ -489,8 +750,13 @@ def update_ingredient(ingredient_id):
         ingredient.proteins = float(data['proteins'])
         ingredient.fats = float(data['fats'])
         ingredient.carbs = float(data['carbs'])
+        if 'extra_nutrients' in data:
+            ingredient.set_extra_nutrients(_extra_nutrients_from(data))
 
+        # Итоги рецептов с этим ингредиентом - в той же транзакции
+        RecipeTotals.refresh(ingredient_ids=[ingredient_id])
         db.session.commit()
+        solution_cache.invalidate_ingredients([ingredient_id])
 
         return jsonify({
             'success': True,
@@ -504,6 +770,7 @@ def update_ingredient(ingredient_id):
 
 @bp.route('/my-recipes', methods=['GET', 'POST'])
 @login_required
+@replica_reads
 def my_recipes():
     # Обработка добавления нового рецепта
     if request.method == 'POST' and request.content_type == 'application/x-www-form-urlencoded':
@@ -533,90 +800,223 @@ def my_recipes():
             db.session.flush()
 
             # Добавляем ингредиенты
-            ingredient_ids = request.form.getlist('ingredient_id')
-            amounts = request.form.getlist('ingredient_amount')
-
-            for ing_id, amount in zip(ingredient_ids, amounts):
-                if ing_id and amount:
-                    recipe_ingredient = recipe_ingredients(
-                        recipe_id=recipe.id,
-                        ingredient_id=int(ing_id),
-                        amount=float(amount)
-                    )
-                    db.session.add(recipe_ingredient)
+            try:
+                amounts = _recipe_amounts(
+                    (ing_id, amount)
+                    for ing_id, amount in zip(request.form.getlist('ingredient_id'),
+                                              request.form.getlist('ingredient_amount'))
+                    if ing_id and amount
+                )
+            except (ValueError, TypeError):
+                db.session.rollback()
+                flash('Неверный формат данных ингредиента', 'error')
+                return redirect(url_for('user.my_recipes'))
+            existing = Ingredient.existing_ids(amounts)
+            RecipeIngredient.write_amounts(recipe, {ing_id: grams for ing_id, grams in amounts.items()
+                                                    if ing_id in existing})
 
+            RecipeTotals.refresh([recipe.id])
             db.session.commit()
             flash('Рецепт успешно добавлен!', 'success')
             return redirect(url_for('user.my_recipes'))
 
     # Получение и фильтрация рецептов
-    page = request.args.get('page', 1, type=int)
-    per_page = 12
-    search = request.args.get('search', '').strip()
-
-    query = Recipe.query.filter(
-        or_(
-            Recipe.user_id == current_user.id,
-            Recipe.is_public == True
-        )
-    )
-
-    if search:
-        query = query.filter(Recipe.name.ilike(f'%{search}%'))
-
-    recipes = query.order_by(Recipe.created_at.desc()).paginate(
-        page=page, per_page=per_page, error_out=False
-    )
+    try:
+        recipes, params = _recipe_page(request.args, 12)
+    except InvalidCursor:
+        abort(400)
+    snippets = Recipe.snippets([recipe.id for recipe in recipes.items], params['search'])
+    summaries = Recipe.summaries([recipe.id for recipe in recipes.items])
 
-    # Получаем доступные ингредиенты для формы
-    available_ingredients = Ingredient.query.filter(
-        or_(
-            Ingredient.user_id == current_user.id,
-            Ingredient.is_public == True
-        )
-    ).order_by(Ingredient.name).all()
+    # Доступные ингредиенты для формы
+    available_ingredients = nutrient_catalog.view(current_user.id).sorted_by_name()
 
     form = RecipeForm()
 
     return render_template('user/my_recipes.html',
                          recipes=recipes,
                          form=form,
-                         search=search,
-                         ingredients=available_ingredients)
+                         snippets=snippets,
+                         summaries=summaries,
+                         page_args={k: v for k, v in request.args.items() if k not in ('cursor', 'page')},
+                         ingredients=available_ingredients,
+                         **params)
+
+
+def _recipe_amounts(items):
+    """
+    Состав рецепта из пар (id ингредиента, граммы): {id: целые граммы}
+
+    Пары с id или количеством не больше нуля пропускаются, количества
+    повторяющегося ингредиента складываются.
+
+    Raises:
+        ValueError, TypeError: id или количество не число
+    """
+    amounts = {}
+    for ingredient_id, amount in items:
+        ingredient_id, amount = int(ingredient_id), float(amount)
+        if ingredient_id > 0 and amount > 0:
+            amounts[ingredient_id] = amounts.get(ingredient_id, 0) + amount
+    return {ingredient_id: round(amount) for ingredient_id, amount in amounts.items()
+            if round(amount) > 0}
+
+
+def _recipe_page(args, per_page):
+    """
+    Страница видимых пользователю рецептов по параметрам запроса (search,
+    диапазоны КБЖУ, sort_by, sort_order, cursor)
+
+    Returns:
+        (KeysetPage, параметры списка для шаблона)
+
+    Raises:
+        InvalidCursor: курсор не подходит к списку
+    """
+    search = args.get('search', '').strip()
+
+    # Полнотекстовый поиск по названию, описанию и инструкциям
+    criteria, rank, options = [], None, ()
+    if search:
+        criterion, rank, options = Recipe.text_search(search)
+        criteria.append(criterion)
+    query = visible_query(Recipe, current_user.id, *criteria, options=options)
+
+    # Фильтр и сортировка по сохранённым КБЖУ
+    query, ranges = RecipeTotals.filter_query(query, args)
+
+    sort_by = args.get('sort_by', 'relevance' if rank is not None else 'created_at')
+    sort_order = args.get('sort_order', 'desc')
+    # Итоги присоединены внешним соединением: у рецепта без строки итогов они
+    # NULL и выпали бы из сравнения с курсором - считаем их нулём
+    sort_mapping = {
+        'calories': func.coalesce(RecipeTotals.calories, 0.0),
+        'proteins': func.coalesce(RecipeTotals.proteins, 0.0),
+        'created_at': Recipe.created_at
+    }
+    if sort_by == 'relevance' and rank is not None:
+        sort_column, sort_order = rank, 'desc'
+    else:
+        if sort_by not in sort_mapping:
+            sort_by = 'created_at'
+        sort_column = sort_mapping[sort_by]
+
+    page = keyset_paginate(query, (sort_column, Recipe.id), cursor=args.get('cursor'),
+                           per_page=per_page, descending=sort_order != 'asc', sort=sort_by,
+                           count_key=('my_recipes', current_user.id, search,
+                                      tuple(sorted(ranges.items()))))
+    return page, {'search': search, 'ranges': ranges, 'sort_by': sort_by,
+                  'sort_order': sort_order}
+
+@bp.route('/recipes', methods=['GET'])
+@login_required
+@replica_reads
+def api_recipes():
+    """
+    API списка видимых рецептов постранично по курсору
+
+    Параметры - как на странице рецептов (search, min_/max_calories,
+    min_/max_proteins, sort_by, sort_order), limit и cursor.
+    """
+    limit, error = _page_limit()
+    if error:
+        return error
+    try:
+        page, params = _recipe_page(request.args, limit)
+    except InvalidCursor as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    return jsonify({
+        'success': True,
+        'recipes': [{
+            'id': recipe.id,
+            'name': recipe.name,
+            'description': recipe.description,
+            'is_public': recipe.is_public,
+            'is_own': recipe.user_id == current_user.id,
+            'nutrition': recipe.nutrition_totals()
+        } for recipe in page.items],
+        'sort_by': params['sort_by'],
+        'sort_order': params['sort_order'],
+        **page.to_dict()
+    })
+
+@bp.route('/recipes/nearest', methods=['GET'])
+@login_required
+@replica_reads
+def api_nearest_recipes():
+    """
+    API поиска рецептов, ближайших к цели по КБЖУ (без расчёта рациона)
+
+    Параметры: calories, proteins, fats, carbs (хотя бы один), k - число
+    рецептов, scope - 'all' (общие и свои) или 'public'.
+    """
+    try:
+        targets = {key: float(request.args[key]) for key in MACRO_KEYS if request.args.get(key)}
+        k = int(request.args.get('k', 5))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': f'Неверный формат данных: {str(e)}'}), 400
+
+    if not targets:
+        return jsonify({'success': False, 'message': 'Укажите хотя бы одно значение КБЖУ'}), 400
+    if any(not math.isfinite(value) or value < 0 for value in targets.values()):
+        return jsonify({'success': False, 'message': 'Значения КБЖУ должны быть неотрицательными числами'}), 400
+    if not 1 <= k <= MAX_NEAREST_RECIPES:
+        return jsonify({'success': False, 'message': f'k должно быть от 1 до {MAX_NEAREST_RECIPES}'}), 400
+
+    scope = request.args.get('scope', 'all')
+    if scope not in SCOPES:
+        return jsonify({'success': False, 'message': f'Неизвестная область поиска: {scope}'}), 400
+
+    nearest = recipe_search.nearest(current_user.id, targets, k=k, scope=scope)
+
+    # Деревья обновляются не сразу после изменений: видимость проверяется
+    # заново по базе, рецепты, удалённые или скрытые с тех пор, пропускаются
+    recipes = {}
+    if nearest:
+        found = Recipe.id.in_([recipe_id for _, recipe_id in nearest])
+        query = (Recipe.query.filter(Recipe.is_public == True, found) if scope == 'public'
+                 else visible_query(Recipe, current_user.id, found))
+        recipes = {recipe.id: recipe for recipe in query}
+
+    results = []
+    for distance, recipe_id in nearest:
+        recipe = recipes.get(recipe_id)
+        if recipe is None:
+            continue
+        results.append({
+            'id': recipe.id,
+            'name': recipe.name,
+            'is_public': recipe.is_public,
+            'distance': round(distance, 1),
+            'nutrition': recipe.nutrition_totals()
+        })
+
+    return jsonify({'success': True, 'targets': targets, 'recipes': results})
 
 @bp.route('/my-recipes/<int:recipe_id>/details', methods=['GET'])
 @login_required
+@replica_reads
 def get_recipe_details(recipe_id):
     """Получить детали рецепта"""
-    recipe = Recipe.query.get_or_404(recipe_id)
+    recipe = Recipe.query.options(Recipe.with_items()).filter_by(id=recipe_id).first_or_404()
 
     # Проверяем права
     if recipe.user_id != current_user.id and not recipe.is_public:
         return jsonify({'success': False, 'message': 'Нет прав для просмотра'}), 403
 
-    # Получаем ингредиенты
-    ingredients_result = db.session.execute(
-        text("""
-            SELECT i.id, i.name, i.calories, ri.amount_grams
-            FROM recipe_ingredients ri
-            JOIN ingredient i ON ri.ingredient_id = i.id
-            WHERE ri.recipe_id = :recipe_id
-        """),
-        {'recipe_id': recipe_id}
-    ).fetchall()
-
-    # Формируем список ингредиентов
+    # Формируем список ингредиентов (состав уже загружен вместе с рецептом)
     ingredients = []
-    for row in ingredients_result:
+    for item in recipe.items:
         ingredients.append({
-            'id': row[0],
-            'name': row[1],
-            'calories_per_100g': float(row[2]),
-            'amount_grams': float(row[3])
+            'id': item.ingredient.id,
+            'name': item.ingredient.name,
+            'calories_per_100g': float(item.ingredient.calories),
+            'amount_grams': float(item.amount_grams)
         })
 
-    # Рассчитываем КБЖУ
-    nutrition = recipe.calculate_nutrition()
+    # КБЖУ из сохранённых итогов рецепта
+    nutrition = recipe.nutrition_totals()
 
     return jsonify({
         'success': True,
@@ -670,38 +1070,15 @@ def update_recipe(recipe_id):
         if current_user.is_admin:
             recipe.is_public = data.get('is_public', False)
 
-        # Удаляем старые ингредиенты
-        db.session.execute(
-            text("DELETE FROM recipe_ingredients WHERE recipe_id = :recipe_id"),
-            {'recipe_id': recipe_id}
-        )
-
-        # Добавляем новые ингредиенты
-        for ing_data in data['ingredients']:
-            ingredient_id = int(ing_data.get('ingredient_id', 0))
-            amount_grams = float(ing_data.get('amount', 0))
-
-            if ingredient_id <= 0 or amount_grams <= 0:
-                continue
-
-            # Проверяем существование ингредиента
-            ingredient = Ingredient.query.get(ingredient_id)
-            if not ingredient:
-                continue
-
-            # Добавляем связь
-            db.session.execute(
-                text("""
-                    INSERT INTO recipe_ingredients (recipe_id, ingredient_id, amount_grams)
-                    VALUES (:recipe_id, :ingredient_id, :amount_grams)
-                """),
-                {
-                    'recipe_id': recipe_id,
-                    'ingredient_id': ingredient_id,
-                    'amount_grams': amount_grams
-                }
-            )
+        # Новый состав записывается разницей с текущим: меняются только
+        # добавленные, убранные и изменённые строки
+        amounts = _recipe_amounts((ing.get('ingredient_id', 0), ing.get('amount', 0))
+                                  for ing in data['ingredients'])
+        existing = Ingredient.existing_ids(amounts)
+        RecipeIngredient.write_amounts(recipe, {ing_id: grams for ing_id, grams in amounts.items()
+                                                if ing_id in existing})
 
+        RecipeTotals.refresh([recipe_id])
         db.session.commit()
 
         return jsonify({
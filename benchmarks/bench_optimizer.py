@@ -0,0 +1,358 @@
+"""
+Нагрузочные замеры оптимизатора рациона и подбора рецептов
+
+Каталоги ингредиентов и рецептов генерируются синтетически с фиксированным
+seed, поэтому прогоны повторяемы. Для каждого сценария записываются
+перцентили задержки, число итераций метода и пиковая память (tracemalloc),
+итог пишется в JSON. Если задан базовый отчёт, сценарии, ставшие медленнее
+или тяжелее допустимого, перечисляются и скрипт завершается с кодом 1.
+
+    python -m benchmarks.bench_optimizer --quick
+    python -m benchmarks.bench_optimizer --baseline benchmarks/baseline.json
+    python -m benchmarks.bench_optimizer --quick --save-baseline benchmarks/baseline.json
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from collections import namedtuple
+from itertools import cycle
+import numpy as np
+import scipy
+from app.calculation import calculate_optimal_diet, find_best_recipes, _target_vector
+from app.catalog import CatalogIngredient, CatalogView
+from app.recipe_index import RecipeIndexBlock
+from app.recipe_search import MacroSearchBlock
+from app.solvers import SOLVERS, NUTRIENT_KEYS, amount_bounds, initial_guess, nutrient_matrix
+
+REPORT_VERSION = 1
+
+# Размеры каталогов: полный прогон и быстрый (для CI)
+SOLVE_SIZES = (5, 50, 500, 5000)
+MATCH_SIZES = (10, 1000, 10000, 100000)
+QUICK_SOLVE_SIZES = (5, 50, 500)
+QUICK_MATCH_SIZES = (10, 1000, 10000)
+
+# До скольких ингредиентов имеет смысл гонять медленные методы
+SOLVER_MAX_SIZE = {'auto': None, 'lsq': None, 'slsqp': 50, 'milp': 50}
+
+# Каталог, из которого составляются синтетические рецепты
+MATCH_CATALOG_SIZE = 500
+RECIPE_SIZE = (3, 12)
+
+# Какой перцентиль задержки сравнивать с базовым отчётом: медиана устойчива
+# к шуму общего CI, p95/p99 - для проверки хвостов на выделенной машине
+COMPARED_METRIC = 'p50_ms'
+
+# Допустимое ухудшение относительно базового отчёта (доли)
+MAX_SLOWDOWN = 0.5
+MAX_MEMORY_GROWTH = 0.25
+MAX_ITERATION_GROWTH = 0.5
+
+# Задержки меньше этого порога не сравниваются: там один шум таймера, мс
+MIN_COMPARED_MS = 1.0
+
+SyntheticRecipe = namedtuple('SyntheticRecipe', ['id', 'name'])
+
+
+class SyntheticIngredient:
+    """Ингредиент с теми же атрибутами, что читает расчёт у Ingredient"""
+
+    def __init__(self, id, calories, proteins, fats, carbs):
+        self.id = id
+        self.name = f"Ингредиент {id}"
+        self.calories = calories
+        self.proteins = proteins
+        self.fats = fats
+        self.carbs = carbs
+
+
+def make_ingredients(rng, n):
+    """
+    Каталог из n ингредиентов с правдоподобным КБЖУ на 100г
+
+    Белки, жиры и углеводы в сумме не больше 100г, калории - по Атуотеру
+    с небольшим шумом.
+    """
+    macros = rng.dirichlet([1.0, 0.6, 1.0, 1.4], size=n)[:, :3] * rng.uniform(20, 100, size=(n, 1))
+    calories = macros @ np.array([4.0, 9.0, 4.0]) * rng.uniform(0.95, 1.05, size=n)
+    return [
+        SyntheticIngredient(i + 1, round(float(calories[i]), 1), *np.round(macros[i], 1).tolist())
+        for i in range(n)
+    ]
+
+
+def make_targets(rng, count):
+    """Цели КБЖУ на приём пищи или день (от 400 до 3000 ккал)"""
+    targets = []
+    for calories in rng.uniform(400, 3000, size=count):
+        shares = rng.dirichlet([6.0, 6.0, 10.0])
+        targets.append({
+            'calories': round(float(calories), 1),
+            'proteins': round(float(calories * shares[0] / 4), 1),
+            'fats': round(float(calories * shares[1] / 9), 1),
+            'carbs': round(float(calories * shares[2] / 4), 1),
+        })
+    return targets
+
+
+def make_catalog(ingredients):
+    """CatalogView из синтетических ингредиентов (как его строит app.catalog)"""
+    rows = [CatalogIngredient(ing.id, ing.name, ing.calories, ing.proteins, ing.fats, ing.carbs,
+                              True, None, {})
+            for ing in ingredients]
+    nutrients = np.asfortranarray(nutrient_matrix(ingredients))
+    return CatalogView(rows, nutrients, NUTRIENT_KEYS, [])
+
+
+def make_recipes(rng, catalog, count):
+    """Рецепты и их состав {id рецепта: [(id ингредиента, граммы)]}"""
+    recipes = []
+    amounts = {}
+    for recipe_id in range(1, count + 1):
+        size = rng.integers(RECIPE_SIZE[0], RECIPE_SIZE[1] + 1)
+        ids = rng.choice(catalog.ids, size=size, replace=False)
+        grams = np.round(rng.uniform(5, 300, size=size) / 5) * 5
+        recipes.append(SyntheticRecipe(recipe_id, f"Рецепт {recipe_id}"))
+        amounts[recipe_id] = list(zip(ids.tolist(), grams.tolist()))
+    return recipes, amounts
+
+
+def measure(call, repeats):
+    """Задержки вызова в мс и пиковая память отдельного прогона под tracemalloc"""
+    call()  # прогрев: импорты, кэши numpy/scipy
+
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        call()
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    call()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return latencies, peak
+
+
+def summarize(latencies, peak, iterations=None, **extra):
+    summary = {
+        'repeats': len(latencies),
+        'p50_ms': round(float(np.percentile(latencies, 50)), 3),
+        'p95_ms': round(float(np.percentile(latencies, 95)), 3),
+        'p99_ms': round(float(np.percentile(latencies, 99)), 3),
+        'max_ms': round(float(np.max(latencies)), 3),
+        'peak_kb': round(peak / 1024, 1),
+        'iterations': iterations,
+    }
+    summary.update(extra)
+    return summary
+
+
+def solver_iterations(ingredients, targets, solver):
+    """Среднее число итераций метода на тех же задачах (без замера времени)"""
+    nutrients = nutrient_matrix(ingredients)
+    lower, upper = amount_bounds(None, len(ingredients))
+    x0 = initial_guess(None, len(ingredients), lower, upper)
+
+    counts = []
+    for target in targets:
+        result = SOLVERS[solver](nutrients, _target_vector(target), lower, upper, x0)
+        count = getattr(result, 'nit', None)
+        if count is None:
+            count = getattr(result, 'mip_node_count', None)
+        if count is not None:
+            counts.append(int(count))
+    return round(float(np.mean(counts)), 1) if counts else None
+
+
+def bench_solve(seed, sizes, repeats):
+    """Сценарии calculate_optimal_diet: каждый метод на каждом размере каталога"""
+    cases = {}
+    for size in sizes:
+        # Свой генератор на размер: данные не зависят от набора размеров (--quick)
+        rng = np.random.default_rng([seed, size])
+        ingredients = make_ingredients(rng, size)
+        targets = make_targets(rng, repeats)
+
+        for solver, max_size in SOLVER_MAX_SIZE.items():
+            if max_size is not None and size > max_size:
+                continue
+
+            queue = cycle(targets)
+            failures = []
+
+            def call():
+                result = calculate_optimal_diet(ingredients, next(queue), solver=solver)
+                if not result['success']:
+                    failures.append(result['error'])
+
+            latencies, peak = measure(call, repeats)
+            cases[f'solve/{solver}/n={size}'] = summarize(
+                latencies, peak, solver_iterations(ingredients, targets, solver),
+                failures=len(failures)
+            )
+            print(f"  solve/{solver}/n={size}: p95 {cases[f'solve/{solver}/n={size}']['p95_ms']} мс")
+    return cases
+
+
+def bench_match(seed, sizes, repeats):
+    """Сценарии find_best_recipes по каталогу и RecipeIndexBlock.rank на тех же рецептах"""
+    rng = np.random.default_rng([seed, MATCH_CATALOG_SIZE])
+    ingredients = make_ingredients(rng, MATCH_CATALOG_SIZE)
+    catalog = make_catalog(ingredients)
+    chosen = rng.choice(len(ingredients), size=8, replace=False)
+    diet = calculate_optimal_diet([ingredients[i] for i in chosen], make_targets(rng, 1)[0])
+    optimal = diet['ingredients']
+    weights = {ing_id: data['grams'] for ing_id, data in optimal.items()}
+
+    cases = {}
+    for size in sizes:
+        recipes, amounts = make_recipes(np.random.default_rng([seed, 0, size]), catalog, size)
+        # На больших каталогах рецептов хватает нескольких повторов
+        count = max(3, min(repeats, 200_000 // size))
+
+        def call():
+            find_best_recipes(optimal, recipes, top_n=3, catalog=catalog, recipe_amounts=amounts)
+
+        latencies, peak = measure(call, count)
+        cases[f'match/recipes={size}'] = summarize(latencies, peak, recipes=size)
+        print(f"  match/recipes={size}: p95 {cases[f'match/recipes={size}']['p95_ms']} мс")
+
+        # Тот же подбор по разреженной матрице индекса рецептов
+        block = RecipeIndexBlock((recipe_id, ingredient_id, grams)
+                                 for recipe_id, items in amounts.items()
+                                 for ingredient_id, grams in items)
+
+        def call():
+            block.rank(weights, top_n=3)
+
+        latencies, peak = measure(call, repeats)
+        cases[f'match_index/recipes={size}'] = summarize(latencies, peak, recipes=size)
+        print(f"  match_index/recipes={size}: p95 "
+              f"{cases[f'match_index/recipes={size}']['p95_ms']} мс")
+
+        # Поиск ближайших по КБЖУ рецептов (итоги - по составу из индекса)
+        totals = block.matrix @ catalog.matrix(cols=catalog.columns(block.ingredient_ids.tolist())).T
+        start = time.perf_counter()
+        search = MacroSearchBlock((recipe_id, *row) for recipe_id, row
+                                  in zip(block.recipe_ids.tolist(), totals.tolist()))
+        search.nearest(np.zeros(2), (0, 1), 1)
+        build_ms = round((time.perf_counter() - start) * 1000, 3)
+        queue = cycle(make_targets(np.random.default_rng([seed, 1, size]), repeats))
+
+        def call():
+            target = next(queue)
+            search.nearest(np.array([target['calories'], target['proteins'] * 4]), (0, 1), 5)
+
+        latencies, peak = measure(call, repeats)
+        cases[f'nearest/recipes={size}'] = summarize(latencies, peak, recipes=size,
+                                                     build_ms=build_ms)
+        print(f"  nearest/recipes={size}: p95 {cases[f'nearest/recipes={size}']['p95_ms']} мс")
+    return cases
+
+
+def run(seed=0, quick=False, repeats=30):
+    """Прогнать все сценарии и вернуть отчёт"""
+    print("Расчёт рациона:")
+    cases = bench_solve(seed, QUICK_SOLVE_SIZES if quick else SOLVE_SIZES, repeats)
+    print("Подбор рецептов:")
+    cases.update(bench_match(seed, QUICK_MATCH_SIZES if quick else MATCH_SIZES, repeats))
+
+    return {
+        'version': REPORT_VERSION,
+        'seed': seed,
+        'quick': quick,
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'scipy': scipy.__version__,
+            'machine': platform.machine(),
+        },
+        'cases': cases,
+    }
+
+
+def compare(report, baseline, max_slowdown=MAX_SLOWDOWN, max_memory_growth=MAX_MEMORY_GROWTH,
+            max_iteration_growth=MAX_ITERATION_GROWTH, metric=COMPARED_METRIC):
+    """
+    Сравнить отчёт с базовым
+
+    Сравниваются только сценарии, которые есть в обоих отчётах: задержка metric,
+    пиковая память и число итераций, плюс появление неуспешных расчётов.
+
+    Returns:
+        Список строк с описанием регрессий (пустой - регрессий нет)
+    """
+    regressions = []
+    for name, old in baseline.get('cases', {}).items():
+        new = report['cases'].get(name)
+        if new is None:
+            continue
+
+        if old[metric] >= MIN_COMPARED_MS and new[metric] > old[metric] * (1 + max_slowdown):
+            regressions.append(f"{name}: {metric} {old[metric]} -> {new[metric]}")
+
+        if new['peak_kb'] > old['peak_kb'] * (1 + max_memory_growth):
+            regressions.append(f"{name}: память {old['peak_kb']} -> {new['peak_kb']} КБ")
+
+        if old.get('iterations') and new.get('iterations') \
+                and new['iterations'] > old['iterations'] * (1 + max_iteration_growth):
+            regressions.append(f"{name}: итерации {old['iterations']} -> {new['iterations']}")
+
+        if new.get('failures', 0) > old.get('failures', 0):
+            regressions.append(f"{name}: неуспешных расчётов {old.get('failures', 0)} -> "
+                               f"{new['failures']}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Замеры скорости оптимизатора и подбора рецептов')
+    parser.add_argument('--seed', type=int, default=0, help='seed генератора каталогов')
+    parser.add_argument('--quick', action='store_true',
+                        help='только небольшие каталоги (до 500 ингредиентов и 10000 рецептов)')
+    parser.add_argument('--repeats', type=int, default=30, help='повторов на сценарий')
+    parser.add_argument('--report', default='benchmarks/report.json', help='куда записать отчёт')
+    parser.add_argument('--baseline', help='базовый отчёт для сравнения')
+    parser.add_argument('--save-baseline', help='записать отчёт ещё и как базовый')
+    parser.add_argument('--max-slowdown', type=float, default=MAX_SLOWDOWN,
+                        help='допустимый рост задержки, доля')
+    parser.add_argument('--metric', default=COMPARED_METRIC,
+                        choices=['p50_ms', 'p95_ms', 'p99_ms'], help='сравниваемый перцентиль')
+    parser.add_argument('--max-memory-growth', type=float, default=MAX_MEMORY_GROWTH,
+                        help='допустимый рост пиковой памяти, доля')
+    parser.add_argument('--max-iteration-growth', type=float, default=MAX_ITERATION_GROWTH,
+                        help='допустимый рост числа итераций, доля')
+    args = parser.parse_args(argv)
+
+    report = run(seed=args.seed, quick=args.quick, repeats=args.repeats)
+
+    for path in filter(None, (args.report, args.save_baseline)):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Отчёт: {args.report}")
+
+    if not args.baseline:
+        return 0
+
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline.get('seed') != report['seed']:
+        print("Базовый отчёт снят с другим seed, сравнение может быть неточным")
+
+    regressions = compare(report, baseline, args.max_slowdown, args.max_memory_growth,
+                          args.max_iteration_growth, args.metric)
+    for line in regressions:
+        print(f"[REGRESSION] {line}")
+    if regressions:
+        return 1
+
+    print("Регрессий относительно базового отчёта нет")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
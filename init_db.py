@@ -6,6 +6,8 @@
 
 import sys
 import argparse
+from flask_migrate import upgrade
+from sqlalchemy import text
 from app import create_app, db
 from app.models import User, Ingredient
 
@@ -16,10 +18,13 @@ def init_database(drop_all=False):
     with app.app_context():
         if drop_all:
             print("Удаление всех таблиц...")
-            db.drop_all()
+            db.drop_all(bind_key=None)
+            db.session.execute(text('DROP TABLE IF EXISTS alembic_version'))
+            db.session.commit()
         
-        print("Создание таблиц...")
-        db.create_all()
+        # Таблицы создают миграции: схема всегда совпадает с alembic_version
+        print("Применение миграций...")
+        upgrade()
         
         # Проверяем, есть ли уже админ
         admin = User.query.filter_by(username='admin').first()
@@ -0,0 +1,64 @@
+"""полнотекстовый поиск рецептов: search_vector, триггер и GIN-индекс
+
+Revision ID: 3b7c1e9a4d20
+Revises: df06acbd9b13
+Create Date: 2026-10-18 13:00:00.000000
+
+Только PostgreSQL. Столбец и триггер могли уже создаться create_all
+в новой базе, поэтому проверки существования; существующие рецепты
+заполняются одним UPDATE. Текст триггера - копия app.models.RECIPE_SEARCH_TRIGGER
+на момент миграции: миграция не импортирует модели.
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '3b7c1e9a4d20'
+down_revision = 'df06acbd9b13'
+branch_labels = None
+depends_on = None
+
+RECIPE_SEARCH_TRIGGER = """
+CREATE OR REPLACE FUNCTION recipe_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('russian', coalesce(NEW.name, '')), 'A') ||
+        setweight(to_tsvector('russian', coalesce(NEW.description, '')), 'B') ||
+        setweight(to_tsvector('russian', coalesce(NEW.instructions, '')), 'C');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS recipe_search_vector_update ON recipe;
+CREATE TRIGGER recipe_search_vector_update
+    BEFORE INSERT OR UPDATE OF name, description, instructions ON recipe
+    FOR EACH ROW EXECUTE FUNCTION recipe_search_vector_update();
+"""
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+
+    columns = {column['name'] for column in sa.inspect(bind).get_columns('recipe')}
+    if 'search_vector' not in columns:
+        op.add_column('recipe', sa.Column('search_vector', postgresql.TSVECTOR(), nullable=True))
+
+    op.execute(RECIPE_SEARCH_TRIGGER)
+    # Триггер срабатывает на UPDATE OF name - пересчитывает вектор
+    op.execute('UPDATE recipe SET name = name WHERE search_vector IS NULL')
+    op.create_index('ix_recipe_search_vector', 'recipe', ['search_vector'],
+                    postgresql_using='gin', if_not_exists=True)
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.drop_index('ix_recipe_search_vector', table_name='recipe', if_exists=True)
+    op.execute('DROP TRIGGER IF EXISTS recipe_search_vector_update ON recipe')
+    op.execute('DROP FUNCTION IF EXISTS recipe_search_vector_update()')
+    op.drop_column('recipe', 'search_vector')
@@ -0,0 +1,28 @@
+"""отметка воркера (heartbeat) у фоновых расчётов
+
+Revision ID: 5e9b3d7f2a41
+Revises: 8d4f2a6c1b57
+Create Date: 2026-10-19 12:00:00.000000
+
+Зависшие задания раньше определялись по started_at, и долгое, но живое
+задание возвращалось в очередь. Уже выполняющимся заданиям отметка
+ставится равной started_at.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e9b3d7f2a41'
+down_revision = '8d4f2a6c1b57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('calculation_job', sa.Column('heartbeat_at', sa.DateTime(), nullable=True))
+    op.execute("UPDATE calculation_job SET heartbeat_at = started_at WHERE status = 'running'")
+
+
+def downgrade():
+    op.drop_column('calculation_job', 'heartbeat_at')
@@ -0,0 +1,40 @@
+"""итоги КБЖУ рецептов, созданных до появления recipe_totals
+
+Revision ID: 8d4f2a6c1b57
+Revises: 3b7c1e9a4d20
+Create Date: 2026-10-19 10:00:00.000000
+
+Раньше недостающие итоги досчитывались при каждом запуске приложения;
+теперь - один раз здесь. SQL тот же, что у RecipeTotals._insert, но без
+импорта моделей: миграция не должна зависеть от их будущих версий.
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '8d4f2a6c1b57'
+down_revision = '3b7c1e9a4d20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("""
+        INSERT INTO recipe_totals (recipe_id, weight, calories, proteins, fats, carbs)
+        SELECT r.id,
+               COALESCE(SUM(COALESCE(ri.amount_grams, 0)), 0),
+               COALESCE(SUM(i.calories * COALESCE(ri.amount_grams, 0) / 100.0), 0),
+               COALESCE(SUM(i.proteins * COALESCE(ri.amount_grams, 0) / 100.0), 0),
+               COALESCE(SUM(i.fats * COALESCE(ri.amount_grams, 0) / 100.0), 0),
+               COALESCE(SUM(i.carbs * COALESCE(ri.amount_grams, 0) / 100.0), 0)
+        FROM recipe r
+        LEFT JOIN recipe_ingredients ri ON ri.recipe_id = r.id
+        LEFT JOIN ingredient i ON i.id = ri.ingredient_id
+        WHERE r.id NOT IN (SELECT recipe_id FROM recipe_totals)
+        GROUP BY r.id
+    """)
+
+
+def downgrade():
+    # Итоги - производные данные, удалять нечего
+    pass
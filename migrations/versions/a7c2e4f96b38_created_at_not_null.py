@@ -0,0 +1,30 @@
+"""created_at ингредиентов и рецептов не NULL
+
+Revision ID: a7c2e4f96b38
+Revises: 5e9b3d7f2a41
+Create Date: 2026-10-19 14:00:00.000000
+
+created_at - ключ пагинации по курсору: строка с NULL не проходит сравнение
+(created_at, id) > (курсор) и пропадает из списка. Пустые значения
+заполняются временем миграции.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c2e4f96b38'
+down_revision = '5e9b3d7f2a41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('ingredient', 'recipe'):
+        op.execute(f"UPDATE {table} SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL")
+        op.alter_column(table, 'created_at', existing_type=sa.DateTime(), nullable=False)
+
+
+def downgrade():
+    for table in ('ingredient', 'recipe'):
+        op.alter_column(table, 'created_at', existing_type=sa.DateTime(), nullable=True)
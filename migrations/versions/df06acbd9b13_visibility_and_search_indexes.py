@@ -0,0 +1,71 @@
+"""индексы видимости (общие/свои), состава рецептов и поиска по названию
+
+Revision ID: df06acbd9b13
+Revises: ef82562f6039
+Create Date: 2026-10-18 12:30:00.000000
+
+Частичные индексы общих записей и индексы по user_id - для веток
+UNION ALL в app.models.visible_query, индекс recipe_ingredients по
+ingredient_id - для поиска рецептов по ингредиенту, GIN pg_trgm - для
+ILIKE '%...%' по названию (если pg_trgm установлен на сервере).
+Индексы могли уже создаться create_all в новой базе, поэтому IF NOT EXISTS.
+"""
+import logging
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'df06acbd9b13'
+down_revision = 'ef82562f6039'
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger('alembic.env')
+
+
+def _trgm_available(bind):
+    # Как app.models.trgm_available: миграция не импортирует модели
+    return bind.execute(
+        sa.text("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+    ).scalar() is not None
+
+
+def upgrade():
+    op.create_index('ix_recipe_ingredients_ingredient_id', 'recipe_ingredients',
+                    ['ingredient_id'], if_not_exists=True)
+    op.create_index('ix_ingredient_user_id_name', 'ingredient', ['user_id', 'name'],
+                    if_not_exists=True)
+    op.create_index('ix_recipe_user_id_created_at', 'recipe', ['user_id', 'created_at'],
+                    if_not_exists=True)
+
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.create_index('ix_ingredient_public_name', 'ingredient', ['name'],
+                    postgresql_where=sa.text('is_public'), if_not_exists=True)
+    op.create_index('ix_recipe_public_created_at', 'recipe', ['created_at'],
+                    postgresql_where=sa.text('is_public'), if_not_exists=True)
+
+    if not _trgm_available(op.get_bind()):
+        logger.warning('pg_trgm не установлен на сервере: индексы поиска по названию пропущены')
+        return
+
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('ix_ingredient_name_trgm', 'ingredient', ['name'], postgresql_using='gin',
+                    postgresql_ops={'name': 'gin_trgm_ops'}, if_not_exists=True)
+    op.create_index('ix_recipe_name_trgm', 'recipe', ['name'], postgresql_using='gin',
+                    postgresql_ops={'name': 'gin_trgm_ops'}, if_not_exists=True)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        for name, table in (('ix_recipe_name_trgm', 'recipe'),
+                            ('ix_ingredient_name_trgm', 'ingredient'),
+                            ('ix_recipe_public_created_at', 'recipe'),
+                            ('ix_ingredient_public_name', 'ingredient')):
+            op.drop_index(name, table_name=table, if_exists=True)
+
+    op.drop_index('ix_recipe_user_id_created_at', table_name='recipe')
+    op.drop_index('ix_ingredient_user_id_name', table_name='ingredient')
+    op.drop_index('ix_recipe_ingredients_ingredient_id', table_name='recipe_ingredients')
@@ -0,0 +1,136 @@
+"""baseline: схема, которую до миграций создавал db.create_all()
+
+Revision ID: ef82562f6039
+Revises: 
+Create Date: 2026-10-18 12:00:00.000000
+
+Базы, созданные create_all, уже содержат часть этих таблиц: создаются
+только недостающие, поэтому миграция подходит и для новой, и для
+существующей базы.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'ef82562f6039'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def _missing(table):
+    return not sa.inspect(op.get_bind()).has_table(table)
+
+
+def upgrade():
+    if _missing('user'):
+        op.create_table('user',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('username', sa.String(length=64), nullable=False),
+            sa.Column('email', sa.String(length=120), nullable=False),
+            sa.Column('password_hash', sa.String(length=256), nullable=True),
+            sa.Column('is_admin', sa.Boolean(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('ix_user_email', 'user', ['email'], unique=True)
+        op.create_index('ix_user_username', 'user', ['username'], unique=True)
+
+    if _missing('ingredient'):
+        op.create_table('ingredient',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('name', sa.String(length=100), nullable=False),
+            sa.Column('calories', sa.Float(), nullable=False),
+            sa.Column('proteins', sa.Float(), nullable=False),
+            sa.Column('fats', sa.Float(), nullable=False),
+            sa.Column('carbs', sa.Float(), nullable=False),
+            sa.Column('is_public', sa.Boolean(), nullable=True),
+            sa.Column('user_id', sa.Integer(), nullable=False),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('id')
+        )
+
+    if _missing('recipe'):
+        op.create_table('recipe',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('name', sa.String(length=200), nullable=False),
+            sa.Column('description', sa.Text(), nullable=True),
+            sa.Column('instructions', sa.Text(), nullable=False),
+            sa.Column('image_url', sa.String(length=500), nullable=True),
+            sa.Column('is_public', sa.Boolean(), nullable=True),
+            sa.Column('user_id', sa.Integer(), nullable=False),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('id')
+        )
+
+    if _missing('recipe_ingredients'):
+        op.create_table('recipe_ingredients',
+            sa.Column('recipe_id', sa.Integer(), nullable=False),
+            sa.Column('ingredient_id', sa.Integer(), nullable=False),
+            sa.Column('amount_grams', sa.Integer(), nullable=False),
+            sa.ForeignKeyConstraint(['ingredient_id'], ['ingredient.id'], ondelete='CASCADE'),
+            sa.ForeignKeyConstraint(['recipe_id'], ['recipe.id'], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('recipe_id', 'ingredient_id')
+        )
+
+    if _missing('nutrient'):
+        op.create_table('nutrient',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('key', sa.String(length=32), nullable=False),
+            sa.Column('name', sa.String(length=64), nullable=False),
+            sa.Column('unit', sa.String(length=16), nullable=False),
+            sa.Column('position', sa.Integer(), nullable=False),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('key')
+        )
+
+    if _missing('ingredient_nutrient_values'):
+        op.create_table('ingredient_nutrient_values',
+            sa.Column('ingredient_id', sa.Integer(), nullable=False),
+            sa.Column('values', sa.JSON(), nullable=False),
+            sa.ForeignKeyConstraint(['ingredient_id'], ['ingredient.id'], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('ingredient_id')
+        )
+
+    if _missing('recipe_totals'):
+        op.create_table('recipe_totals',
+            sa.Column('recipe_id', sa.Integer(), nullable=False),
+            sa.Column('weight', sa.Float(), nullable=False),
+            sa.Column('calories', sa.Float(), nullable=False),
+            sa.Column('proteins', sa.Float(), nullable=False),
+            sa.Column('fats', sa.Float(), nullable=False),
+            sa.Column('carbs', sa.Float(), nullable=False),
+            sa.ForeignKeyConstraint(['recipe_id'], ['recipe.id'], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('recipe_id')
+        )
+        op.create_index('ix_recipe_totals_calories', 'recipe_totals', ['calories'])
+        op.create_index('ix_recipe_totals_proteins', 'recipe_totals', ['proteins'])
+
+    if _missing('calculation_job'):
+        op.create_table('calculation_job',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('user_id', sa.Integer(), nullable=False),
+            sa.Column('status', sa.String(length=20), nullable=False),
+            sa.Column('payload', sa.JSON(), nullable=False),
+            sa.Column('result', sa.JSON(), nullable=True),
+            sa.Column('error', sa.Text(), nullable=True),
+            sa.Column('attempts', sa.Integer(), nullable=False),
+            sa.Column('worker', sa.String(length=100), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.Column('started_at', sa.DateTime(), nullable=True),
+            sa.Column('finished_at', sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('ix_calculation_job_user_id', 'calculation_job', ['user_id'])
+        op.create_index('ix_calculation_job_pending', 'calculation_job', ['id'],
+                        postgresql_where=sa.text("status = 'pending'"))
+
+
+def downgrade():
+    for table in ('calculation_job', 'recipe_totals', 'ingredient_nutrient_values', 'nutrient',
+                  'recipe_ingredients', 'recipe', 'ingredient', 'user'):
+        op.drop_table(table)
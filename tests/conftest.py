@@ -0,0 +1,75 @@
+"""
+Общие фикстуры тестов
+
+Тесты с базой работают с отдельной тестовой базой PostgreSQL
+(TEST_DATABASE_URL, см. config.TestConfig): перед каждым тестом все таблицы
+удаляются и создаются заново. Если база недоступна, такие тесты пропускаются.
+"""
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import SQLAlchemyError
+from config import TestConfig
+
+
+@pytest.fixture(scope='session')
+def database_url():
+    """Адрес тестовой базы; тесты пропускаются, если к ней нельзя подключиться"""
+    url = make_url(TestConfig.SQLALCHEMY_DATABASE_URI)
+    if 'test' not in (url.database or ''):
+        pytest.fail(f'База «{url.database}» не похожа на тестовую, а тесты удаляют все '
+                    f'таблицы: задайте TEST_DATABASE_URL', pytrace=False)
+
+    engine = create_engine(url)
+    try:
+        with engine.connect():
+            pass
+    except (SQLAlchemyError, ImportError) as e:
+        pytest.skip(f'Тестовая база PostgreSQL недоступна: {e}')
+    finally:
+        engine.dispose()
+    return url
+
+
+@pytest.fixture
+def make_app(database_url):
+    """
+    Фабрика приложений на тестовой базе: make_app(**настройки) - приложение
+    с пустой схемой. Реплика отключена, если её не передали в настройках
+    (REPLICA_DATABASE_URL). Соединения закрываются после теста.
+    """
+    from app import create_app, db
+    apps = []
+
+    def make(**overrides):
+        config = type('Config', (TestConfig,), {'REPLICA_DATABASE_URL': None, **overrides})
+        app = create_app(config)
+        with app.app_context():
+            db.drop_all(bind_key=None)
+            db.create_all(bind_key=None)
+        apps.append(app)
+        return app
+
+    yield make
+
+    for app in apps:
+        with app.app_context():
+            db.session.remove()
+            for engine in db.engines.values():
+                engine.dispose()
+
+
+@pytest.fixture
+def app(make_app):
+    """Приложение на тестовой базе с пустой схемой"""
+    return make_app()
+
+
+@pytest.fixture
+def login(client):
+    """Вход через API: login(email, password); проверяет успех"""
+    def log_in(email, password):
+        response = client.post('/auth/api/login', json={'email': email, 'password': password})
+        assert response.json['success'], response.json
+        return client
+    return log_in
@@ -0,0 +1,32 @@
+def test_synthetic_catalog_is_reproducible():
+    """Тест что синтетический каталог повторяется при том же seed"""
+    import numpy as np
+    from benchmarks.bench_optimizer import make_ingredients, make_targets
+
+    first = make_ingredients(np.random.default_rng(1), 20)
+    second = make_ingredients(np.random.default_rng(1), 20)
+    assert [vars(a) for a in first] == [vars(b) for b in second]
+    assert all(ing.proteins + ing.fats + ing.carbs <= 100 for ing in first)
+
+    targets = make_targets(np.random.default_rng(1), 5)
+    assert all(400 <= t['calories'] <= 3000 for t in targets)
+
+def test_benchmark_regressions():
+    """Тест сравнения отчёта замеров с базовым"""
+    from benchmarks.bench_optimizer import compare
+
+    baseline = {'cases': {
+        'solve/auto/n=5': {'p50_ms': 10.0, 'peak_kb': 100.0, 'iterations': 4, 'failures': 0},
+        'match/recipes=10': {'p50_ms': 0.2, 'peak_kb': 8.0, 'iterations': None},
+    }}
+    same = {'cases': {
+        'solve/auto/n=5': {'p50_ms': 12.0, 'peak_kb': 110.0, 'iterations': 5, 'failures': 0},
+        'match/recipes=10': {'p50_ms': 0.9, 'peak_kb': 8.0, 'iterations': None},
+    }}
+    assert compare(same, baseline) == []
+
+    slower = {'cases': {
+        'solve/auto/n=5': {'p50_ms': 20.0, 'peak_kb': 200.0, 'iterations': 4, 'failures': 1},
+    }}
+    assert len(compare(slower, baseline)) == 3
+    assert compare(slower, baseline, max_slowdown=1.5, max_memory_growth=1.5) != []
@@ -0,0 +1,105 @@
+import io
+import pytest
+
+@pytest.fixture
+def admin_client(app, login):
+    """Администратор с одним ингредиентом и клиент, вошедший под ним"""
+    from app import db
+    from app.models import User, Ingredient
+
+    with app.app_context():
+        admin = User(username="admin", email="admin@test.com", is_admin=True)
+        admin.set_password("password")
+        db.session.add(admin)
+        db.session.flush()
+        db.session.add(Ingredient(name="Овсянка", calories=1, proteins=1, fats=1, carbs=1,
+                                  user_id=admin.id))
+        db.session.commit()
+
+    return login('admin@test.com', 'password')
+
+def _upload(client, kind, content, filename, **form):
+    return client.post(f'/admin/api/import/{kind}', content_type='multipart/form-data',
+                       data={'file': (io.BytesIO(content.encode()), filename), **form})
+
+def test_bulk_import(app, admin_client):
+    """Тест импорта ингредиентов (COPY) и рецептов с отчётом об ошибках строк"""
+    client = admin_client
+
+    response = _upload(client, 'ingredients', (
+        "name,calories,proteins,fats,carbs,is_public\n"
+        "овсянка,370,13,7,60,да\n"
+        "Мёд,300,0,0,80,\n"
+        "Битый,много,1,1,1,\n"
+        "Мёд,1,1,1,1,\n"
+    ), 'ingredients.csv', is_public='1')
+    report = response.json
+    assert report['success'] and report['inserted'] == 1 and report['updated'] == 1
+    assert [error['line'] for error in report['errors']] == [4, 5]
+
+    response = _upload(client, 'recipes', (
+        '{"name": "Каша", "instructions": "Варить", '
+        '"ingredients": [{"ingredient": "ОВСЯНКА", "amount": 60}, {"ingredient": "мёд", "amount": 10},'
+        ' {"ingredient": "Овсянка", "amount": 20}]}\n'
+        '{"name": "Пирог", "instructions": "Печь", "ingredients": [{"ingredient": "Мука", "amount": 10}]}\n'
+    ), 'recipes.jsonl')
+    report = response.json
+    assert report['success'] and report['inserted'] == 1 and report['errors_total'] == 1
+
+    with app.app_context():
+        from app.models import Ingredient, Recipe
+        oats = Ingredient.query.filter_by(name="Овсянка").one()
+        assert oats.calories == 370 and oats.is_public
+        recipe = Recipe.query.filter_by(name="Каша").one()
+        assert sorted(item.amount_grams for item in recipe.items) == [10, 80]
+        assert round(recipe.totals.calories, 1) == 326.0
+
+    # Повторный импорт заменяет состав рецепта
+    response = _upload(client, 'recipes', (
+        '{"name": "каша", "instructions": "Варить", '
+        '"ingredients": [{"ingredient": "Овсянка", "amount": 50}]}\n'
+    ), 'recipes.jsonl')
+    report = response.json
+    assert report['success'] and report['updated'] == 1 and report['errors_total'] == 0
+
+    # Строки подряд с одним названием, но другими полями - не один рецепт
+    response = _upload(client, 'recipes', (
+        "name,instructions,ingredient,amount\n"
+        "Салат,Резать,Овсянка,10\n"
+        "Салат,,Мёд,5\n"
+        "Салат,Смешать,Мёд,30\n"
+    ), 'recipes.csv')
+    report = response.json
+    assert report['success'] and report['inserted'] == 1
+    assert [error['line'] for error in report['errors']] == [4]
+
+    with app.app_context():
+        recipe = Recipe.query.filter_by(name="Каша").one()
+        assert [item.amount_grams for item in recipe.items] == [50]
+        assert round(recipe.totals.calories, 1) == 185.0
+        recipe = Recipe.query.filter_by(name="Салат").one()
+        assert sorted(item.amount_grams for item in recipe.items) == [5, 10]
+
+    # Файл без обязательных столбцов не импортируется
+    response = _upload(client, 'ingredients', "name,kcal\nСоль,0\n", 'bad.csv')
+    assert response.status_code == 400
+
+def test_bulk_export(admin_client):
+    """Тест потоковой выгрузки и повторного импорта выгруженного файла"""
+    client = admin_client
+
+    _upload(client, 'recipes', (
+        "name,instructions,ingredient,amount\n"
+        "Каша,Варить,Овсянка,50\n"
+    ), 'recipes.csv')
+
+    for kind in ('ingredients', 'recipes'):
+        for fmt in ('csv', 'jsonl'):
+            response = client.get(f'/admin/api/export/{kind}?format={fmt}')
+            assert response.status_code == 200 and response.is_streamed
+            exported = response.get_data(as_text=True)
+
+            # Выгруженный файл импортируется обратно без ошибок: те же записи обновляются
+            report = _upload(client, kind, exported, f'{kind}.{fmt}').json
+            assert report['success'] and report['errors_total'] == 0, report
+            assert report['inserted'] == 0 and report['updated'] == 1, report
@@ -1,49 +1,34 @@
 def test_calculate_optimal_diet_basic():
-    """Базовый тест функции расчёта"""
-    print("\nТестирование функции calculate_optimal_diet...")
-
-    try:
-        from app.calculation import calculate_optimal_diet
-
-        class SimpleIngredient:
-            def init(self, id, name, calories, proteins, fats, carbs):
-                self.id = id
-                self.name = name
-                self.calories = calories
-                self.proteins = proteins
-                self.fats = fats
-                self.carbs = carbs
-
-        ingredients = [
-            SimpleIngredient(1, "Белок", 100, 25, 1, 0),
-            SimpleIngredient(2, "Углеводы", 100, 2, 0, 25)
-        ]
-
-        targets = {
-            'calories': 500,
-            'proteins': 50,
-            'fats': 10,
-            'carbs': 50
-        }
-
-        result = calculate_optimal_diet(ingredients, targets)
-
-        assert isinstance(result, dict)
-        assert 'success' in result
-
-        if result['success']:
-            assert 'ingredients' in result
-            assert 'total_nutrition' in result
-            print("[OK] Функция расчёта возвращает корректную структуру при успехе")
-        else:
-            assert 'error' in result
-            print("[OK] Функция расчёта возвращает корректную структуру при ошибке")
-
-        return True
-
-    except Exception as e:
-        print(f"[ERROR] Ошибка функции расчёта: {e}")
-        return False
+    """Базовый тест функции расчёта: цели достижимы (по 200г каждого ингредиента)"""
+    from app.calculation import calculate_optimal_diet
+
+    class SimpleIngredient:
+        def __init__(self, id, name, calories, proteins, fats, carbs):
+            self.id = id
+            self.name = name
+            self.calories = calories
+            self.proteins = proteins
+            self.fats = fats
+            self.carbs = carbs
+
+    ingredients = [
+        SimpleIngredient(1, "Белок", 100, 25, 1, 0),
+        SimpleIngredient(2, "Углеводы", 100, 2, 0, 25)
+    ]
+
+    targets = {
+        'calories': 400,
+        'proteins': 54,
+        'fats': 2,
+        'carbs': 50
+    }
+
+    result = calculate_optimal_diet(ingredients, targets)
+
+    assert result['success'], result.get('error')
+    assert sorted(item['grams'] for item in result['ingredients'].values()) == [200, 200]
+    for key, target in targets.items():
+        assert abs(result['total_nutrition'][key] - target) <= 0.01 * target, key
 
 def test_calculate_edge_cases():
     """Тест граничных случаев расчёта"""
@@ -119,6 +104,461 @@ def test_find_best_recipes_simple():
         print(f"[ERROR] Ошибка поиска рецептов: {e}")
         return False
 
+def test_solvers_agree():
+    """Тест что быстрый и SLSQP методы дают одинаковый результат"""
+    print("\nСравнение методов расчёта...")
+
+    try:
+        from app.calculation import calculate_optimal_diet
+
+        class SimpleIngredient:
+            def __init__(self, id, calories, proteins, fats, carbs):
+                self.id = id
+                self.name = f"Ингредиент {id}"
+                self.calories = calories
+                self.proteins = proteins
+                self.fats = fats
+                self.carbs = carbs
+
+        ingredients = [
+            SimpleIngredient(1, 165, 31, 3.6, 0),
+            SimpleIngredient(2, 130, 2.7, 0.3, 28),
+            SimpleIngredient(3, 884, 0, 100, 0),
+            SimpleIngredient(4, 35, 2.8, 0.4, 7),
+        ]
+        targets = {'calories': 700, 'proteins': 50, 'fats': 20, 'carbs': 70}
+
+        fast = calculate_optimal_diet(ingredients, targets, solver='auto')
+        slow = calculate_optimal_diet(ingredients, targets, solver='slsqp')
+
+        assert fast['success'] and slow['success']
+        for key in targets:
+            assert abs(fast['total_nutrition'][key] - slow['total_nutrition'][key]) <= 5
+
+        bad = calculate_optimal_diet(ingredients, targets, solver='unknown')
+        assert bad['success'] == False
+
+        print("[OK] Методы расчёта согласованы")
+        return True
+
+    except Exception as e:
+        print(f"[ERROR] Ошибка сравнения методов: {e}")
+        return False
+
+def test_integer_portions():
+    """Тест целочисленного режима"""
+    print("\nТестирование целочисленного режима...")
+
+    try:
+        from app.calculation import calculate_optimal_diet
+
+        class SimpleIngredient:
+            def __init__(self, id, calories, proteins, fats, carbs):
+                self.id = id
+                self.name = f"Ингредиент {id}"
+                self.calories = calories
+                self.proteins = proteins
+                self.fats = fats
+                self.carbs = carbs
+
+        ingredients = [
+            SimpleIngredient(1, 165, 31, 3.6, 0),
+            SimpleIngredient(2, 130, 2.7, 0.3, 28),
+            SimpleIngredient(3, 884, 0, 100, 0),
+            SimpleIngredient(4, 35, 2.8, 0.4, 7),
+            SimpleIngredient(5, 52, 0.3, 0.2, 14),
+            SimpleIngredient(6, 155, 13, 11, 1.1),
+        ]
+        targets = {'calories': 700, 'proteins': 50, 'fats': 20, 'carbs': 70}
+
+        result = calculate_optimal_diet(ingredients, targets, solver='milp',
+                                        solver_options={'min_portion': 20, 'tolerance': 0.05})
+
+        assert result['success']
+        for data in result['ingredients'].values():
+            assert data['grams'] % 5 == 0
+            assert data['grams'] >= 20
+        for key in targets:
+            assert abs(result['deviations'][key]) <= 5.1
+
+        print("[OK] Целочисленный режим соблюдает порции и допуски")
+        return True
+
+    except Exception as e:
+        print(f"[ERROR] Ошибка целочисленного режима: {e}")
+        return False
+
+def test_integer_portions_keep_user_amounts():
+    """Тест что в целочисленном режиме ингредиент с количеством пользователя не выбрасывается"""
+    import numpy as np
+    from app.solvers import solve_milp, amount_bounds
+
+    # На 1г: ингредиент 1 сам даёт цели за 200г, ингредиенту 2 пользователь задал 100г
+    nutrients = np.array([[2.0, 0.5], [0.25, 0.0], [0.05, 0.0], [0.1, 0.0]])
+    target_vector = nutrients[:, 0] * 200
+    lower, upper = amount_bounds([0, 100], 2)
+
+    result = solve_milp(nutrients, target_vector, lower, upper, np.array([200.0, 100.0]))
+    assert result.success
+    assert result.x[0] > 0 and 50 <= result.x[1] <= 200
+
+    # Без количества пользователя ингредиент 2 только портит калории
+    lower, upper = amount_bounds(None, 2)
+    result = solve_milp(nutrients, target_vector, lower, upper, np.array([200.0, 100.0]))
+    assert result.success and result.x[1] == 0
+
+def test_integer_portions_fallback_tolerance(monkeypatch):
+    """Тест что округлённое решение после лимита времени проверяется на допуск"""
+    import numpy as np
+    from scipy.optimize import OptimizeResult
+    from app import solvers
+
+    # Лимит времени вышел, а допустимого решения HiGHS не нашёл
+    monkeypatch.setattr(solvers, 'milp', lambda *args, **kwargs: OptimizeResult(
+        x=None, status=1, success=False, message='Time limit reached'))
+
+    nutrients = np.array([[1.65, 1.3], [0.31, 0.027], [0.036, 0.003], [0.0, 0.28]])
+    lower, upper = solvers.amount_bounds(None, 2)
+    x0 = np.array([100.0, 100.0])
+
+    reachable = nutrients @ np.array([150.0, 200.0])
+    result = solvers.solve_milp(nutrients, reachable, lower, upper, x0, tolerance=0.05)
+    assert result.success and list(result.x) == [150, 200]
+
+    # Углеводов при таком белке не набрать: округлённое решение вне допуска
+    unreachable = np.array([500.0, 60.0, 5.0, 150.0])
+    result = solvers.solve_milp(nutrients, unreachable, lower, upper, x0, tolerance=0.05)
+    assert not result.success
+    assert '±5%' in result.message
+
+def test_batch_matches_single():
+    """Тест что пакетный расчёт совпадает с расчётом по одной цели"""
+    print("\nТестирование пакетного расчёта...")
+
+    try:
+        from app.calculation import calculate_optimal_diet, calculate_optimal_diet_batch
+
+        class SimpleIngredient:
+            def __init__(self, id, calories, proteins, fats, carbs):
+                self.id = id
+                self.name = f"Ингредиент {id}"
+                self.calories = calories
+                self.proteins = proteins
+                self.fats = fats
+                self.carbs = carbs
+
+        ingredients = [
+            SimpleIngredient(1, 165, 31, 3.6, 0),
+            SimpleIngredient(2, 130, 2.7, 0.3, 28),
+            SimpleIngredient(3, 884, 0, 100, 0),
+            SimpleIngredient(4, 35, 2.8, 0.4, 7),
+        ]
+        targets_list = [
+            {'calories': 2000, 'proteins': 120, 'fats': 60, 'carbs': 220},
+            {'calories': 300, 'proteins': 20, 'fats': 10, 'carbs': 30},
+            {'calories': 700, 'proteins': 50, 'fats': 20, 'carbs': 70},
+        ]
+
+        batch = calculate_optimal_diet_batch(ingredients, targets_list)
+        assert len(batch) == len(targets_list)
+
+        for targets, result in zip(targets_list, batch):
+            single = calculate_optimal_diet(ingredients, targets)
+            assert result['success'] == single['success']
+            assert result['target_nutrition'] == targets
+            for key in targets:
+                assert abs(result['total_nutrition'][key] - single['total_nutrition'][key]) <= 1
+
+        assert calculate_optimal_diet_batch(ingredients, []) == []
+
+        # Для SLSQP векторный метод не запускается: только одна задача на цель
+        from app.telemetry import solver_telemetry
+        solver_telemetry.clear()
+        batch = calculate_optimal_diet_batch(ingredients, targets_list, solver='slsqp')
+        assert all(result['success'] for result in batch)
+        assert [record['solver'] for record in solver_telemetry.recent()] == ['slsqp'] * len(targets_list)
+
+        print("[OK] Пакетный расчёт совпадает с одиночным")
+        return True
+
+    except Exception as e:
+        print(f"[ERROR] Ошибка пакетного расчёта: {e}")
+        return False
+
+def test_meal_plan():
+    """Тест плана питания на неделю"""
+    print("\nТестирование плана на неделю...")
+
+    try:
+        from app.meal_plan import plan_week
+
+        class SimpleIngredient:
+            def __init__(self, id, calories, proteins, fats, carbs):
+                self.id = id
+                self.name = f"Ингредиент {id}"
+                self.calories = calories
+                self.proteins = proteins
+                self.fats = fats
+                self.carbs = carbs
+
+        ingredients = [
+            SimpleIngredient(1, 165, 31, 3.6, 0),
+            SimpleIngredient(2, 130, 2.7, 0.3, 28),
+            SimpleIngredient(3, 884, 0, 100, 0),
+            SimpleIngredient(4, 35, 2.8, 0.4, 7),
+            SimpleIngredient(5, 155, 13, 11, 1.1),
+            SimpleIngredient(6, 343, 12.6, 3.3, 62),
+        ]
+        meal_targets = [
+            {'calories': 500, 'proteins': 30, 'fats': 15, 'carbs': 60},
+            {'calories': 800, 'proteins': 50, 'fats': 25, 'carbs': 90},
+        ]
+        day_targets = {'calories': 1300, 'proteins': 80, 'fats': 40, 'carbs': 150}
+
+        plan = plan_week(ingredients, meal_targets, day_targets)
+        assert plan['success']
+        assert len(plan['days']) == 7
+        assert all(len(day['meals']) == 2 for day in plan['days'])
+        for day in plan['days']:
+            assert abs(day['total_nutrition']['calories'] - 1300) < 1300 * 0.1
+
+        limited = plan_week(ingredients, meal_targets, days=3, max_weekly_uses=2)
+        assert limited['success']
+        assert len(limited['days']) == 3
+        assert max(limited['ingredient_uses'].values()) <= 2
+
+        assert not plan_week([], meal_targets)['success']
+        assert not plan_week(ingredients, [])['success']
+
+        print("[OK] План на неделю составляется")
+        return True
+
+    except Exception as e:
+        print(f"[ERROR] Ошибка плана на неделю: {e}")
+        return False
+
+def test_choose_ingredients():
+    """Тест автоматического подбора ингредиентов из каталога"""
+    print("\nТестирование автоподбора ингредиентов...")
+
+    try:
+        import time
+        import numpy as np
+        from app.calculation import choose_ingredients
+
+        rng = np.random.default_rng(0)
+        size = 10000
+        catalog_ids = list(range(1, size + 1))
+        catalog_rows = np.column_stack([
+            rng.uniform(20, 600, size), rng.uniform(0, 30, size),
+            rng.uniform(0, 40, size), rng.uniform(0, 70, size)
+        ]).tolist()
+        targets = {'calories': 2000, 'proteins': 120, 'fats': 65, 'carbs': 220}
+
+        start = time.perf_counter()
+        nutrients = np.array(catalog_rows).T / 100
+        chosen = choose_ingredients(catalog_ids, nutrients, targets, max_ingredients=5)
+        elapsed = time.perf_counter() - start
+
+        assert 0 < len(chosen) <= 5
+        assert elapsed < 0.5
+        totals = np.zeros(4)
+        for ingredient_id, grams in chosen:
+            totals += np.array(catalog_rows[ingredient_id - 1]) * grams / 100
+        for value, key in zip(totals, ('calories', 'proteins', 'fats', 'carbs')):
+            assert abs(value - targets[key]) <= targets[key] * 0.05
+
+        assert choose_ingredients([], np.zeros((4, 0)), targets) == []
+
+        print(f"[OK] Подобрано {len(chosen)} из {size} за {elapsed * 1000:.1f} мс")
+        return True
+
+    except Exception as e:
+        print(f"[ERROR] Ошибка автоподбора: {e}")
+        return False
+
+def test_warm_start_resolve():
+    """Тест пересчёта с тёплого старта и токена состояния"""
+    print("\nТестирование тёплого старта...")
+
+    try:
+        from app.calculation import calculate_optimal_diet
+        from app.diet_state import dump_state, load_state
+
+        class SimpleIngredient:
+            def __init__(self, id, calories, proteins, fats, carbs):
+                self.id = id
+                self.name = f"Ингредиент {id}"
+                self.calories = calories
+                self.proteins = proteins
+                self.fats = fats
+                self.carbs = carbs
+
+        ingredients = [
+            SimpleIngredient(1, 165, 31, 3.6, 0),
+            SimpleIngredient(2, 130, 2.7, 0.3, 28),
+            SimpleIngredient(3, 884, 0, 100, 0),
+            SimpleIngredient(4, 35, 2.8, 0.4, 7),
+        ]
+        targets = {'calories': 700, 'proteins': 50, 'fats': 20, 'carbs': 70}
+
+        first = calculate_optimal_diet(ingredients, targets)
+        assert first['success'] and first['solution']['dual'] is not None
+
+        token = dump_state('secret', 7, [1, 2, 3, 4], None, targets, 'auto', None,
+                           first['solution'])
+        state = load_state('secret', token, 7)
+        assert state['targets'] == targets
+        assert load_state('secret', token, 8) is None
+        assert load_state('other-secret', token, 7) is None
+
+        changed = dict(targets, calories=800)
+        warm = calculate_optimal_diet(ingredients, changed, warm_start=state['warm_start'])
+        cold = calculate_optimal_diet(ingredients, changed)
+        assert warm['success'] and cold['success']
+        for key in changed:
+            assert abs(warm['total_nutrition'][key] - cold['total_nutrition'][key]) <= 1
+
+        print("[OK] Тёплый старт даёт то же решение")
+        return True
+
+    except Exception as e:
+        print(f"[ERROR] Ошибка тёплого старта: {e}")
+        return False
+
+def test_extra_nutrients():
+    """Тест расчёта с дополнительным нутриентом (клетчатка)"""
+    print("\nТестирование дополнительных нутриентов...")
+
+    try:
+        from app.calculation import calculate_optimal_diet, target_keys
+
+        class SimpleIngredient:
+            def __init__(self, id, calories, proteins, fats, carbs, fiber):
+                self.id = id
+                self.name = f"Ингредиент {id}"
+                self.calories = calories
+                self.proteins = proteins
+                self.fats = fats
+                self.carbs = carbs
+                self.extra_nutrients = {'fiber': fiber}
+
+        ingredients = [
+            SimpleIngredient(1, 165, 31, 3.6, 0, 0),
+            SimpleIngredient(2, 130, 2.7, 0.3, 28, 0.4),
+            SimpleIngredient(3, 884, 0, 100, 0, 0),
+            SimpleIngredient(4, 35, 2.8, 0.4, 7, 2.6),
+        ]
+        targets = {'calories': 700, 'proteins': 50, 'fats': 20, 'carbs': 70, 'fiber': 10}
+        assert target_keys(targets)[4:] == ('fiber',)
+
+        result = calculate_optimal_diet(ingredients, targets)
+        assert result['success']
+        assert 'fiber' in result['total_nutrition']
+        assert abs(result['total_nutrition']['fiber'] - 10) < 3
+
+        without = calculate_optimal_diet(ingredients, dict(targets, fiber=0))
+        assert result['total_nutrition']['fiber'] > without['total_nutrition']['fiber']
+
+        print("[OK] Дополнительный нутриент учитывается в расчёте")
+        return True
+
+    except Exception as e:
+        print(f"[ERROR] Ошибка дополнительных нутриентов: {e}")
+        return False
+
+def test_solver_telemetry():
+    """Тест замеров оптимизатора"""
+    print("\nТестирование замеров оптимизатора...")
+
+    try:
+        from app.calculation import calculate_optimal_diet
+        from app.telemetry import solver_telemetry
+
+        class SimpleIngredient:
+            def __init__(self, id, calories, proteins, fats, carbs):
+                self.id = id
+                self.name = f"Ингредиент {id}"
+                self.calories = calories
+                self.proteins = proteins
+                self.fats = fats
+                self.carbs = carbs
+
+        ingredients = [
+            SimpleIngredient(1, 165, 31, 3.6, 0),
+            SimpleIngredient(2, 130, 2.7, 0.3, 28),
+            SimpleIngredient(3, 884, 0, 100, 0),
+        ]
+        solver_telemetry.clear()
+        solver_telemetry.configure(maxsize=3)
+
+        for calories in (500, 600, 700, 800):
+            calculate_optimal_diet(ingredients, {'calories': calories, 'proteins': 40,
+                                                 'fats': 20, 'carbs': 60}, solver='slsqp')
+
+        recent = solver_telemetry.recent()
+        assert len(recent) == 3 and solver_telemetry.total == 4
+        assert recent[0]['calories'] == 800 and recent[0]['ingredients'] == 3
+        assert recent[0]['iterations'] and recent[0]['evaluations']
+        assert recent[0]['residual'] is not None
+
+        summary = solver_telemetry.summary()
+        assert summary['kept'] == 3 and sum(g['count'] for g in summary['groups']) == 3
+        assert summary['groups'][0]['solver'] == 'slsqp'
+
+        solver_telemetry.configure(maxsize=1000)
+        print("[OK] Замеры оптимизатора сохраняются")
+        return True
+
+    except Exception as e:
+        print(f"[ERROR] Ошибка замеров оптимизатора: {e}")
+        return False
+
+def test_solution_cache():
+    """Тест кэша решений"""
+    print("\nТестирование кэша решений...")
+
+    try:
+        from app.calculation import calculate_optimal_diet
+        from app.cache import SolutionCache
+
+        class SimpleIngredient:
+            def __init__(self, id, calories, proteins, fats, carbs):
+                self.id = id
+                self.name = f"Ингредиент {id}"
+                self.calories = calories
+                self.proteins = proteins
+                self.fats = fats
+                self.carbs = carbs
+
+        ingredients = [
+            SimpleIngredient(1, 165, 31, 3.6, 0),
+            SimpleIngredient(2, 130, 2.7, 0.3, 28),
+        ]
+        targets = {'calories': 700, 'proteins': 50, 'fats': 20, 'carbs': 70}
+        cache = SolutionCache(maxsize=2, ttl=60)
+
+        first = calculate_optimal_diet(ingredients, targets, cache=cache)
+        second = calculate_optimal_diet(ingredients, dict(targets, calories=700.2), cache=cache)
+        assert cache.hits == 1 and cache.misses == 1
+        assert first['total_nutrition'] == second['total_nutrition']
+        assert second['target_nutrition']['calories'] == 700.2
+
+        cache.invalidate_ingredients([2])
+        assert cache.stats()['size'] == 0
+
+        for calories in (500, 600, 800):
+            calculate_optimal_diet(ingredients, dict(targets, calories=calories), cache=cache)
+        assert cache.stats()['size'] == 2
+        assert cache.evictions == 1
+
+        print("[OK] Кэш решений работает")
+        return True
+
+    except Exception as e:
+        print(f"[ERROR] Ошибка кэша решений: {e}")
+        return False
+
 def test_calculation_functions_exist():
     """Тест что функции существуют и вызываются"""
     print("\nПроверка существования функций...")
@@ -152,6 +592,15 @@ def run_all_calculation_tests():
     results.append(test_calculate_optimal_diet_basic())
     results.append(test_calculate_edge_cases())
     results.append(test_find_best_recipes_simple())
+    results.append(test_solvers_agree())
+    results.append(test_integer_portions())
+    results.append(test_batch_matches_single())
+    results.append(test_meal_plan())
+    results.append(test_choose_ingredients())
+    results.append(test_warm_start_resolve())
+    results.append(test_extra_nutrients())
+    results.append(test_solver_telemetry())
+    results.append(test_solution_cache())
     results.append(test_calculation_functions_exist())
 
     passed = sum([1 for r in results if r])
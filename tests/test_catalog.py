@@ -0,0 +1,79 @@
+def test_catalog_visibility(app):
+    """Тест что каталог содержит общие и свои ингредиенты, но не чужие личные"""
+    with app.app_context():
+        from app import db
+        from app.models import User, Ingredient, Nutrient
+        from app.catalog import nutrient_catalog
+
+        owner = User(username="owner", email="owner@test.com")
+        other = User(username="other", email="other@test.com")
+        db.session.add_all([owner, other])
+        db.session.flush()
+
+        public = Ingredient(name="Рис", calories=130, proteins=2.7, fats=0.3, carbs=28,
+                            user_id=other.id, is_public=True)
+        own = Ingredient(name="Курица", calories=165, proteins=31, fats=3.6, carbs=0,
+                         user_id=owner.id)
+        foreign = Ingredient(name="Масло", calories=884, proteins=0, fats=100, carbs=0,
+                             user_id=other.id)
+        db.session.add_all([public, own, foreign])
+        db.session.commit()
+        nutrient_catalog.clear()
+
+        catalog = nutrient_catalog.view(owner.id)
+        assert public.id in catalog and own.id in catalog
+        assert foreign.id not in catalog
+        assert catalog.nutrients.shape == (4, 2)
+        assert abs(catalog.nutrients[0, catalog.index[own.id]] - 1.65) < 1e-9
+
+        rows, amounts, nutrients = catalog.load_selected([
+            {'ingredient_id': own.id, 'amount': 150},
+            {'ingredient_id': foreign.id, 'amount': 50},
+        ])
+        assert [row.id for row in rows] == [own.id]
+        assert amounts == [150.0]
+        assert nutrients.shape == (4, 1)
+
+        db.session.add(Nutrient(key="fiber", name="Клетчатка"))
+        own.set_extra_nutrients({'fiber': 2.5})
+        db.session.commit()
+
+        catalog = nutrient_catalog.view(owner.id)
+        assert catalog.keys[4:] == ('fiber',)
+        fiber = catalog.matrix(('fiber',), catalog.columns([own.id, public.id]))
+        assert abs(fiber[0, 0] - 0.025) < 1e-9 and fiber[0, 1] == 0
+
+def test_catalog_invalidation(app):
+    """Тест что изменение ингредиента сбрасывает каталог"""
+    with app.app_context():
+        from app import db
+        from app.models import User, Ingredient
+        from app.catalog import nutrient_catalog
+
+        user = User(username="catalog", email="catalog@test.com")
+        db.session.add(user)
+        db.session.flush()
+
+        rice = Ingredient(name="Рис", calories=130, proteins=2.7, fats=0.3, carbs=28,
+                          user_id=user.id)
+        db.session.add(rice)
+        db.session.commit()
+        nutrient_catalog.clear()
+
+        before = nutrient_catalog.view(user.id)
+        assert len(before) == 1
+
+        rice.calories = 140
+        db.session.commit()
+        after = nutrient_catalog.view(user.id)
+        assert after is not before
+        assert after.rows[after.index[rice.id]].calories == 140
+
+        db.session.add(Ingredient(name="Гречка", calories=343, proteins=12.6, fats=3.3,
+                                  carbs=62, user_id=user.id))
+        db.session.commit()
+        assert len(nutrient_catalog.view(user.id)) == 2
+
+        db.session.delete(rice)
+        db.session.commit()
+        assert rice.id not in nutrient_catalog.view(user.id)
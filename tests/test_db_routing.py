@@ -0,0 +1,107 @@
+import pytest
+from config import TestConfig
+
+# Порт, на котором заведомо нет PostgreSQL: реплика недоступна
+UNAVAILABLE_REPLICA_URL = 'postgresql+psycopg2://postgres@127.0.0.1:1/none'
+
+@pytest.fixture
+def make_routing_app(make_app):
+    """Фабрика приложений с репликой TEST_REPLICA_DATABASE_URL - второй независимой
+    базой: make_routing_app(replica_schema, **настройки)"""
+    from app import db
+
+    def make(replica_schema=True, **overrides):
+        overrides.setdefault('REPLICA_DATABASE_URL', TestConfig.REPLICA_DATABASE_URL)
+        app = make_app(REPLICA_CHECK_INTERVAL=0, REPLICA_STICKY_SECONDS=30, **overrides)
+        if replica_schema:
+            with app.app_context():
+                db.metadata.drop_all(db.engines['replica'])
+                db.metadata.create_all(db.engines['replica'])
+        return app
+    return make
+
+def _seed(connection, ingredient_name):
+    """Пользователь и один его ингредиент напрямую в базе"""
+    from werkzeug.security import generate_password_hash
+    from app.models import User, Ingredient
+
+    connection.execute(User.__table__.insert(), {
+        'id': 1, 'username': 'cook', 'email': 'cook@test.com', 'is_admin': False,
+        'password_hash': generate_password_hash('password')
+    })
+    connection.execute(Ingredient.__table__.insert(), {
+        'name': ingredient_name, 'calories': 100, 'proteins': 10, 'fats': 5, 'carbs': 5,
+        'user_id': 1, 'is_public': False
+    })
+
+def _names(client):
+    response = client.get('/user/ingredients?limit=10')
+    return [ing['name'] for ing in response.json['ingredients']]
+
+def test_replica_reads(make_routing_app):
+    """Тест чтения списков с реплики и возврата на основную базу"""
+    if not TestConfig.REPLICA_DATABASE_URL:
+        pytest.skip('TEST_REPLICA_DATABASE_URL не задан')
+
+    app = make_routing_app()
+
+    with app.app_context():
+        from app import db
+        from app.db_routing import replica_monitor
+
+        with db.engines[None].begin() as connection:
+            _seed(connection, 'С основной базы')
+        with db.engines['replica'].begin() as connection:
+            _seed(connection, 'С реплики')
+
+        client = app.test_client()
+        response = client.post('/auth/api/login',
+                               json={'email': 'cook@test.com', 'password': 'password'})
+        assert response.json['success']
+
+        # Чтение - с реплики
+        assert _names(client) == ['С реплики']
+
+        # Отставание больше допустимого - с основной базы
+        replica_monitor.configure(max_lag=-1)
+        assert _names(client) == ['С основной базы']
+        replica_monitor.configure(max_lag=5)
+        assert _names(client) == ['С реплики']
+
+        # После своей записи пользователь читает с основной базы
+        response = client.post('/user/ingredients', json={
+            'name': 'Новый', 'calories': 1, 'proteins': 1, 'fats': 1, 'carbs': 1
+        })
+        assert response.json['success']
+        assert _names(client) == ['Новый', 'С основной базы']
+
+def test_unavailable_replica(make_routing_app):
+    """Тест что при недоступной реплике списки читаются с основной базы"""
+    app = make_routing_app(replica_schema=False, REPLICA_DATABASE_URL=UNAVAILABLE_REPLICA_URL)
+
+    with app.app_context():
+        from app import db
+        from app.db_routing import replica_monitor
+
+        with db.engines[None].begin() as connection:
+            _seed(connection, 'С основной базы')
+        client = app.test_client()
+        client.post('/auth/api/login', json={'email': 'cook@test.com', 'password': 'password'})
+        assert _names(client) == ['С основной базы']
+        assert replica_monitor.status(db.engines['replica'])['available'] is False
+
+def test_pool_profiles():
+    """Тест параметров пула из профиля конфигурации"""
+    from app.db_routing import engine_options
+    from config import Config
+
+    config = {'DB_POOL_PROFILES': Config.DB_POOL_PROFILES, 'DB_POOL_PROFILE': 'worker'}
+    options = engine_options(config, 'postgresql://localhost/db')
+    assert options == Config.DB_POOL_PROFILES['worker'] and options['pool_pre_ping']
+
+    # SQLite и конфигурация без профилей - параметры по умолчанию
+    assert engine_options(config, 'sqlite:///:memory:') == {}
+    assert engine_options({}, 'postgresql://localhost/db') == {}
+
+    with pytest.raises(ValueError):
+        engine_options({**config, 'DB_POOL_PROFILE': 'huge'}, 'postgresql://localhost/db')
@@ -0,0 +1,98 @@
+def create_user_with_ingredients():
+    """Пользователь и пара ингредиентов для расчёта"""
+    from app import db
+    from app.models import User, Ingredient
+
+    user = User(username="jobs", email="jobs@test.com")
+    user.set_password("secret123")
+    db.session.add(user)
+    db.session.flush()
+
+    chicken = Ingredient(name="Курица", calories=165, proteins=31, fats=3.6, carbs=0, user_id=user.id)
+    rice = Ingredient(name="Рис", calories=130, proteins=2.7, fats=0.3, carbs=28, user_id=user.id)
+    db.session.add_all([chicken, rice])
+    db.session.commit()
+
+    return user, [chicken, rice]
+
+def test_enqueue_and_process(app):
+    """Тест постановки задания в очередь и его выполнения"""
+    with app.app_context():
+        from app.jobs import enqueue_calculation, work
+
+        user, ingredients = create_user_with_ingredients()
+        job = enqueue_calculation(user.id, {
+            'targets': {'calories': 700, 'proteins': 50, 'fats': 10, 'carbs': 70},
+            'ingredients': [{'ingredient_id': ing.id, 'amount': 100} for ing in ingredients]
+        })
+        assert job.status == 'pending'
+
+        processed = work(once=True, worker_name='test')
+        assert processed == 1
+
+        job = job.query.get(job.id)
+        assert job.status == 'done'
+        assert job.result['success'] == True
+        assert 'best_recipes' in job.result
+
+def test_skip_locked_claim(app):
+    """Тест что заблокированное задание пропускается другим воркером"""
+    with app.app_context():
+        from app import db
+        from app.jobs import enqueue_calculation, claim_next_job
+
+        user, ingredients = create_user_with_ingredients()
+        payload = {
+            'targets': {'calories': 700, 'proteins': 50, 'fats': 10, 'carbs': 70},
+            'ingredients': [{'ingredient_id': ing.id} for ing in ingredients]
+        }
+        first = enqueue_calculation(user.id, payload)
+        second = enqueue_calculation(user.id, payload)
+
+        # Первое задание держит другой воркер в своей транзакции
+        connection = db.engine.connect()
+        transaction = connection.begin()
+        connection.execute(
+            db.text("SELECT id FROM calculation_job WHERE id = :id FOR UPDATE"),
+            {'id': first.id}
+        )
+
+        claimed = claim_next_job('test')
+        transaction.rollback()
+        connection.close()
+
+        assert claimed.id == second.id
+        assert claimed.status == 'running'
+
+def test_stale_job_by_heartbeat(app):
+    """Тест что зависшее задание ищется по отметке воркера, а не по времени старта"""
+    with app.app_context():
+        from datetime import datetime, timedelta
+        from app import db
+        from app.models import CalculationJob
+        from app.jobs import enqueue_calculation, claim_next_job, requeue_stale_jobs, process_job
+
+        user, ingredients = create_user_with_ingredients()
+        job = enqueue_calculation(user.id, {
+            'targets': {'calories': 700, 'proteins': 50, 'fats': 10, 'carbs': 70},
+            'ingredients': [{'ingredient_id': ing.id} for ing in ingredients]
+        })
+        job = claim_next_job('first')
+        job_id = job.id
+
+        # Долгое, но живое задание: старт давно, отметка свежая
+        CalculationJob.query.filter_by(id=job_id).update(
+            {'started_at': datetime.utcnow() - timedelta(hours=1)})
+        db.session.commit()
+        assert requeue_stale_jobs(600, 3) == (0, 0)
+
+        # Отметка устарела - задание возвращается в очередь
+        CalculationJob.query.filter_by(id=job_id).update(
+            {'heartbeat_at': datetime.utcnow() - timedelta(hours=1)})
+        db.session.commit()
+        assert requeue_stale_jobs(600, 3) == (1, 0)
+
+        # Первый воркер досчитал, но задание уже не его - статус не перезаписывается
+        assert process_job(job, 'first') == False
+        job = db.session.get(CalculationJob, job_id)
+        assert job.status == 'pending' and job.result is None
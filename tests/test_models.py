@@ -106,6 +106,35 @@ def test_user_password():
         print(f"[ERROR] Ошибка работы с паролями: {e}")
         return False
 
+def test_recipe_items():
+    """Тест состава рецепта через объект связи RecipeIngredient"""
+    print("\nТестирование состава рецепта...")
+
+    try:
+        from app.models import Ingredient, Recipe, RecipeIngredient
+
+        chicken = Ingredient(id=1, name="Курица", calories=165.0, proteins=31.0, fats=3.6, carbs=0.0)
+        rice = Ingredient(id=2, name="Рис", calories=130.0, proteins=2.7, fats=0.3, carbs=28.0)
+        recipe = Recipe(name="Курица с рисом", user_id=1)
+        recipe.items = [
+            RecipeIngredient(ingredient_id=1, ingredient=chicken, amount_grams=150.0),
+            RecipeIngredient(ingredient_id=2, ingredient=rice, amount_grams=100.0)
+        ]
+
+        assert recipe.get_ingredient_amount(2) == 100.0
+        assert recipe.get_ingredient_amount(3) == 0
+
+        nutrition = recipe.calculate_nutrition()
+        assert abs(nutrition['calories'] - 377.5) < 0.01
+        assert abs(nutrition['carbs'] - 28.0) < 0.01
+
+        print("[OK] Состав рецепта работает корректно")
+        return True
+
+    except Exception as e:
+        print(f"[ERROR] Ошибка состава рецепта: {e}")
+        return False
+
 def run_all_model_tests():
     """Запуск всех тестов моделей"""
     print("\n" + "="*50)
@@ -117,6 +146,7 @@ def run_all_model_tests():
     results.append(test_ingredient_model())
     results.append(test_recipe_model())
     results.append(test_user_password())
+    results.append(test_recipe_items())
 
     passed = sum([1 for r in results if r])
     total = len(results)
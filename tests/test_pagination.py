@@ -0,0 +1,184 @@
+def test_keyset_pages(app):
+    """Тест листания по курсору вперёд и назад (равные ключи, UNION ALL, релевантность)"""
+    with app.app_context():
+        from app import db
+        from app.models import User, Ingredient, Recipe, visible_query
+        from app.pagination import keyset_paginate, InvalidCursor
+
+        user = User(username="cook", email="cook@test.com")
+        other = User(username="other", email="other@test.com")
+        db.session.add_all([user, other])
+        db.session.flush()
+
+        # Калорийность повторяется - порядок внутри равных задаёт id
+        db.session.add_all([
+            Ingredient(name=f"Ингредиент {i}", calories=i % 4 * 10, proteins=1, fats=1, carbs=1,
+                       user_id=user.id if i % 3 else other.id, is_public=i % 2 == 0)
+            for i in range(23)
+        ])
+        db.session.commit()
+
+        def make_query():
+            return visible_query(Ingredient, user.id)
+
+        expected = [i.id for i in make_query().order_by(Ingredient.calories.desc(),
+                                                        Ingredient.id.desc())]
+        keys = (Ingredient.calories, Ingredient.id)
+
+        pages, cursor = [], None
+        while True:
+            page = keyset_paginate(make_query(), keys, cursor=cursor, per_page=5,
+                                   descending=True, sort='calories', count_key=('test',))
+            pages.append(page)
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        assert [i.id for page in pages for i in page.items] == expected
+        assert pages[0].total == len(expected) and not pages[0].total_estimated
+        assert not pages[0].has_prev
+
+        # Назад с последней страницы - те же страницы
+        page = pages[-1]
+        for previous in reversed(pages[:-1]):
+            page = keyset_paginate(make_query(), keys, cursor=page.prev_cursor, per_page=5,
+                                   descending=True, sort='calories')
+            assert [i.id for i in page.items] == [i.id for i in previous.items]
+        assert not page.has_prev and page.has_next
+
+        # Курсор другой сортировки не принимается
+        try:
+            keyset_paginate(make_query(), keys, cursor=pages[0].next_cursor, sort='name')
+            assert False, "курсор другой сортировки принят"
+        except InvalidCursor:
+            pass
+
+        # Сортировка по релевантности полнотекстового поиска
+        db.session.add_all([
+            Recipe(name=f"Суп {i}", description="суп " * (i % 3 + 1),
+                   instructions="Варить", user_id=user.id)
+            for i in range(9)
+        ])
+        db.session.commit()
+        criterion, rank, options = Recipe.text_search("суп")
+        expected = [r.id for r in visible_query(Recipe, user.id, criterion, options=options)
+                    .order_by(rank.desc(), Recipe.id.desc())]
+        found, cursor = [], None
+        while True:
+            page = keyset_paginate(visible_query(Recipe, user.id, criterion, options=options),
+                                   (rank, Recipe.id), cursor=cursor, per_page=2,
+                                   descending=True, sort='relevance')
+            found.extend(r.id for r in page.items)
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        assert found == expected and len(found) == 9
+
+def test_keyset_null_keys(app, login):
+    """Тест что рецепты без строки итогов (NULL в ключе сортировки) не пропадают"""
+    with app.app_context():
+        from app import db
+        from app.models import User, Recipe, RecipeTotals
+
+        user = User(username="cook", email="cook@test.com")
+        user.set_password("password")
+        db.session.add(user)
+        db.session.flush()
+        db.session.add_all([
+            Recipe(name=f"Рецепт {i}", instructions="Варить", user_id=user.id)
+            for i in range(7)
+        ])
+        db.session.commit()
+
+        # У части рецептов нет строки итогов: при внешнем соединении КБЖУ - NULL
+        ids = [recipe.id for recipe in Recipe.query.order_by(Recipe.id)]
+        RecipeTotals.query.filter(RecipeTotals.recipe_id.in_(ids[::2])).delete()
+        RecipeTotals.query.filter(RecipeTotals.recipe_id.in_(ids[1::2])).update({'calories': 100})
+        db.session.commit()
+
+    client = login('cook@test.com', 'password')
+
+    for sort_order in ('asc', 'desc'):
+        found, cursor = [], None
+        while True:
+            response = client.get('/user/recipes', query_string={
+                'sort_by': 'calories', 'sort_order': sort_order, 'limit': 2,
+                **({'cursor': cursor} if cursor else {})})
+            assert response.status_code == 200, response.json
+            found.extend(recipe['id'] for recipe in response.json['recipes'])
+            cursor = response.json['next_cursor']
+            if cursor is None:
+                break
+        assert sorted(found) == ids and len(found) == len(ids), (sort_order, found)
+
+def test_admin_keyset_null_keys(app, login):
+    """Тест что в админском списке рецепты без строки итогов не пропадают со страниц"""
+    import html
+    import re
+
+    with app.app_context():
+        from app import db
+        from app.models import User, Recipe, RecipeTotals
+
+        admin = User(username="admin", email="admin@test.com", is_admin=True)
+        admin.set_password("password")
+        db.session.add(admin)
+        db.session.flush()
+        db.session.add_all([
+            Recipe(name=f"Рецепт {i}", instructions="Варить", user_id=admin.id)
+            for i in range(25)
+        ])
+        db.session.commit()
+
+        ids = [recipe.id for recipe in Recipe.query.order_by(Recipe.id)]
+        RecipeTotals.query.filter(RecipeTotals.recipe_id.in_(ids[::2])).delete()
+        RecipeTotals.query.filter(RecipeTotals.recipe_id.in_(ids[1::2])).update(
+            {'calories': 100, 'proteins': 10, 'fats': 5, 'carbs': 10, 'weight': 200})
+        db.session.commit()
+
+    client = login('admin@test.com', 'password')
+
+    for sort_by in ('calories', 'proteins', 'fats', 'carbs', 'weight'):
+        for sort_order in ('asc', 'desc'):
+            found, url = [], f'/admin/recipes?sort_by={sort_by}&sort_order={sort_order}'
+            while url:
+                response = client.get(url)
+                assert response.status_code == 200
+                page = response.get_data(as_text=True)
+                found.extend(int(i) for i in re.findall(
+                    r'data-action="toggle-public"\s+data-type="recipe"\s+data-id="(\d+)"', page))
+                next_link = re.search(r'<a href="([^"]+)"\s+class="btn btn-outline">\s*'
+                                      r'<i class="bi bi-chevron-right">', page)
+                url = html.unescape(next_link.group(1)) if next_link else None
+            assert sorted(found) == ids and len(found) == len(ids), (sort_by, sort_order, found)
+
+def test_list_counts_estimate(app):
+    """Тест оценки числа записей планировщиком вместо COUNT(*)"""
+    with app.app_context():
+        from app import db
+        from app.models import User, Ingredient
+        from app.pagination import ListCounts
+
+        user = User(username="cook", email="cook@test.com")
+        db.session.add(user)
+        db.session.flush()
+        db.session.add_all([
+            Ingredient(name=f"Ингредиент {i}", calories=10, proteins=1, fats=1, carbs=1,
+                       user_id=user.id)
+            for i in range(50)
+        ])
+        db.session.commit()
+        db.session.execute(db.text('ANALYZE ingredient'))
+
+        query = Ingredient.query.filter(Ingredient.user_id == user.id)
+        assert ListCounts(exact_limit=1000).count(query, 'exact') == (50, False)
+
+        total, estimated = ListCounts(exact_limit=0).count(query, 'estimate')
+        assert estimated and 0 < total <= 100
+
+        # Число берётся из кэша до истечения времени жизни
+        counts = ListCounts(ttl=60)
+        counts.count(query, 'key')
+        db.session.add(Ingredient(name="Ещё", calories=1, proteins=1, fats=1, carbs=1,
+                                  user_id=user.id))
+        db.session.flush()
+        assert counts.count(query, 'key') == (50, False)
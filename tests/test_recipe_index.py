@@ -0,0 +1,184 @@
+def test_recipe_index_candidates(app):
+    """Тест что индекс отдаёт только видимые рецепты с общими ингредиентами"""
+    with app.app_context():
+        from app import db
+        from app.models import User, Ingredient, Recipe, recipe_ingredients
+        from app.recipe_index import recipe_index
+
+        owner = User(username="owner", email="owner@test.com")
+        other = User(username="other", email="other@test.com")
+        db.session.add_all([owner, other])
+        db.session.flush()
+
+        rice = Ingredient(name="Рис", calories=130, proteins=2.7, fats=0.3, carbs=28,
+                          user_id=owner.id, is_public=True)
+        apple = Ingredient(name="Яблоко", calories=52, proteins=0.3, fats=0.2, carbs=14,
+                           user_id=owner.id, is_public=True)
+        db.session.add_all([rice, apple])
+        db.session.flush()
+
+        public = Recipe(name="Плов", instructions="...", user_id=other.id, is_public=True)
+        own = Recipe(name="Рис с яблоком", instructions="...", user_id=owner.id)
+        foreign = Recipe(name="Чужой рис", instructions="...", user_id=other.id)
+        fruit = Recipe(name="Яблоки", instructions="...", user_id=owner.id)
+        db.session.add_all([public, own, foreign, fruit])
+        db.session.flush()
+
+        db.session.execute(recipe_ingredients.insert(), [
+            {'recipe_id': public.id, 'ingredient_id': rice.id, 'amount_grams': 200},
+            {'recipe_id': own.id, 'ingredient_id': rice.id, 'amount_grams': 100},
+            {'recipe_id': own.id, 'ingredient_id': apple.id, 'amount_grams': 50},
+            {'recipe_id': foreign.id, 'ingredient_id': rice.id, 'amount_grams': 100},
+            {'recipe_id': fruit.id, 'ingredient_id': apple.id, 'amount_grams': 300},
+        ])
+        db.session.commit()
+        recipe_index.clear()
+
+        found = recipe_index.candidates(owner.id, [rice.id])
+        assert set(found) == {public.id, own.id}
+        assert sorted(found[own.id]) == sorted([(rice.id, 100), (apple.id, 50)])
+
+        # Изменение рецепта сбрасывает индекс после коммита
+        db.session.execute(recipe_ingredients.insert().values(
+            recipe_id=fruit.id, ingredient_id=rice.id, amount_grams=10))
+        fruit.name = "Яблоки с рисом"
+        db.session.commit()
+        assert fruit.id in recipe_index.candidates(owner.id, [rice.id])
+
+        db.session.delete(public)
+        db.session.commit()
+        assert public.id not in recipe_index.candidates(owner.id, [rice.id])
+
+def test_best_recipes_recheck_visibility(app):
+    """Тест что рецепт, скрытый в другом процессе, не отдаётся из старого блока индекса"""
+    with app.app_context():
+        from app import db
+        from app.models import User, Ingredient, Recipe, recipe_ingredients
+        from app.catalog import nutrient_catalog
+        from app.recipe_index import recipe_index
+
+        owner = User(username="owner", email="owner@test.com")
+        other = User(username="other", email="other@test.com")
+        db.session.add_all([owner, other])
+        db.session.flush()
+
+        rice = Ingredient(name="Рис", calories=130, proteins=2.7, fats=0.3, carbs=28,
+                          user_id=owner.id, is_public=True)
+        db.session.add(rice)
+        db.session.flush()
+
+        hidden = Recipe(name="Плов", instructions="...", user_id=other.id, is_public=True)
+        shown = Recipe(name="Рисовая каша", instructions="...", user_id=other.id, is_public=True)
+        db.session.add_all([hidden, shown])
+        db.session.flush()
+        db.session.execute(recipe_ingredients.insert(), [
+            {'recipe_id': hidden.id, 'ingredient_id': rice.id, 'amount_grams': 200},
+            {'recipe_id': shown.id, 'ingredient_id': rice.id, 'amount_grams': 150},
+        ])
+        db.session.commit()
+        recipe_index.clear()
+
+        catalog = nutrient_catalog.view(owner.id)
+        optimal = {rice.id: {'grams': 200.0}}
+        found = recipe_index.best_recipes(owner.id, optimal, catalog)
+        assert [r['recipe'].id for r in found] == [hidden.id, shown.id]
+
+        # Другой процесс делает рецепт личным: событий в этом процессе нет,
+        # блок общих рецептов остаётся прежним
+        db.session.execute(Recipe.__table__.update().where(Recipe.id == hidden.id)
+                           .values(is_public=False))
+        db.session.commit()
+        db.session.expire_all()
+
+        found = recipe_index.best_recipes(owner.id, optimal, catalog)
+        assert [r['recipe'].id for r in found] == [shown.id]
+        assert [r['recipe'].id for r in recipe_index.best_recipes(other.id, optimal, catalog)] == \
+            [hidden.id, shown.id]
+
+def test_sparse_ranking_matches_find_best_recipes():
+    """Тест что оценка по матрице индекса совпадает с find_best_recipes"""
+    from collections import namedtuple
+    import numpy as np
+    from app.calculation import find_best_recipes
+    from app.recipe_index import RecipeIndexBlock
+
+    SimpleRecipe = namedtuple('SimpleRecipe', ['id'])
+
+    class Catalog:
+        keys = ('calories', 'proteins', 'fats', 'carbs')
+        nutrients = np.ones((4, 30))
+        def __contains__(self, ingredient_id):
+            return True
+        def columns(self, ids):
+            return [i - 1 for i in ids]
+
+    rng = np.random.default_rng(3)
+    amounts = {}
+    for recipe_id in range(1, 201):
+        ids = rng.choice(np.arange(1, 31), size=rng.integers(2, 7), replace=False)
+        grams = rng.integers(1, 40, len(ids)) * 5
+        amounts[recipe_id] = [(int(i), float(g)) for i, g in zip(ids, grams)]
+    optimal = {i: {'grams': float(g)} for i, g in zip((2, 5, 7, 11, 13), (120, 80, 35, 200, 10))}
+
+    block = RecipeIndexBlock((r, i, g) for r, items in amounts.items() for i, g in items)
+    ranked = block.rank({i: d['grams'] for i, d in optimal.items()}, top_n=5)
+    expected = find_best_recipes(optimal, [SimpleRecipe(r) for r in amounts], top_n=5,
+                                 catalog=Catalog(), recipe_amounts=amounts)
+
+    assert [int(block.recipe_ids[row]) for _, row, *_ in ranked] == \
+        [r['recipe'].id for r in expected]
+    assert [score for score, *_ in ranked] == [r['score'] for r in expected]
+    assert block.rank({99: 100.0}) == []
+
+    # Повторный подбор с тем же рационом берётся из памяти блока
+    assert block.rank({i: d['grams'] for i, d in optimal.items()}, top_n=5) is ranked
+
+def test_sql_engine_matches_index(app):
+    """Тест что подбор рецептов одним запросом совпадает с индексом"""
+    with app.app_context():
+        import numpy as np
+        from app import db
+        from app.models import User, Ingredient, Recipe, recipe_ingredients
+        from app.catalog import nutrient_catalog
+        from app.recipe_index import recipe_index
+        from app.recipe_match import best_recipes
+
+        owner = User(username="owner", email="owner@test.com")
+        other = User(username="other", email="other@test.com")
+        db.session.add_all([owner, other])
+        db.session.flush()
+
+        rng = np.random.default_rng(5)
+        ingredients = [Ingredient(name=f"Ингредиент {i}", calories=100 + i, proteins=10,
+                                  fats=5, carbs=10, user_id=owner.id, is_public=True)
+                       for i in range(20)]
+        db.session.add_all(ingredients)
+        recipes = [Recipe(name=f"Рецепт {i}", instructions="...",
+                          user_id=(owner.id, other.id)[i % 2], is_public=i % 3 == 0)
+                   for i in range(150)]
+        db.session.add_all(recipes)
+        db.session.flush()
+
+        links = []
+        for recipe in recipes:
+            for i in rng.choice(20, size=rng.integers(1, 6), replace=False):
+                links.append({'recipe_id': recipe.id, 'ingredient_id': ingredients[i].id,
+                              'amount_grams': int(rng.integers(1, 40)) * 10})
+        db.session.execute(recipe_ingredients.insert(), links)
+        db.session.commit()
+        recipe_index.clear()
+
+        catalog = nutrient_catalog.view(owner.id)
+        for _ in range(5):
+            chosen = rng.choice(20, size=4, replace=False)
+            optimal = {ingredients[i].id: {'grams': float(rng.integers(1, 50)) * 5}
+                       for i in chosen}
+            expected = best_recipes(owner.id, optimal, catalog, top_n=5, engine='index')
+            found = best_recipes(owner.id, optimal, catalog, top_n=5, engine='sql')
+
+            assert [r['recipe'].id for r in found] == [r['recipe'].id for r in expected]
+            for a, b in zip(found, expected):
+                assert {k: v for k, v in a.items() if k != 'recipe'} == \
+                    {k: v for k, v in b.items() if k != 'recipe'}
+
+        assert best_recipes(owner.id, {}, catalog, engine='sql') == []
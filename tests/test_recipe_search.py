@@ -0,0 +1,38 @@
+def test_nearest_matches_brute_force():
+    """Тест что поиск по дереву с заплатками совпадает с перебором"""
+    import numpy as np
+    from app.recipe_search import MacroSearchBlock, MACRO_SCALE
+
+    rng = np.random.default_rng(7)
+    recipes = {recipe_id: tuple(rng.uniform(0, [900, 60, 40, 120]))
+               for recipe_id in range(1, 301)}
+
+    def brute(target, dims, k):
+        ids = sorted(recipes)
+        vectors = np.array([recipes[i] for i in ids]) * MACRO_SCALE
+        distances = np.linalg.norm(vectors[:, dims] - target, axis=1)
+        return [ids[i] for i in np.lexsort((ids, distances))[:k]]
+
+    block = MacroSearchBlock((recipe_id, *vector) for recipe_id, vector in recipes.items())
+    target = np.array([600, 40 * 4])
+    assert [i for _, i in block.nearest(target, (0, 1), 5)] == brute(target, (0, 1), 5)
+
+    # Изменение, удаление и новый рецепт - заплаткой, без перестройки
+    changes = {5: (600, 40, 10, 50), 17: None, 1000: (590, 41, 0, 0)}
+    for recipe_id, vector in changes.items():
+        if vector is None:
+            recipes.pop(recipe_id)
+        else:
+            recipes[recipe_id] = vector
+    patched = block.patched(changes)
+    assert patched.ids is block.ids and len(patched.added) == 2
+    assert len(patched) == len(recipes)
+    assert [i for _, i in patched.nearest(target, (0, 1), 5)] == brute(target, (0, 1), 5)
+
+    # Много изменений - блок перестраивается
+    changes = {recipe_id: (100 + recipe_id, 5, 5, 5) for recipe_id in range(1, 101)}
+    recipes.update(changes)
+    rebuilt = patched.patched(changes)
+    assert not rebuilt.added and not rebuilt.removed
+    target = np.array([100, 5 * 9])
+    assert [i for _, i in rebuilt.nearest(target, (0, 2), 7)] == brute(target, (0, 2), 7)
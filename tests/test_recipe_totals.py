@@ -0,0 +1,136 @@
+def test_recipe_totals_refresh(app):
+    """Тест пересчёта итогов КБЖУ рецепта и фильтра по ним"""
+    with app.app_context(), app.test_request_context('/?min_calories=300&max_proteins=60'):
+        from flask import request
+        from app import db
+        from app.models import (User, Ingredient, Recipe, RecipeTotals, recipe_ingredients,
+                                visible_query)
+
+        user = User(username="cook", email="cook@test.com")
+        db.session.add(user)
+        db.session.flush()
+
+        chicken = Ingredient(name="Курица", calories=165, proteins=31, fats=3.6, carbs=0,
+                             user_id=user.id, is_public=True)
+        rice = Ingredient(name="Рис", calories=130, proteins=2.7, fats=0.3, carbs=28,
+                          user_id=user.id, is_public=True)
+        db.session.add_all([chicken, rice])
+        db.session.flush()
+
+        pilaf = Recipe(name="Плов", instructions="...", user_id=user.id)
+        porridge = Recipe(name="Каша", instructions="...", user_id=user.id)
+        empty = Recipe(name="Пусто", instructions="...", user_id=user.id)
+        db.session.add_all([pilaf, porridge, empty])
+        db.session.flush()
+
+        db.session.execute(recipe_ingredients.insert(), [
+            {'recipe_id': pilaf.id, 'ingredient_id': chicken.id, 'amount_grams': 150},
+            {'recipe_id': pilaf.id, 'ingredient_id': rice.id, 'amount_grams': 100},
+            {'recipe_id': porridge.id, 'ingredient_id': rice.id, 'amount_grams': 200},
+        ])
+        RecipeTotals.refresh_missing()
+        db.session.commit()
+
+        totals = db.session.get(RecipeTotals, pilaf.id)
+        assert totals.weight == 250
+        assert totals.to_dict() == db.session.get(Recipe, pilaf.id).calculate_nutrition()
+        assert db.session.get(RecipeTotals, empty.id).calories == 0
+
+        # Состав карточек списка одним запросом: первыми - тяжёлые ингредиенты
+        summaries = Recipe.summaries([pilaf.id, empty.id], names=1)
+        assert summaries[pilaf.id].ingredient_count == 2
+        assert summaries[pilaf.id].ingredient_names == ["Курица"]
+        assert summaries[empty.id].ingredient_count == 0
+
+        # Изменение ингредиента пересчитывает рецепты, где он есть
+        rice.calories = 200
+        RecipeTotals.refresh(ingredient_ids=[rice.id])
+        db.session.commit()
+        assert abs(db.session.get(RecipeTotals, porridge.id).calories - 400) < 1e-6
+        assert abs(db.session.get(RecipeTotals, pilaf.id).calories - 447.5) < 1e-6
+
+        query, ranges = RecipeTotals.filter_query(Recipe.query, request.args)
+        assert ranges == {'min_calories': 300.0, 'max_proteins': 60.0}
+        assert {r.name for r in query} == {"Плов", "Каша"}
+
+        # То же по видимым пользователю рецептам (UNION ALL общих и своих)
+        other = User(username="other", email="other@test.com")
+        db.session.add(other)
+        db.session.flush()
+        db.session.add_all([
+            Recipe(name="Чужой", instructions="...", user_id=other.id),
+            Recipe(name="Общий", instructions="...", user_id=other.id, is_public=True)
+        ])
+        db.session.commit()
+        visible = visible_query(Recipe, user.id).options(Recipe.with_items())
+        assert {r.name for r in visible} == {"Плов", "Каша", "Пусто", "Общий"}
+        query, _ = RecipeTotals.filter_query(visible, request.args)
+        page = query.order_by(RecipeTotals.calories.desc()).paginate(page=1, per_page=1)
+        assert [r.name for r in page.items] == ["Плов"] and page.total == 2
+
+def test_recipe_fulltext_search(app):
+    """Тест полнотекстового поиска рецептов (ранжирование и фрагменты)"""
+    with app.app_context():
+        from app import db
+        from app.models import User, Recipe, visible_query
+
+        user = User(username="cook", email="cook@test.com")
+        db.session.add(user)
+        db.session.flush()
+
+        soup = Recipe(name="Куриный суп", description="Лёгкий суп",
+                      instructions="Сварить курицу, добавить <морковь>", user_id=user.id)
+        salad = Recipe(name="Салат", description="Салат с курицей",
+                       instructions="Нарезать овощи", user_id=user.id, is_public=True)
+        cake = Recipe(name="Торт", instructions="Испечь коржи", user_id=user.id)
+        db.session.add_all([soup, salad, cake])
+        db.session.commit()
+
+        # Вектор заполнен триггером, слово ищется в любой форме;
+        # совпадение в описании весит больше, чем в инструкциях
+        criterion, rank, options = Recipe.text_search("курица")
+        found = visible_query(Recipe, user.id, criterion, options=options) \
+            .order_by(rank.desc(), Recipe.id.desc()).all()
+        assert [r.name for r in found] == ["Салат", "Куриный суп"]
+
+        # Изменение инструкций обновляет вектор
+        cake.instructions = "Испечь коржи, украсить курицей"
+        db.session.commit()
+        criterion, _, _ = Recipe.text_search("курица -суп")
+        assert {r.name for r in Recipe.query.filter(criterion)} == {"Салат", "Торт"}
+
+        snippets = Recipe.snippets([soup.id, salad.id], "курица")
+        assert '<mark>курицу</mark>' in snippets[soup.id]
+        assert '&lt;морковь' in snippets[soup.id] and '<морковь' not in snippets[soup.id]
+
+def test_recipe_write_amounts(app):
+    """Тест записи состава рецепта разницей с текущим"""
+    with app.app_context():
+        from app import db
+        from app.models import User, Ingredient, Recipe, RecipeIngredient, recipe_ingredients
+
+        user = User(username="cook", email="cook@test.com")
+        db.session.add(user)
+        db.session.flush()
+        ingredients = [Ingredient(name=f"Ингредиент {i}", calories=100, proteins=1, fats=1,
+                                  carbs=1, user_id=user.id) for i in range(4)]
+        recipe = Recipe(name="Салат", instructions="Смешать", user_id=user.id)
+        db.session.add_all(ingredients + [recipe])
+        db.session.flush()
+        a, b, c, d = [ing.id for ing in ingredients]
+
+        assert Ingredient.existing_ids([a, b, 10**6]) == {a, b}
+        assert RecipeIngredient.write_amounts(recipe, {a: 100, b: 50, c: 30}) == 3
+        db.session.commit()
+
+        # Одна изменённая, одна убранная, одна добавленная строка
+        assert RecipeIngredient.write_amounts(recipe, {a: 100, b: 80, d: 20}) == 3
+        # Тот же состав - ни одного запроса на запись
+        assert RecipeIngredient.write_amounts(recipe, {a: 100, b: 80, d: 20}) == 0
+        db.session.commit()
+
+        rows = db.session.execute(
+            db.select(recipe_ingredients.c.ingredient_id, recipe_ingredients.c.amount_grams)
+            .where(recipe_ingredients.c.recipe_id == recipe.id)
+        ).all()
+        assert dict(rows) == {a: 100, b: 80, d: 20}
@@ -0,0 +1,20 @@
+import argparse
+from app import create_app
+from app.jobs import work
+from config import Config
+
+app = create_app(Config)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Воркер фоновых расчётов рациона')
+    parser.add_argument('--poll-interval', type=float, default=1.0,
+                        help='пауза при пустой очереди, с')
+    parser.add_argument('--once', action='store_true',
+                        help='выйти, когда очередь опустеет')
+    parser.add_argument('--name', default=None,
+                        help='имя воркера (по умолчанию host:pid)')
+    args = parser.parse_args()
+
+    with app.app_context():
+        processed = work(poll_interval=args.poll_interval, once=args.once, worker_name=args.name)
+        print(f'Обработано заданий: {processed}')